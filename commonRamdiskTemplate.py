@@ -4,11 +4,16 @@ Template for the ramdisk classes
 @author: Roy Nielsen
 """
 #--- Native python libraries
+import os
 from tempfile import mkdtemp
 
 #--- non-native python libraries in this source tree
 from lib.loggers import LogPriority as lp
 from lib.loggers import CyLogger
+from lib.ramdisk_arena import RamdiskArena
+from lib.ramdisk_watchdog import RamdiskWatchdog
+from lib.ramdisk_wipe import WipeEngine
+from lib.environ_overlay import tempEnviron
 
 ###########################################################################
 
@@ -55,6 +60,8 @@ class RamDiskTemplate(object):
         self.diskSize = size
         self.success = False
         self.myRamdiskDev = None
+        self.arena = None
+        self.watchdog = None
         if not mountpoint:
             self.getRandomizedMountpoint()
         else:
@@ -225,6 +232,96 @@ class RamDiskTemplate(object):
         """
         return self.module_version
 
+    ###########################################################################
+
+    def getArena(self, name="arena"):
+        """
+        Getter for a shared memory arena kept in a directory on the ramdisk.
+
+        Regions allocated from the arena are files on the ramdisk mapped
+        with mmap, so cooperating processes can share large buffers without
+        copying them.  The arena is created the first time it is asked for.
+
+        @param: name - directory, relative to the mount point, to keep the
+                       arena in.
+        """
+        if self.arena is None:
+            self.arena = RamdiskArena(os.path.join(str(self.mntPoint), name),
+                                      self.logger,
+                                      gate=self.allocationsAllowed)
+        return self.arena
+
+    ###########################################################################
+
+    def wipe(self, workers=8):
+        """
+        Remove everything on the ramdisk, leaving it mounted.
+
+        Any arena on the ramdisk is closed first, as its files go too.
+
+        @param: workers - number of threads doing the unlinking
+
+        @returns: dictionary of counts and timings, see WipeEngine.wipe
+        """
+        if self.arena is not None:
+            self.arena.close()
+            self.arena = None
+        return WipeEngine(str(self.mntPoint), self.logger, workers).wipe()
+
+    ###########################################################################
+
+    def tempEnviron(self, base=None, xdgCache=False):
+        """
+        Context manager giving an environment that sends a command's
+        temporary files to a new directory on the ramdisk, removed on the
+        way out.  The ramdisk must be mounted.
+
+        with ramdisk.tempEnviron() as env:
+            runner.run(command, env=env)
+
+        @param: base - environment to add TMPDIR, TMP and TEMP to,
+                       os.environ if None
+        @param: xdgCache - point XDG_CACHE_HOME at the directory too
+        """
+        return tempEnviron(self.mntPoint, base, xdgCache)
+
+    ###########################################################################
+
+    def allocationsAllowed(self):
+        """
+        Whether new arena allocations are allowed - False while a watchdog
+        with refuse set finds the ramdisk under memory pressure.
+        """
+        return self.watchdog is None or self.watchdog.allocationsAllowed
+
+    ###########################################################################
+
+    def startWatchdog(self, **kwargs):
+        """
+        Start a health watchdog thread for this ramdisk.
+
+        Keyword arguments are passed on to RamdiskWatchdog.  If the ramdisk
+        has a resize method, it is used to shrink the ramdisk when shrink
+        is set.
+
+        @returns: the RamdiskWatchdog
+        """
+        self.stopWatchdog()
+        kwargs.setdefault("resize", getattr(self, "resize", None))
+        self.watchdog = RamdiskWatchdog(self.mntPoint, self.logger, **kwargs)
+        self.watchdog.start()
+        return self.watchdog
+
+    ###########################################################################
+
+    def stopWatchdog(self):
+        """
+        Stop the health watchdog, if one is running.
+        """
+        if self.watchdog is not None:
+            self.watchdog.stop()
+            self.watchdog = None
+
 ###############################################################################
 
 
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+"""
+Measure what a CyLogger.log call costs, when the logger's level drops the
+message and when it is written out.
+
+A dropped message should cost a priority lookup and a level check, well
+under a microsecond, however deep the stack it is logged from.  A written
+one pays for the caller lookup, the timestamp and the handlers as well,
+unless the logs are written from a background thread, with -a.  -w adds a
+handler taking that many milliseconds a record, to see what a slow disk or
+syslog does to the caller.
+
+Example:
+    python benchmark_logging.py -n 200000 -d 30
+    python benchmark_logging.py -a -w 1
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import sys
+import time
+import logging
+from optparse import OptionParser
+sys.path.append("../..")
+#--- non-native python libraries in this source tree
+from ramdisk.lib.loggers import CyLogger
+from ramdisk.lib.loggers import LogPriority as lp
+from ramdisk.lib.log_queue import OverflowPolicy
+
+parser = OptionParser(usage="\n\n%prog [options]\n\n")
+parser.add_option("-n", "--count", dest="count", default="200000",
+                  help="Calls to time for each case")
+parser.add_option("-d", "--depth", dest="depth", default="30",
+                  help="Frames on the stack under the logging call")
+parser.add_option("-a", "--asynchronous", dest="asynchronous",
+                  action="store_true", default=False,
+                  help="Write the logs from a background thread")
+parser.add_option("-o", "--overflow", dest="overflow",
+                  default=OverflowPolicy.DROP_OLDEST,
+                  help="Overflow policy with -a: " +
+                       ", ".join(OverflowPolicy.ALL))
+parser.add_option("-w", "--write", dest="write", default="0",
+                  help="Milliseconds a slow handler takes per record")
+(opts, args) = parser.parse_args()
+
+logger = CyLogger()
+logger.initializeLogs(syslog=False, myconsole=False,
+                      asynchronous=opts.asynchronous, overflow=opts.overflow)
+
+
+class SlowHandler(logging.Handler):
+    """
+    Handler taking a while to write each record.
+    """
+    def __init__(self, delay):
+        logging.Handler.__init__(self)
+        self.delay = delay
+
+    def emit(self, record):
+        time.sleep(self.delay)
+
+
+if float(opts.write) > 0:
+    slow = SlowHandler(float(opts.write) / 1000)
+    if logger.listener is not None:
+        logger.listener.handlers.append(slow)
+    else:
+        logger.logr.addHandler(slow)
+
+
+def timeCalls(priority, count):
+    """
+    Microseconds per logger.log call.
+    """
+    start = time.time()
+    for _ in xrange(count):
+        logger.log(priority, "message")
+    return (time.time() - start) * 1e6 / count
+
+
+def nested(depth, function, *args):
+    """
+    Call function with depth more frames on the stack.
+    """
+    if depth <= 0:
+        return function(*args)
+    return nested(depth - 1, function, *args)
+
+
+count = int(opts.count)
+depth = int(opts.depth)
+logger.logr.setLevel(lp.INFO)
+
+print "%-28s %10s" % ("case", "us/call")
+print "%-28s %10.3f" % ("dropped, DEBUG",
+                        nested(depth, timeCalls, lp.DEBUG, count))
+print "%-28s %10.3f" % ("dropped, string priority",
+                        nested(depth, timeCalls, "10", count))
+start = time.time()
+for _ in xrange(count):
+    logger.isEnabledFor(lp.DEBUG)
+print "%-28s %10.3f" % ("isEnabledFor", (time.time() - start) * 1e6 / count)
+#####
+# Written to the log file, fewer calls, they're a lot slower
+logger.flush()
+print "%-28s %10.3f" % ("written, INFO",
+                        nested(depth, timeCalls, lp.INFO, max(1, count / 20)))
+start = time.time()
+logger.flush()
+print "%-28s %10.3f" % ("flush, ms", (time.time() - start) * 1000)
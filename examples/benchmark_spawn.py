@@ -0,0 +1,71 @@
+#!/usr/bin/python
+"""
+Measure how long RunWith takes to start a command with Popen, which forks
+the whole python process, and with posix_spawn, as the process' resident
+set grows.
+
+Fork copies the page tables, so its cost grows with the heap, posix_spawn's
+shouldn't.  Each size is allocated and touched before its round, the sizes
+are cumulative.
+
+Example:
+    python benchmark_spawn.py -s 100,2048 -n 50
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import sys
+import time
+from optparse import OptionParser
+sys.path.append("../..")
+#--- non-native python libraries in this source tree
+from ramdisk.lib.loggers import CyLogger
+from ramdisk.lib.run_commands import RunWith
+from ramdisk.lib.command_metrics import percentile
+
+parser = OptionParser(usage="\n\n%prog [options]\n\n")
+parser.add_option("-n", "--count", dest="count", default="50",
+                  help="Commands to start with each backend at each size")
+parser.add_option("-s", "--sizes", dest="sizes", default="100,2048",
+                  help="Comma separated resident set sizes, in megabytes")
+(opts, args) = parser.parse_args()
+
+logger = CyLogger()
+logger.initializeLogs(syslog=False, myconsole=False)
+
+
+def rss():
+    """
+    Resident set size of this process in megabytes, where /proc has it.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * 4096 / (1024 * 1024)
+    except IOError:
+        return 0
+
+
+count = int(opts.count)
+rw = RunWith(logger)
+if not rw.setSpawn():
+    print "posix_spawn is not available here"
+    sys.exit(1)
+
+heap = []
+print "%8s %8s %-12s %10s %10s %10s" % ("size MB", "rss MB", "backend",
+                                         "mean ms", "p50 ms", "p99 ms")
+for size in [int(size) for size in opts.sizes.split(",")]:
+    #####
+    # Grow the heap to size, writing every page so it is resident
+    while len(heap) < size:
+        heap.append(bytearray("x" * (1024 * 1024)))
+    for backend in ["popen", "posix_spawn"]:
+        rw.setSpawn(backend == "posix_spawn")
+        latencies = []
+        for _ in range(count):
+            start = time.time()
+            rw.run(["/bin/true"])
+            latencies.append((time.time() - start) * 1000)
+        latencies.sort()
+        print "%8d %8d %-12s %10.2f %10.2f %10.2f" % (
+            size, rss(), backend, sum(latencies) / count,
+            percentile(latencies, 0.5), percentile(latencies, 0.99))
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+"""
+Measure the per command latency of RunWith under each sync policy, while a
+background thread keeps dirtying pages on a disk.
+
+With SyncPolicy.GLOBAL every command waits for everything the writer has
+dirtied to reach the disk, the other policies only pay for what they are
+pointed at.
+
+Example:
+    python benchmark_sync_policy.py -d /var/tmp -t /tmp/ramdisk_mnt -n 200
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import time
+import tempfile
+import threading
+from optparse import OptionParser
+sys.path.append("../..")
+#--- non-native python libraries in this source tree
+from ramdisk.lib.loggers import CyLogger
+from ramdisk.lib.run_commands import RunWith, SyncPolicy
+from ramdisk.lib.command_metrics import percentile
+
+parser = OptionParser(usage="\n\n%prog [options]\n\n")
+parser.add_option("-n", "--count", dest="count", default="100",
+                  help="Commands to run under each policy")
+parser.add_option("-d", "--dirty-dir", dest="dirtyDir",
+                  default=tempfile.gettempdir(),
+                  help="Directory, on a real disk, for the background writer")
+parser.add_option("-t", "--target", dest="target",
+                  default=tempfile.gettempdir(),
+                  help="Path passed to the syncfs and fdatasync policies")
+parser.add_option("-m", "--megabytes", dest="megabytes", default="8",
+                  help="Megabytes the writer writes between rewinds")
+(opts, args) = parser.parse_args()
+
+logger = CyLogger()
+logger.initializeLogs(syslog=False, myconsole=False)
+
+
+class DirtyWriter(threading.Thread):
+    """
+    Keep writing to a file, without syncing, so there are always dirty pages.
+    """
+    def __init__(self, directory, megabytes):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.megabytes = megabytes
+        self.stopEvent = threading.Event()
+        self.fd, self.path = tempfile.mkstemp(dir=directory)
+
+    def run(self):
+        block = "x" * (1024 * 1024)
+        while not self.stopEvent.is_set():
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            for _ in range(self.megabytes):
+                os.write(self.fd, block)
+
+    def stop(self):
+        self.stopEvent.set()
+        self.join()
+        os.close(self.fd)
+        os.unlink(self.path)
+
+
+count = int(opts.count)
+fdatasyncTarget = tempfile.mkstemp(dir=opts.target)
+
+writer = DirtyWriter(opts.dirtyDir, int(opts.megabytes))
+writer.start()
+try:
+    rw = RunWith(logger)
+    print "%-10s %10s %10s %10s" % ("policy", "mean ms", "p50 ms", "p99 ms")
+    for policy, targets in [(SyncPolicy.NONE, None),
+                            (SyncPolicy.SYNCFS, [opts.target]),
+                            (SyncPolicy.FDATASYNC, [fdatasyncTarget[1]]),
+                            (SyncPolicy.GLOBAL, None)]:
+        rw.setSyncPolicy(policy, targets)
+        latencies = []
+        for _ in range(count):
+            rw.setCommand(["/bin/true"])
+            start = time.time()
+            rw.communicate()
+            latencies.append((time.time() - start) * 1000)
+        latencies.sort()
+        print "%-10s %10.2f %10.2f %10.2f" % (policy,
+                                              sum(latencies) / count,
+                                              percentile(latencies, 0.5),
+                                              percentile(latencies, 0.99))
+finally:
+    writer.stop()
+    os.close(fdatasyncTarget[0])
+    os.unlink(fdatasyncTarget[1])
@@ -0,0 +1,622 @@
+"""
+Run many commands at once without a thread per command.
+
+RunWith blocks the calling thread until its command finishes, so a
+controller running many ramdisk and user operations at the same time
+needs as many threads.  AsyncRunWith starts each command right away and
+hands back a CommandFuture, while one reactor thread watches the pipes of
+every command in flight with poll, collects their output, enforces their
+timeouts and reaps them.  Results are the same CommandResult objects
+RunWith.run returns, and the same logging and metrics apply.
+
+Commands are started with posix_spawn where possible, see
+RunWith.setSpawn, so starting thousands of them from a large process stays
+cheap.  Callbacks, from addDoneCallback, stream or runPty, run on the
+reactor thread and must not block.
+"""
+from __future__ import absolute_import
+import os
+import re
+import sys
+import time
+import heapq
+import errno
+import fcntl
+import signal
+import select
+import threading
+import traceback
+
+from . loggers import CyLogger
+from . loggers import LogPriority as lp
+from . libHelperExceptions import NotACyLoggerError
+from . run_commands import RunWith, CommandResult
+from . resource_usage import reap, usageOf
+from . pty_session import PtySession
+
+
+class AsyncRunError(Exception):
+    """
+    Custom Exception
+    """
+    def __init__(self, *args, **kwargs):
+        Exception.__init__(self, *args, **kwargs)
+
+
+class CommandCancelledError(AsyncRunError):
+    """
+    Custom Exception
+    """
+    def __init__(self, *args, **kwargs):
+        AsyncRunError.__init__(self, *args, **kwargs)
+
+
+class CommandFuture(object):
+    """
+    The eventual CommandResult of a command started by AsyncRunWith, or
+    queued on a CommandPool.
+
+    @method done(self)
+    @method result(self, timeout=None)
+    @method exception(self, timeout=None)
+    @method addDoneCallback(self, callback)
+    @method cancel(self)
+    @method cancelled(self)
+    """
+    def __init__(self, command, logger, canceller=None):
+        """
+        @param: command - the command, for messages
+        @param: logger - CyLogger instance, for callbacks that fail
+        @param: canceller - callable taking the future, returning True if
+                            it stopped the command from running
+        """
+        self.command = command
+        self.logger = logger
+        self.canceller = canceller
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.value = None
+        self.error = None
+        self.callbacks = []
+
+    def done(self):
+        """
+        @returns: True once the command has finished, or failed to start
+        """
+        return self.event.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the command to finish.
+
+        @param: timeout - seconds to wait, None to wait forever
+
+        @returns: CommandResult.  Raises what starting the command raised,
+                  if it couldn't be, or AsyncRunError if timeout runs out.
+        """
+        if not self.event.wait(timeout):
+            raise AsyncRunError("Command still running: " + str(self.command))
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def exception(self, timeout=None):
+        """
+        @returns: what starting the command raised, None if it started
+        """
+        if not self.event.wait(timeout):
+            raise AsyncRunError("Command still running: " + str(self.command))
+        return self.error
+
+    def cancel(self):
+        """
+        Keep the command from running, if it hasn't started.
+
+        @returns: True if it was cancelled, its result is then a
+                  CommandCancelledError
+        """
+        if self.canceller is None or self.done():
+            return False
+        return self.canceller(self)
+
+    def cancelled(self):
+        """
+        @returns: True if the command was cancelled
+        """
+        return isinstance(self.error, CommandCancelledError)
+
+    def addDoneCallback(self, callback):
+        """
+        Call callback with this future once it is done, right away if it
+        already is.
+        """
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def _set(self, value=None, error=None):
+        with self.lock:
+            self.value = value
+            self.error = error
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                self.logger.log(lp.WARNING, traceback.format_exc())
+
+
+class _Job(object):
+    """
+    One command in flight.
+    """
+    def __init__(self, future, command, proc, fds, start, spawned, silent,
+                 group):
+        self.future = future
+        self.command = command
+        self.proc = proc
+        self.fds = fds
+        self.start = start
+        self.spawned = spawned
+        self.silent = silent
+        self.group = group
+        self.chunks = {"stdout": [], "stderr": []}
+        self.timedOut = False
+        self.finished = False
+        self.closed = False
+        self.outputBytes = 0
+        #####
+        # For stream, keep lines only long enough to hand them out
+        self.onLine = None
+        self.partial = {}
+        #####
+        # For runPty, the expect and reply script and the pty master
+        self.script = []
+        self.window = ""
+        self.master = None
+
+    def feed(self, name, data):
+        self.outputBytes += len(data)
+        if self.onLine is not None:
+            lines = (self.partial.pop(name, "") + data).split("\n")
+            self.partial[name] = lines.pop()
+            for line in lines:
+                self.onLine(name, line)
+        else:
+            self.chunks[name].append(data)
+        if self.script:
+            self.window = (self.window + data)[-4096:]
+            while self.script:
+                pattern, reply = self.script[0]
+                match = pattern.search(self.window)
+                if match is None:
+                    break
+                self.window = self.window[match.end():]
+                self.script.pop(0)
+                os.write(self.master, reply + "\n")
+
+    def eof(self, name):
+        if self.onLine is not None and self.partial.get(name):
+            self.onLine(name, self.partial.pop(name))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.master is not None:
+            os.close(self.master)
+        else:
+            self.proc.stdout.close()
+            self.proc.stderr.close()
+
+    def signal(self, sig):
+        try:
+            if self.group:
+                os.killpg(self.proc.pid, sig)
+            else:
+                self.proc.send_signal(sig)
+        except OSError:
+            pass
+
+
+class _Poller(object):
+    """
+    poll where python has it, select where it doesn't, or where poll
+    can't watch a pty, on macOS.
+    """
+    def __init__(self):
+        self.fds = set()
+        self.poller = None
+        if hasattr(select, "poll") and sys.platform != "darwin":
+            self.poller = select.poll()
+
+    def register(self, fd):
+        self.fds.add(fd)
+        if self.poller is not None:
+            self.poller.register(fd, select.POLLIN | select.POLLPRI)
+
+    def unregister(self, fd):
+        self.fds.discard(fd)
+        if self.poller is not None:
+            self.poller.unregister(fd)
+
+    def wait(self, timeout):
+        try:
+            if self.poller is not None:
+                if timeout is not None:
+                    timeout = max(0, int(timeout * 1000))
+                return [fd for fd, _ in self.poller.poll(timeout)]
+            ready, _, _ = select.select(list(self.fds), [], [], timeout)
+            return ready
+        except select.error, err:
+            if err.args[0] == errno.EINTR:
+                return []
+            raise
+
+
+class AsyncRunWith(object):
+    """
+    Start commands without waiting for them, one reactor thread watching
+    all of them.
+
+    @method run(self, command, env=None, myshell=None, close_fds=None,
+                cwd=None, timeout=None, grace=2.0, silent=True)
+    @method stream(self, command, onLine, ...)
+    @method runPty(self, command, script, env=None, timeout=None,
+                   grace=2.0, silent=True)
+    @method gather(self, futures, timeout=None)
+    @method inFlight(self)
+    @method close(self)
+    """
+    def __init__(self, logger, metrics=None, spawn=True, chunkSize=65536):
+        """
+        @param: logger - CyLogger
+        @param: metrics - CommandMetrics collector, None to not collect
+        @param: spawn - start commands with posix_spawn where possible
+        @param: chunkSize - bytes to read from a pipe at a time
+        """
+        if not isinstance(logger, CyLogger):
+            raise NotACyLoggerError("Passed in value for logger" +
+                                    " is invalid, try again.")
+        self.logger = logger
+        self.runner = RunWith(logger, metrics=metrics)
+        if spawn:
+            self.runner.setSpawn()
+        self.chunkSize = chunkSize
+        self.lock = threading.Lock()
+        self.incoming = []
+        self.jobs = set()
+        self.fds = {}
+        self.reaping = []
+        self.timers = []
+        self.timerCount = 0
+        self.closed = False
+        self.thread = None
+        self.wakeRead, self.wakeWrite = os.pipe()
+        for fd in [self.wakeRead, self.wakeWrite]:
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            fcntl.fcntl(fd, fcntl.F_SETFD,
+                        fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+    ###########################################################################
+
+    def run(self, command, env=None, myshell=None, close_fds=None, cwd=None,
+            timeout=None, grace=2.0, silent=True):
+        """
+        Start a command.  Parameters are those of RunWith.run.
+
+        @returns: CommandFuture of the command's CommandResult
+        """
+        return self._submit(command, env, myshell, close_fds, cwd, timeout,
+                            grace, silent)
+
+    ###########################################################################
+
+    def stream(self, command, onLine, env=None, myshell=None, close_fds=None,
+               cwd=None, timeout=None, grace=2.0, silent=True):
+        """
+        Start a command, calling onLine("stdout", line) or
+        onLine("stderr", line), on the reactor thread, for each line it
+        writes.  Lines are passed without their newline and are not kept,
+        so the result has empty stdout and stderr.
+
+        @returns: CommandFuture of the command's CommandResult
+        """
+        return self._submit(command, env, myshell, close_fds, cwd, timeout,
+                            grace, silent, onLine=onLine)
+
+    ###########################################################################
+
+    def runPty(self, command, script, env=None, timeout=None, grace=2.0,
+               silent=True):
+        """
+        Start a command on a pty, and answer its prompts, su or sudo asking
+        for a password for instance, without blocking.
+
+        @param: script - list of (regular expression, reply) tuples.  Each
+                         reply, with a newline, is written once its
+                         expression matches output after the previous one.
+        @param: timeout - seconds before the command is stopped, None to
+                          wait forever
+
+        @returns: CommandFuture of the command's CommandResult, everything
+                  written to the pty in its stdout
+        """
+        self.runner._checkCommand(command)
+        future = CommandFuture(command, self.logger)
+        start = time.time()
+        try:
+            session = PtySession(command, self.logger, env=env).spawn()
+        except Exception, err:
+            return self._failed(future, command, start, err)
+        job = _Job(future, command, session.proc,
+                   {session.master: "stdout"}, start, time.time(), silent,
+                   False)
+        job.master = session.master
+        job.script = [(re.compile(pattern, re.M), reply)
+                      for pattern, reply in script]
+        self._add(job, timeout, grace)
+        return future
+
+    ###########################################################################
+
+    def gather(self, futures, timeout=None):
+        """
+        Wait for all of the futures.
+
+        @param: timeout - seconds to wait for all of them, None to wait
+                          forever
+
+        @returns: list of CommandResults, in the order of futures
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        results = []
+        for future in futures:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.time())
+            results.append(future.result(remaining))
+        return results
+
+    ###########################################################################
+
+    def inFlight(self):
+        """
+        @returns: number of commands started and not yet finished
+        """
+        with self.lock:
+            return len(self.incoming) + len(self.jobs)
+
+    ###########################################################################
+
+    def close(self):
+        """
+        Wait for the commands in flight, then stop the reactor thread.
+        """
+        with self.lock:
+            self.closed = True
+            thread = self.thread
+        self._wake()
+        if thread is not None:
+            thread.join()
+        for fd in [self.wakeRead, self.wakeWrite]:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    ###########################################################################
+
+    def _submit(self, command, env, myshell, close_fds, cwd, timeout, grace,
+                silent, onLine=None):
+        myshell = self.runner._checkCommand(command, myshell)
+        future = CommandFuture(command, self.logger)
+        start = time.time()
+        group = timeout is not None
+        try:
+            proc = self.runner._spawn(command, env, myshell, cwd, close_fds,
+                                      newGroup=group)
+        except Exception, err:
+            return self._failed(future, command, start, err)
+        job = _Job(future, command, proc,
+                   {proc.stdout.fileno(): "stdout",
+                    proc.stderr.fileno(): "stderr"},
+                   start, time.time(), silent, group)
+        job.onLine = onLine
+        self._add(job, timeout, grace)
+        return future
+
+    ###########################################################################
+
+    def _failed(self, future, command, start, err):
+        if self.runner.metrics is not None:
+            self.runner.metrics.record(command, time.time() - start,
+                                       failed=True)
+        self.runner._log(lp.WARNING, "command: %s", command)
+        self.logger.log(lp.WARNING, str(err))
+        future._set(error=err)
+        return future
+
+    ###########################################################################
+
+    def _add(self, job, timeout, grace):
+        with self.lock:
+            if self.closed:
+                raise AsyncRunError("AsyncRunWith is closed")
+            job.timeout = timeout
+            job.grace = grace
+            self.incoming.append(job)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop)
+                self.thread.daemon = True
+                self.thread.start()
+        self._wake()
+
+    ###########################################################################
+
+    def _wake(self):
+        try:
+            os.write(self.wakeWrite, "x")
+        except OSError:
+            pass
+
+    ###########################################################################
+
+    def _timer(self, when, job, action):
+        self.timerCount += 1
+        heapq.heappush(self.timers, (when, self.timerCount, job, action))
+
+    ###########################################################################
+
+    def _loop(self):
+        """
+        The reactor: read whatever is ready, fire due timers, reap.
+        """
+        poller = _Poller()
+        poller.register(self.wakeRead)
+        while True:
+            with self.lock:
+                incoming, self.incoming = self.incoming, []
+                if self.closed and not incoming and not self.jobs:
+                    return
+                self.jobs.update(incoming)
+            for job in incoming:
+                for fd in job.fds:
+                    self.fds[fd] = job
+                    poller.register(fd)
+                if job.timeout is not None:
+                    self._timer(job.start + job.timeout, job, "terminate")
+
+            wait = None
+            if self.reaping:
+                wait = 0.002
+            if self.timers:
+                until = max(0, self.timers[0][0] - time.time())
+                wait = until if wait is None else min(wait, until)
+
+            for fd in poller.wait(wait):
+                if fd == self.wakeRead:
+                    try:
+                        while os.read(self.wakeRead, 4096):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                job = self.fds.get(fd)
+                if job is None:
+                    continue
+                try:
+                    data = os.read(fd, self.chunkSize)
+                except OSError, err:
+                    if err.errno in (errno.EINTR, errno.EAGAIN):
+                        continue
+                    #####
+                    # EIO on a pty master once the child is gone
+                    data = ""
+                try:
+                    if data:
+                        job.feed(job.fds[fd], data)
+                        continue
+                    job.eof(job.fds[fd])
+                except Exception:
+                    self.logger.log(lp.WARNING, traceback.format_exc())
+                poller.unregister(fd)
+                del self.fds[fd]
+                del job.fds[fd]
+                if not job.fds:
+                    self.reaping.append(job)
+
+            now = time.time()
+            while self.timers and self.timers[0][0] <= now:
+                _, _, job, action = heapq.heappop(self.timers)
+                if job.finished:
+                    continue
+                try:
+                    if action == "terminate":
+                        job.timedOut = True
+                        job.signal(signal.SIGTERM)
+                        self._timer(now + job.grace, job, "kill")
+                    else:
+                        job.signal(signal.SIGKILL)
+                except Exception, err:
+                    self._abandon(job, poller, err)
+
+            if self.reaping:
+                reaping, self.reaping = self.reaping, []
+                for job in reaping:
+                    try:
+                        if reap(job.proc, block=False) is None:
+                            self.reaping.append(job)
+                        else:
+                            self._finish(job)
+                    except Exception, err:
+                        #####
+                        # One odd child mustn't take the reactor, and
+                        # every other command in flight, down with it
+                        self._abandon(job, poller, err)
+
+    ###########################################################################
+
+    def _abandon(self, job, poller, err):
+        """
+        Fail the one command the reactor couldn't handle, and forget it.
+
+        @param: job - the _Job that raised
+        @param: poller - the reactor's _Poller, to stop watching its fds
+        @param: err - the exception, handed to the job's future
+        """
+        self.logger.log(lp.WARNING, traceback.format_exc())
+        job.finished = True
+        with self.lock:
+            self.jobs.discard(job)
+        for fd in job.fds.keys():
+            poller.unregister(fd)
+            self.fds.pop(fd, None)
+        job.fds = {}
+        if job.proc.returncode is None:
+            job.signal(signal.SIGKILL)
+        try:
+            job.close()
+        except (OSError, IOError):
+            pass
+        if not job.future.done():
+            job.future._set(error=err)
+
+    ###########################################################################
+
+    def _finish(self, job):
+        """
+        Build the result of a command that has exited, and hand it out.
+        """
+        job.finished = True
+        with self.lock:
+            self.jobs.discard(job)
+        job.close()
+        end = time.time()
+        stdout = "".join(job.chunks["stdout"])
+        stderr = "".join(job.chunks["stderr"])
+        result = CommandResult(job.command, stdout, stderr,
+                               job.proc.returncode, end - job.start,
+                               job.timedOut, usage=usageOf(job.proc))
+        if self.runner.metrics is not None:
+            self.runner.metrics.record(job.command, end - job.start,
+                                       job.spawned - job.start,
+                                       end - job.spawned, 0.0,
+                                       job.outputBytes, not result.ok,
+                                       result.usage)
+        log = self.runner._log
+        if job.timedOut:
+            log(lp.WARNING, "Timed out after %ss: %s", job.timeout, job.command)
+        if not job.silent:
+            log(lp.DEBUG, "Done with command: %s", job.command)
+            log(lp.DEBUG, "stdout: %s", stdout)
+            log(lp.DEBUG, "stderr: %s", stderr)
+        log(lp.DEBUG, "Command returned with error/returncode: %s",
+            job.proc.returncode)
+        job.future._set(result)
@@ -0,0 +1,154 @@
+"""
+Run many commands at once, with a bounded number running at a time.
+
+Fan-out work, like looking up the groups of every user on the system, takes
+roughly as long as the slowest command instead of the sum of all of them.
+Each command gets its own pipes, read with select so neither can fill up and
+stall the child, and its own optional timeout.  Results come back as
+read only CommandResult records, either in the order the commands were
+given or as each command finishes.
+
+Each command goes through RunWith.run, so a timeout stops everything the
+command started, not just the command, and the runner's sync policy,
+spawner, metrics, trace and cache apply as they do to any other command.
+"""
+from __future__ import absolute_import
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+
+from . loggers import CyLogger
+from . loggers import LogPriority as lp
+from . libHelperExceptions import NotACyLoggerError
+from . run_commands import CommandResult, RunWith
+
+
+class CommandBatch(object):
+    """
+    Run a batch of commands in parallel.
+
+    Commands are argv lists, or (argv, timeout) tuples to give one command
+    its own timeout.
+
+    @method run(self, commands, timeout=None)
+    @method iterate(self, commands, timeout=None)
+    """
+    def __init__(self, logger, workers=8, timeout=None, env=None,
+                 runner=None):
+        """
+        @param: logger - CyLogger instance
+        @param: workers - most commands to run at one time
+        @param: timeout - default seconds before a command is killed, None
+                          for no limit
+        @param: env - environment for the commands, None to inherit this
+                      process' environment
+        @param: runner - RunWith to run the commands with, a new one if
+                         None.  Its run() is safe to share between threads.
+        """
+        if isinstance(logger, CyLogger):
+            self.logger = logger
+        else:
+            raise NotACyLoggerError("Passed in value for logger" +
+                                    " is invalid, try again.")
+        self.workers = max(1, int(workers))
+        self.timeout = timeout
+        self.env = env
+        if runner is None:
+            runner = RunWith(logger)
+        self.runner = runner
+
+    ###########################################################################
+
+    def _tasks(self, commands, timeout):
+        """
+        Number the commands and pair each with its timeout.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        tasks = []
+        for index, command in enumerate(commands):
+            if isinstance(command, tuple):
+                command, cmdTimeout = command
+            else:
+                cmdTimeout = timeout
+            tasks.append((index, list(command), cmdTimeout))
+        return tasks
+
+    ###########################################################################
+
+    def _runOne(self, task):
+        """
+        Run one command.  Runs in a pool thread, and never raises.
+
+        @returns: CommandResult
+        """
+        index, command, timeout = task
+        start = time.time()
+        try:
+            #####
+            # close_fds, so no command holds open another one's pipes
+            result = self.runner.run(command, env=self.env, close_fds=True,
+                                     timeout=timeout)
+        except Exception, err:
+            self.logger.log(lp.DEBUG, traceback.format_exc())
+            return CommandResult(command, elapsed=time.time() - start,
+                                 error=str(err), index=index)
+        return CommandResult(command, result.stdout, result.stderr,
+                             result.retcode, result.elapsed, result.timedOut,
+                             index=index, usage=result.usage)
+
+    ###########################################################################
+
+    def _log(self, result):
+        """
+        Log a failed command.
+        """
+        if result.error is not None:
+            self.logger.log(lp.WARNING, "Could not run " +
+                            " ".join(result.command) + ": " + result.error)
+        elif result.timedOut:
+            self.logger.log(lp.WARNING, "Killed " + " ".join(result.command) +
+                            " after " + "%.3f" % result.elapsed + "s")
+
+    ###########################################################################
+
+    def iterate(self, commands, timeout=None):
+        """
+        Run the commands, yielding each result as its command finishes.
+        result.index is the command's position in commands.
+
+        @param: commands - list of argv lists or (argv, timeout) tuples
+        @param: timeout - seconds before a command is killed, overrides the
+                          default for this batch
+        """
+        tasks = self._tasks(commands, timeout)
+        if not tasks:
+            return
+        pool = ThreadPool(min(self.workers, len(tasks)))
+        try:
+            for result in pool.imap_unordered(self._runOne, tasks):
+                self._log(result)
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+    ###########################################################################
+
+    def run(self, commands, timeout=None):
+        """
+        Run the commands and wait for all of them.
+
+        @param: commands - list of argv lists or (argv, timeout) tuples
+        @param: timeout - seconds before a command is killed, overrides the
+                          default for this batch
+
+        @returns: list of CommandResult, in the same order as commands
+        """
+        results = [None] * len(commands)
+        start = time.time()
+        for result in self.iterate(commands, timeout):
+            results[result.index] = result
+        self.logger.log(lp.DEBUG, "Ran " + str(len(results)) +
+                        " commands in " + "%.3f" % (time.time() - start) + "s")
+        return results
@@ -0,0 +1,165 @@
+"""
+Memoize the results of read only commands.
+
+Much of what gets shelled out to, lsb_release, dscl -list, groups,
+system_profiler, answers the same way for the life of the process.  A
+CommandCache keeps results keyed by the command, its environment and the
+directory it ran in, each for a time to live, and drops the least recently
+used entry when full.  Callers opt in per command, see
+RunWith.run(cache=True) or RunWith.communicate(cache=True).
+"""
+from __future__ import absolute_import
+import time
+import threading
+from collections import OrderedDict
+
+
+class CommandCache(object):
+    """
+    LRU cache of command results with a per entry time to live.
+
+    @method key(self, command, env=None, cwd=None)
+    @method get(self, key)
+    @method put(self, key, value, ttl=None)
+    @method invalidate(self, match=None)
+    @method clear(self)
+    @method getStats(self)
+    """
+    def __init__(self, maxEntries=256, ttl=300, clock=time.time):
+        """
+        @param: maxEntries - most results to keep
+        @param: ttl - default seconds a result stays valid
+        @param: clock - callable returning the current time in seconds
+        """
+        self.maxEntries = max(1, int(maxEntries))
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    ###########################################################################
+
+    def key(self, command, env=None, cwd=None):
+        """
+        Build the key a command's result is stored under.
+
+        @param: command - argv list or command string
+        @param: env - environment dictionary the command runs with
+        @param: cwd - directory the command runs in
+        """
+        if isinstance(command, list):
+            command = tuple(command)
+        if env:
+            env = tuple(sorted(env.items()))
+        else:
+            env = None
+        return (command, env, cwd)
+
+    ###########################################################################
+
+    def get(self, key):
+        """
+        @returns: the value stored under key, or None if there is none or
+                  it has expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires is not None and self.clock() >= expires:
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            #####
+            # Move to the most recently used end
+            del self.entries[key]
+            self.entries[key] = entry
+            self.hits += 1
+            return value
+
+    ###########################################################################
+
+    def put(self, key, value, ttl=None):
+        """
+        Store a value.
+
+        @param: ttl - seconds the value stays valid, the cache default if
+                      None, forever if negative
+        """
+        if ttl is None:
+            ttl = self.ttl
+        expires = None
+        if ttl is not None and ttl >= 0:
+            expires = self.clock() + ttl
+        with self.lock:
+            if key in self.entries:
+                del self.entries[key]
+            self.entries[key] = (expires, value)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    ###########################################################################
+
+    def invalidate(self, match=None):
+        """
+        Drop cached results.
+
+        @param: match - None to drop everything, a string to drop every
+                        command whose executable is that path or name, or
+                        a callable taking a key and returning True for
+                        the entries to drop.
+
+        @returns: number of entries dropped
+        """
+        if match is None:
+            predicate = lambda key: True
+        elif callable(match):
+            predicate = match
+        else:
+            def predicate(key):
+                command = key[0]
+                if isinstance(command, tuple):
+                    executable = command[0] if command else ""
+                else:
+                    executable = command.split()[0] if command.split() else ""
+                return executable == match or \
+                       executable.rsplit("/", 1)[-1] == match
+        with self.lock:
+            dropped = [key for key in self.entries if predicate(key)]
+            for key in dropped:
+                del self.entries[key]
+        return len(dropped)
+
+    ###########################################################################
+
+    def clear(self):
+        """
+        Drop everything, and reset the counters.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.expirations = 0
+
+    ###########################################################################
+
+    def getStats(self):
+        """
+        @returns: dictionary of hits, misses, evictions, expirations and
+                  entries
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions,
+                    "expirations": self.expirations,
+                    "entries": len(self.entries)}
@@ -0,0 +1,222 @@
+"""
+Collect timings of the commands RunWith runs.
+
+For each executable the collector keeps the number of calls and failures,
+the bytes of output, and the time spent in total, spawning the process,
+waiting on it and syncing filesystems afterwards.  The latest latencies
+are kept to report the median and 99th percentile.  Where the command's
+resource usage is known, see resource_usage, its CPU time, page faults and
+context switches are added up and its peak memory kept too, and top()
+names the executables that cost the most.  Stats can be read in process
+with getStats(), or written as JSON with dumpJson(), for example when the
+program exits with dumpAtExit().
+
+RunWith only collects when given a collector, so a RunWith without one
+pays for a single attribute check per command.
+"""
+from __future__ import absolute_import
+import json
+import atexit
+import threading
+
+
+def percentile(ordered, fraction):
+    """
+    Nearest rank percentile of a sorted list, 0.0 if it is empty.
+    """
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class ExecutableStats(object):
+    """
+    Running totals for one executable.
+    """
+    def __init__(self, maxSamples):
+        self.maxSamples = maxSamples
+        self.calls = 0
+        self.failures = 0
+        self.outputBytes = 0
+        self.total = 0.0
+        self.spawn = 0.0
+        self.wait = 0.0
+        self.sync = 0.0
+        self.samples = []
+        self.next = 0
+        self.measured = 0
+        self.userTime = 0.0
+        self.systemTime = 0.0
+        self.maxRss = 0
+        self.minorFaults = 0
+        self.majorFaults = 0
+        self.voluntarySwitches = 0
+        self.involuntarySwitches = 0
+
+    def addUsage(self, usage):
+        self.measured += 1
+        self.userTime += usage.userTime
+        self.systemTime += usage.systemTime
+        self.maxRss = max(self.maxRss, usage.maxRss)
+        self.minorFaults += usage.minorFaults
+        self.majorFaults += usage.majorFaults
+        self.voluntarySwitches += usage.voluntarySwitches
+        self.involuntarySwitches += usage.involuntarySwitches
+
+    def add(self, total, spawn, wait, sync, outputBytes, failed):
+        self.calls += 1
+        if failed:
+            self.failures += 1
+        self.outputBytes += outputBytes
+        self.total += total
+        self.spawn += spawn
+        self.wait += wait
+        self.sync += sync
+        #####
+        # Keep the latest maxSamples latencies, as a ring
+        if len(self.samples) < self.maxSamples:
+            self.samples.append(total)
+        else:
+            self.samples[self.next] = total
+            self.next = (self.next + 1) % self.maxSamples
+
+    def report(self):
+        ordered = sorted(self.samples)
+        return {"calls": self.calls,
+                "failures": self.failures,
+                "outputBytes": self.outputBytes,
+                "total": self.total,
+                "spawn": self.spawn,
+                "wait": self.wait,
+                "sync": self.sync,
+                "p50": percentile(ordered, 0.5),
+                "p99": percentile(ordered, 0.99),
+                "measured": self.measured,
+                "cpu": self.userTime + self.systemTime,
+                "userTime": self.userTime,
+                "systemTime": self.systemTime,
+                "maxRss": self.maxRss,
+                "minorFaults": self.minorFaults,
+                "majorFaults": self.majorFaults,
+                "voluntarySwitches": self.voluntarySwitches,
+                "involuntarySwitches": self.involuntarySwitches}
+
+###############################################################################
+
+class CommandMetrics(object):
+    """
+    Collector of per executable command timings.
+
+    @method record(self, command, total, spawn=0.0, wait=0.0, sync=0.0,
+                   outputBytes=0, failed=False, usage=None)
+    @method getStats(self, executable=None)
+    @method top(self, field="cpu", count=10)
+    @method dumpJson(self, path)
+    @method dumpAtExit(self, path)
+    @method reset(self)
+    """
+    def __init__(self, maxSamples=1024):
+        """
+        @param: maxSamples - latencies kept per executable for percentiles
+        """
+        self.maxSamples = max(1, int(maxSamples))
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    ###########################################################################
+
+    def executable(self, command):
+        """
+        Name commands are grouped under, the first word of the command.
+        """
+        if isinstance(command, (list, tuple)):
+            return str(command[0]) if command else ""
+        words = str(command or "").split()
+        return words[0] if words else ""
+
+    ###########################################################################
+
+    def record(self, command, total, spawn=0.0, wait=0.0, sync=0.0,
+               outputBytes=0, failed=False, usage=None):
+        """
+        Record one finished command.
+
+        @param: command - argv list or command string
+        @param: total - seconds from start to finish
+        @param: spawn - seconds spent starting the process
+        @param: wait - seconds spent waiting on the process
+        @param: sync - seconds spent syncing filesystems after it
+        @param: outputBytes - bytes of stdout and stderr
+        @param: failed - True if it exited non zero, timed out or couldn't
+                         be run
+        @param: usage - its ResourceUsage, None if not known
+        """
+        name = self.executable(command)
+        with self.lock:
+            if name not in self.stats:
+                self.stats[name] = ExecutableStats(self.maxSamples)
+            self.stats[name].add(total, spawn, wait, sync, outputBytes,
+                                 failed)
+            if usage is not None:
+                self.stats[name].addUsage(usage)
+
+    ###########################################################################
+
+    def getStats(self, executable=None):
+        """
+        @returns: dictionary of executable to dictionaries of calls,
+                  failures, outputBytes, and total, spawn, wait, sync, p50
+                  and p99 seconds, and the resource usage of the calls
+                  measured.  Just the one dictionary if executable is
+                  given, None if it has not been run.
+        """
+        with self.lock:
+            if executable is not None:
+                if executable not in self.stats:
+                    return None
+                return self.stats[executable].report()
+            return dict([(name, stats.report())
+                         for name, stats in self.stats.items()])
+
+    ###########################################################################
+
+    def top(self, field="cpu", count=10):
+        """
+        The executables that cost the most.
+
+        @param: field - key of getStats to rank by, cpu, maxRss, total,
+                        majorFaults...
+        @param: count - how many to return
+
+        @returns: list of (executable, value), highest first
+        """
+        ranked = [(name, stats[field])
+                  for name, stats in self.getStats().items()]
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return ranked[:count]
+
+    ###########################################################################
+
+    def dumpJson(self, path):
+        """
+        Write the stats of every executable to a JSON file.
+        """
+        with open(path, "w") as dump:
+            json.dump(self.getStats(), dump, indent=2, sort_keys=True)
+
+    ###########################################################################
+
+    def dumpAtExit(self, path):
+        """
+        Write the stats to a JSON file when the program exits.
+        """
+        atexit.register(self.dumpJson, path)
+
+    ###########################################################################
+
+    def reset(self):
+        """
+        Forget everything collected so far.
+        """
+        with self.lock:
+            self.stats = {}
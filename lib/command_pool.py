@@ -0,0 +1,226 @@
+"""
+Shared, bounded pool of worker threads for running commands in the
+background.
+
+RunThread used to start a thread per command, and runMyThreadCommand
+joined it right away, paying for a thread without running anything in the
+background.  A CommandPool keeps at most a fixed number of worker threads,
+started as they are needed, takes commands, or any callable, in priority
+order and hands back a CommandFuture for each.  Commands that haven't
+started can be cancelled, and a cap on processes running at once applies
+to commands however many workers there are.
+
+sharedPool() gives the process wide pool RunThread and runMyThreadCommand
+use.
+"""
+from __future__ import absolute_import
+import heapq
+import threading
+import traceback
+
+from . loggers import CyLogger
+from . loggers import LogPriority as lp
+from . libHelperExceptions import NotACyLoggerError
+from . run_commands import RunWith
+from . async_run import AsyncRunError, CommandFuture, CommandCancelledError
+
+#####
+# The pool sharedPool() hands out, made on first use
+_shared = None
+_sharedLock = threading.Lock()
+
+
+class _Task(object):
+    """
+    One queued call.
+    """
+    def __init__(self, function, args, kwargs, spawns):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.spawns = spawns
+        self.started = False
+        self.cancelled = False
+        self.future = None
+
+
+class CommandPool(object):
+    """
+    Bounded pool of workers running commands in priority order.
+
+    @method run(self, command, priority=0, **kwargs)
+    @method submit(self, function, args=(), kwargs=None, priority=0,
+                   spawns=False)
+    @method pending(self)
+    @method shutdown(self, wait=True, cancel=False)
+    """
+    def __init__(self, logger, workers=4, maxProcesses=None, runner=None):
+        """
+        @param: logger - CyLogger
+        @param: workers - most threads the pool starts
+        @param: maxProcesses - most commands running at once, the number of
+                               workers if None
+        @param: runner - RunWith the commands run with, a new one if None
+        """
+        if isinstance(logger, CyLogger):
+            self.logger = logger
+        else:
+            raise NotACyLoggerError("Passed in value for logger" +
+                                    " is invalid, try again.")
+        self.workers = max(1, int(workers))
+        if maxProcesses is None:
+            maxProcesses = self.workers
+        self.processes = threading.BoundedSemaphore(max(1, int(maxProcesses)))
+        if runner is None:
+            runner = RunWith(logger)
+        self.runner = runner
+        self.condition = threading.Condition()
+        self.queue = []
+        self.count = 0
+        self.threads = []
+        self.idle = 0
+        self.closed = False
+
+    ###########################################################################
+
+    def run(self, command, priority=0, **kwargs):
+        """
+        Queue a command for RunWith.run.
+
+        @param: command - argv list, or a string
+        @param: priority - lower runs sooner, ties in the order queued
+        @param: kwargs - the other parameters of RunWith.run
+
+        @returns: CommandFuture of the command's CommandResult
+        """
+        return self.submit(self.runner.run, (command,), kwargs, priority,
+                           spawns=True)
+
+    ###########################################################################
+
+    def submit(self, function, args=(), kwargs=None, priority=0,
+               spawns=False):
+        """
+        Queue any callable.
+
+        @param: priority - lower runs sooner, ties in the order queued
+        @param: spawns - True if the callable runs a command, so it counts
+                         against maxProcesses
+
+        @returns: CommandFuture of what the callable returns
+        """
+        task = _Task(function, args, kwargs or {}, spawns)
+        task.future = CommandFuture(args[0] if args else function,
+                                    self.logger,
+                                    lambda future: self._cancel(task))
+        with self.condition:
+            if self.closed:
+                raise AsyncRunError("CommandPool is shut down")
+            self.count += 1
+            heapq.heappush(self.queue, (priority, self.count, task))
+            if self.idle:
+                #####
+                # Claim an idle worker, so the next call doesn't count on
+                # the same one
+                self.idle -= 1
+                self.condition.notify()
+            elif len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                self.threads.append(thread)
+                thread.start()
+        return task.future
+
+    ###########################################################################
+
+    def pending(self):
+        """
+        @returns: number of calls queued and not yet started
+        """
+        with self.condition:
+            return len([entry for entry in self.queue
+                        if not entry[2].cancelled])
+
+    ###########################################################################
+
+    def shutdown(self, wait=True, cancel=False):
+        """
+        Stop taking calls.  Those queued still run, unless cancel is True.
+
+        @param: wait - wait for the workers to finish
+        @param: cancel - cancel the calls that haven't started
+        """
+        with self.condition:
+            self.closed = True
+            queued = [entry[2] for entry in self.queue]
+            self.condition.notify_all()
+            threads = list(self.threads)
+        if cancel:
+            for task in queued:
+                task.future.cancel()
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    ###########################################################################
+
+    def _cancel(self, task):
+        with self.condition:
+            if task.started or task.cancelled:
+                return False
+            task.cancelled = True
+        task.future._set(error=CommandCancelledError("Cancelled: " +
+                                                     str(task.future.command)))
+        return True
+
+    ###########################################################################
+
+    def _work(self):
+        """
+        Worker thread, runs queued calls until the pool is shut down.
+        """
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.idle += 1
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                _, _, task = heapq.heappop(self.queue)
+                if task.cancelled:
+                    continue
+                task.started = True
+            if task.spawns:
+                self.processes.acquire()
+            try:
+                value = task.function(*task.args, **task.kwargs)
+            except BaseException, err:
+                #####
+                # RunWith's own exceptions are BaseExceptions, they belong
+                # to the future as much as any other
+                error = err
+                self.logger.log(lp.WARNING, traceback.format_exc())
+            else:
+                error = None
+            finally:
+                if task.spawns:
+                    self.processes.release()
+            if error is None:
+                task.future._set(value)
+            else:
+                task.future._set(error=error)
+
+
+###############################################################################
+
+def sharedPool(logger):
+    """
+    The process wide CommandPool, made with logger on first use.
+
+    @returns: CommandPool
+    """
+    global _shared
+    with _sharedLock:
+        if _shared is None:
+            _shared = CommandPool(logger, workers=8)
+        return _shared
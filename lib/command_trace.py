@@ -0,0 +1,232 @@
+"""
+Record the commands RunWith runs, and play them back without running them.
+
+Code that shells out, ramdisk setup with hdiutil and diskutil, user
+management with dscl, is hard to test and benchmark anywhere but the
+machine it was written for.  A TraceRecorder, set on a RunWith with
+setTrace, writes each command run() runs, with its environment, directory,
+output, return code and timing, to a trace file.  A TraceReplayer loads the
+file and answers the same commands from it instead of running anything,
+so the flow that made the trace runs again anywhere, in milliseconds.
+
+Traces are JSON, one record to a line, gzipped if the file name ends in
+.gz.  Replayed commands are looked up in a dictionary keyed by the
+command, its environment and its directory.  A command recorded more than
+once gets its answers in the order they were recorded, the last one over
+and over once they run out.
+
+Only run(), and communicate() and timeout() which use it, are traced.
+"""
+from __future__ import absolute_import
+import gzip
+import json
+import threading
+
+from . run_commands import CommandResult
+from . resource_usage import ResourceUsage
+
+TRACE_VERSION = 1
+
+
+class CommandNotInTraceError(Exception):
+    """
+    Custom Exception
+    """
+    def __init__(self, *args, **kwargs):
+        Exception.__init__(self, *args, **kwargs)
+
+
+def _open(path, mode):
+    if str(path).endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def _text(value):
+    """
+    Output as something JSON holds, any bytes survive latin-1.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, basestring):
+        value = value.read()
+    return value.decode("latin-1")
+
+
+def _bytes(value):
+    if value is None:
+        return None
+    return value.encode("latin-1")
+
+
+def traceKey(command, env=None, cwd=None, matchEnv=True):
+    """
+    Key a command's records are looked up by.
+    """
+    if isinstance(command, list):
+        command = tuple(command)
+    if env and matchEnv:
+        env = tuple(sorted(env.items()))
+    else:
+        env = None
+    return (command, env, cwd)
+
+###############################################################################
+
+class TraceRecorder(object):
+    """
+    Write each command a RunWith runs to a trace file.
+
+    @method record(self, command, env, cwd, result)
+    @method close(self)
+    """
+    def __init__(self, path):
+        """
+        @param: path - trace file to write, gzipped if it ends in .gz
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.count = 0
+        self.trace = _open(path, "wb")
+        self.trace.write(json.dumps({"version": TRACE_VERSION}) + "\n")
+
+    ###########################################################################
+
+    def replay(self, command, env=None, cwd=None):
+        """
+        Nothing to replay while recording.
+        """
+        return None
+
+    ###########################################################################
+
+    def record(self, command, env, cwd, result):
+        """
+        Add a finished command to the trace.
+
+        @param: env - the environment the caller gave, None if inherited
+        @param: result - its CommandResult
+        """
+        line = json.dumps({"command": command,
+                           "env": dict(env) if env else None,
+                           "cwd": cwd,
+                           "stdout": _text(result.stdout),
+                           "stderr": _text(result.stderr),
+                           "retcode": result.retcode,
+                           "elapsed": round(result.elapsed, 6),
+                           "timedOut": result.timedOut,
+                           "usage": result.usage.asDict()
+                                    if result.usage else None},
+                          separators=(",", ":"))
+        with self.lock:
+            self.trace.write(line + "\n")
+            self.trace.flush()
+            self.count += 1
+
+    ###########################################################################
+
+    def close(self):
+        with self.lock:
+            self.trace.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+###############################################################################
+
+class TraceReplayer(object):
+    """
+    Answer commands from a trace file instead of running them.
+
+    @method replay(self, command, env=None, cwd=None)
+    @method unused(self)
+    """
+    def __init__(self, path, strict=True, matchEnv=True):
+        """
+        @param: path - trace file written by a TraceRecorder
+        @param: strict - raise CommandNotInTraceError for a command not in
+                         the trace, instead of letting RunWith run it
+        @param: matchEnv - only answer commands run with the environment
+                           they were recorded with
+        """
+        self.path = path
+        self.strict = strict
+        self.matchEnv = matchEnv
+        self.lock = threading.Lock()
+        self.index = {}
+        self.served = {}
+        with _open(path, "rb") as trace:
+            header = json.loads(trace.readline() or "{}")
+            if header.get("version") != TRACE_VERSION:
+                raise CommandNotInTraceError("Not a version " +
+                                             str(TRACE_VERSION) +
+                                             " trace: " + str(path))
+            for line in trace:
+                record = json.loads(line)
+                command = self._native(record["command"])
+                env = self._native(record["env"])
+                key = traceKey(command, env, self._native(record["cwd"]),
+                               matchEnv)
+                usage = record.get("usage")
+                if usage:
+                    usage = ResourceUsage(**self._native(usage))
+                result = CommandResult(command, _bytes(record["stdout"]),
+                                       _bytes(record["stderr"]),
+                                       record["retcode"], record["elapsed"],
+                                       record["timedOut"], usage=usage)
+                self.index.setdefault(key, []).append(result)
+
+    ###########################################################################
+
+    def _native(self, value):
+        """
+        JSON gives unicode, commands were str.
+        """
+        if isinstance(value, list):
+            return [self._native(item) for item in value]
+        if isinstance(value, dict):
+            return dict([(self._native(key), self._native(item))
+                         for key, item in value.items()])
+        if isinstance(value, unicode):
+            return value.encode("utf-8")
+        return value
+
+    ###########################################################################
+
+    def record(self, command, env, cwd, result):
+        """
+        Nothing to record while replaying.
+        """
+        pass
+
+    ###########################################################################
+
+    def replay(self, command, env=None, cwd=None):
+        """
+        @returns: the recorded CommandResult of the command, or None if it
+                  isn't in the trace and strict is off.
+        """
+        key = traceKey(command, env, cwd, self.matchEnv)
+        with self.lock:
+            results = self.index.get(key)
+            if results is None:
+                if self.strict:
+                    raise CommandNotInTraceError("Not in " + str(self.path) +
+                                                 ": " + str(command))
+                return None
+            served = self.served.get(key, 0)
+            self.served[key] = served + 1
+            return results[min(served, len(results) - 1)]
+
+    ###########################################################################
+
+    def unused(self):
+        """
+        @returns: keys of recorded commands that haven't been replayed, to
+                  spot a flow that has stopped running something
+        """
+        with self.lock:
+            return [key for key in self.index if key not in self.served]
@@ -14,7 +14,8 @@ import termios
 sys.path.append("..")
 from ..lib.loggers import CyLogger
 from ..lib.loggers import LogPriority as lp
-from ..lib.run_commands import RunWith, runMyThreadCommand
+from ..lib.run_commands import RunWith
+from ..lib.command_pool import sharedPool
 
 class NotASaneNameError(Exception):
     """
@@ -73,13 +74,41 @@ class MenuComponent(object):
         
         self.previous = None
 
-        self.run = runMyThreadCommand
+        #####
+        # Menu actions run their commands on the shared pool, so picking
+        # one never blocks the menu
+        self.run = self.runInBackground
 
     def menuAction(self, *args, **kwargs):
         """
         """
         pass
 
+    def runInBackground(self, command, priority=0, **kwargs):
+        """
+        Run a command on the shared CommandPool without waiting for it, so
+        the menu stays responsive.
+
+        @returns: CommandFuture of the command's CommandResult
+        """
+        future = sharedPool(self.logger).run(command, priority, **kwargs)
+        future.addDoneCallback(self._ranInBackground)
+        return future
+
+    def _ranInBackground(self, future):
+        """
+        Log a background command that failed, nobody may be waiting on it.
+        """
+        err = future.exception(0)
+        if err is not None:
+            self.logger.log(lp.WARNING, "Command: " + str(future.command) + \
+                                        " failed: " + str(err))
+        elif not future.result(0).ok:
+            result = future.result(0)
+            self.logger.log(lp.WARNING, "Command: " + str(future.command) + \
+                                        " returned: " + str(result.retcode) + \
+                                        " stderr: " + str(result.stderr))
+
     def get_key(self):
         """
         Wait for a keypress and return a single character string.
@@ -0,0 +1,323 @@
+"""
+Long lived helper process that runs commands as another user.
+
+RunWith.liftDown runs each command through "su - user -c", paying for a
+login shell, PAM and environment setup every time.  A Coprocess goes
+through su once, starting a small python helper as the user, then sends it
+one request per command over the helper's stdin and reads the result back
+from its stdout.  Each command costs the helper one fork and exec.
+
+Requests and replies are JSON, each preceded by its length as a 4 byte big
+endian integer.  Command output is base64 encoded in the reply, so any
+bytes survive.  The helper exits when its stdin closes, or when it has been
+idle for idleTimeout seconds.  A timer stops and reaps an idle helper a
+little before that, so it isn't left a zombie, and a Coprocess whose
+helper has exited, or is about to, starts a new one on the next command.  A request is sent again
+only when writing it failed, which means the helper never got it, so no
+command runs twice.
+"""
+from __future__ import absolute_import
+import os
+import sys
+import json
+import time
+import base64
+import select
+import struct
+import threading
+from subprocess import Popen, PIPE
+
+from . loggers import CyLogger
+from . loggers import LogPriority as lp
+from . libHelperExceptions import NotACyLoggerError
+
+READY = "coprocess ready"
+
+#####
+# The helper, run by the target user's python.  Kept to what python 2.6
+# and later understand.
+HELPER = r'''
+import os, sys, json, base64, select, struct, subprocess
+idle = float(sys.argv[1])
+inp = sys.stdin.fileno()
+
+def readExact(size):
+    data = []
+    while size:
+        chunk = os.read(inp, size)
+        if not chunk:
+            return None
+        data.append(chunk)
+        size -= len(chunk)
+    return "".join(data)
+
+def writeAll(data):
+    while data:
+        data = data[os.write(1, data):]
+
+def native(value):
+    if isinstance(value, list):
+        return [native(item) for item in value]
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+writeAll("%s\n")
+while True:
+    if not select.select([inp], [], [], idle)[0]:
+        break
+    header = readExact(4)
+    if header is None:
+        break
+    request = json.loads(readExact(struct.unpack("!I", header)[0]))
+    command = native(request["command"])
+    try:
+        proc = subprocess.Popen(command, shell=isinstance(command, str),
+                                cwd=native(request.get("cwd")) or None,
+                                stdin=open(os.devnull),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, close_fds=True)
+        out, err = proc.communicate()
+        retcode = proc.returncode
+    except OSError, error:
+        out, err, retcode = "", str(error), 127
+    reply = json.dumps({"stdout": base64.b64encode(out),
+                        "stderr": base64.b64encode(err),
+                        "retcode": retcode})
+    writeAll(struct.pack("!I", len(reply)) + reply)
+''' % READY
+
+
+class CoprocessError(Exception):
+    """
+    Thrown when the helper can't be started, or stops answering.
+    """
+    def __init__(self, *args, **kwargs):
+        Exception.__init__(self, *args, **kwargs)
+
+###############################################################################
+
+class Coprocess(object):
+    """
+    Run commands as a user through one long lived helper process.
+
+    @method run(self, command, cwd=None)
+    @method isRunning(self)
+    @method close(self)
+    """
+    def __init__(self, user, logger, idleTimeout=60, startTimeout=30,
+                 launcher=None, python=sys.executable):
+        """
+        @param: user - name of the user to run commands as
+        @param: logger - CyLogger instance
+        @param: idleTimeout - seconds without a command before the helper
+                              exits
+        @param: startTimeout - seconds to wait for the helper to start
+        @param: launcher - command prefix the helper's shell command line
+                           is appended to, defaults to su to the user with
+                           a login shell
+        @param: python - python interpreter the helper runs with
+        """
+        if isinstance(logger, CyLogger):
+            self.logger = logger
+        else:
+            raise NotACyLoggerError("Passed in value for logger" +
+                                    " is invalid, try again.")
+        self.user = user
+        self.idleTimeout = idleTimeout
+        self.startTimeout = startTimeout
+        if launcher is None:
+            launcher = ["/usr/bin/su", "-", str(user), "-c"]
+        self.launcher = launcher
+        self.python = python
+        self.proc = None
+        self.starts = 0
+        self.lastUsed = 0
+        self.idleTimer = None
+        self.lock = threading.Lock()
+
+    ###########################################################################
+
+    def _idleDelay(self):
+        """
+        Seconds idle after which the helper is stopped from this side,
+        before it would time out and exit on its own.
+        """
+        return self.idleTimeout - min(1.0, self.idleTimeout / 2.0)
+
+    ###########################################################################
+
+    def isRunning(self):
+        """
+        True if the helper is up.
+        """
+        return self.proc is not None and self.proc.poll() is None
+
+    ###########################################################################
+
+    def _start(self):
+        """
+        Start the helper and wait for it to say it's ready.  Anything the
+        user's login scripts print before that is skipped.
+        """
+        bootstrap = "import base64;exec(base64.b64decode(\"" + \
+                    base64.b64encode(HELPER) + "\"))"
+        cmd = self.launcher + [self.python + " -c '" + bootstrap + "' " +
+                               str(float(self.idleTimeout))]
+        self.proc = Popen(cmd, stdin=PIPE, stdout=PIPE, close_fds=True)
+        self.starts += 1
+        deadline = time.time() + self.startTimeout
+        fd = self.proc.stdout.fileno()
+        output = ""
+        while READY + "\n" not in output:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                self._stop()
+                raise CoprocessError("Helper for " + str(self.user) +
+                                     " did not start")
+            data = os.read(fd, 4096)
+            if not data:
+                self._stop()
+                raise CoprocessError("Helper for " + str(self.user) +
+                                     " exited while starting")
+            output += data
+        self.logger.log(lp.DEBUG, "Started helper for " + str(self.user) +
+                        ", pid " + str(self.proc.pid))
+
+    ###########################################################################
+
+    def _readExact(self, size):
+        """
+        Read exactly size bytes of reply.
+        """
+        data = self.proc.stdout.read(size)
+        if len(data) != size:
+            raise CoprocessError("Helper for " + str(self.user) +
+                                 " stopped answering")
+        return data
+
+    ###########################################################################
+
+    def _send(self, request):
+        """
+        Write one request to the helper.
+        """
+        payload = json.dumps(request)
+        self.proc.stdin.write(struct.pack("!I", len(payload)) + payload)
+        self.proc.stdin.flush()
+
+    ###########################################################################
+
+    def _receive(self):
+        """
+        Read the reply to the last request.
+        """
+        size = struct.unpack("!I", self._readExact(4))[0]
+        return json.loads(self._readExact(size))
+
+    ###########################################################################
+
+    def run(self, command, cwd=None):
+        """
+        Run a command as the user.
+
+        @param: command - argv list, or a string run with the shell
+        @param: cwd - directory to run the command in
+
+        @returns: (stdout, stderr, retcode)
+
+        @note: If the helper fails after the request went out, the command
+               may or may not have run, so CoprocessError is raised rather
+               than running it again.
+        """
+        request = {"command": command, "cwd": cwd}
+        with self.lock:
+            #####
+            # Don't race a helper about to hit its idle timeout
+            if self.isRunning() and \
+               time.time() - self.lastUsed > self._idleDelay():
+                self._stop()
+            for attempt in [1, 2]:
+                if not self.isRunning():
+                    self._stop()
+                    self._start()
+                try:
+                    self._send(request)
+                    break
+                except IOError, err:
+                    #####
+                    # The helper exited before it read the request, so the
+                    # command didn't run, try once more with a new one.
+                    self.logger.log(lp.DEBUG, "Helper for " + str(self.user) +
+                                    " went away: " + str(err))
+                    self._stop()
+                    if attempt == 2:
+                        raise CoprocessError("Helper for " + str(self.user) +
+                                             " failed: " + str(err))
+            try:
+                reply = self._receive()
+            except (IOError, ValueError, CoprocessError), err:
+                self._stop()
+                raise CoprocessError("Helper for " + str(self.user) +
+                                     " failed running " + str(command) +
+                                     ": " + str(err))
+            self.lastUsed = time.time()
+            if self.idleTimer is None:
+                self._scheduleIdleStop(self._idleDelay())
+        return base64.b64decode(reply["stdout"]), \
+               base64.b64decode(reply["stderr"]), reply["retcode"]
+
+    ###########################################################################
+
+    def _scheduleIdleStop(self, delay):
+        """
+        Check for an idle helper in delay seconds.
+        """
+        self.idleTimer = threading.Timer(delay, self._idleStop)
+        self.idleTimer.daemon = True
+        self.idleTimer.start()
+
+    def _idleStop(self):
+        """
+        Stop and reap the helper once it has been idle long enough, or
+        check again when it will have been.
+        """
+        with self.lock:
+            self.idleTimer = None
+            if self.proc is None:
+                return
+            remaining = self.lastUsed + self._idleDelay() - time.time()
+            if remaining > 0:
+                self._scheduleIdleStop(remaining)
+            else:
+                self.logger.log(lp.DEBUG, "Stopping idle helper for " +
+                                str(self.user))
+                self._stop()
+
+    ###########################################################################
+
+    def _stop(self):
+        """
+        Close the helper's stdin, which tells it to exit, and reap it.
+        """
+        if self.proc is None:
+            return
+        for pipe in [self.proc.stdin, self.proc.stdout]:
+            try:
+                pipe.close()
+            except IOError:
+                pass
+        self.proc.wait()
+        self.proc = None
+
+    ###########################################################################
+
+    def close(self):
+        """
+        Stop the helper.
+        """
+        with self.lock:
+            if self.idleTimer is not None:
+                self.idleTimer.cancel()
+                self.idleTimer = None
+            self._stop()
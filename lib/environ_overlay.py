@@ -0,0 +1,97 @@
+"""
+Point the temporary files of commands at a ramdisk.
+
+Tools write their scratch files wherever TMPDIR, TMP and TEMP say, /tmp
+by default, even with a ramdisk mounted.  An EnvironOverlay is an
+environment for a command that sets a few variables on top of another one,
+os.environ by default, reading through to it for everything else instead
+of copying it for each command.  tempEnviron makes a directory for one
+command under a ramdisk's mount point, gives an overlay pointing the
+temporary file variables into it, and removes it when the command is done.
+"""
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+from collections import Mapping
+from contextlib import contextmanager
+
+#####
+# Variables tools look at for where to put temporary files
+TEMP_VARIABLES = ["TMPDIR", "TMP", "TEMP"]
+
+
+class EnvironOverlay(Mapping):
+    """
+    Read only environment of a few variables over another environment.
+
+    Usable wherever Popen, os.execve or posix_spawn take an environment.
+    """
+    def __init__(self, overrides, base=None, remove=()):
+        """
+        @param: overrides - dictionary of variables to set
+        @param: base - environment under them, os.environ if None
+        @param: remove - names of variables of base to leave out
+        """
+        if base is None:
+            base = os.environ
+        self.base = base
+        self.overrides = dict(overrides)
+        self.removed = frozenset(remove)
+
+    def __getitem__(self, key):
+        if key in self.overrides:
+            return self.overrides[key]
+        if key in self.removed:
+            raise KeyError(key)
+        return self.base[key]
+
+    def __iter__(self):
+        for key in self.overrides:
+            yield key
+        for key in self.base:
+            if key not in self.overrides and key not in self.removed:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "EnvironOverlay(%r)" % (self.overrides,)
+
+###############################################################################
+
+def makeTempEnviron(root, base=None, xdgCache=False):
+    """
+    Make a directory for one command's temporary files under root, and an
+    environment pointing TMPDIR, TMP and TEMP at it.
+
+    @param: root - directory to make it in, a ramdisk's mount point
+    @param: base - environment to add to, os.environ if None
+    @param: xdgCache - point XDG_CACHE_HOME at it too
+
+    @returns: (directory, EnvironOverlay).  The directory is the caller's
+              to remove.
+    """
+    directory = tempfile.mkdtemp(prefix="cmd-", dir=str(root))
+    overrides = dict([(name, directory) for name in TEMP_VARIABLES])
+    if xdgCache:
+        overrides["XDG_CACHE_HOME"] = directory
+    return directory, EnvironOverlay(overrides, base)
+
+###############################################################################
+
+@contextmanager
+def tempEnviron(root, base=None, xdgCache=False):
+    """
+    Context manager giving an environment whose temporary files go to a
+    new directory under root, removed with everything in it on the way out.
+
+    with tempEnviron("/mnt/ramdisk") as env:
+        runner.run(command, env=env)
+    """
+    directory, environ = makeTempEnviron(root, base, xdgCache)
+    try:
+        yield environ
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -18,9 +18,11 @@ from subprocess import Popen, STDOUT, PIPE
 from .loggers import CyLogger
 from .loggers import LogPriority as lp
 from .run_commands import RunWith
+from .command_cache import CommandCache
+from .pty_session import waitForNoEcho
 
 logger = CyLogger()
-run = RunWith(logger)
+run = RunWith(logger, cache=CommandCache())
 
 ###########################################################################
 
@@ -127,7 +129,10 @@ def is_laptop():
     
     cmd = ["/usr/sbin/system_profiler", "SPHardwareDataType"]
     
-    retval, reterr = Popen(cmd, stdout=PIPE, stderr=PIPE).communicate()
+    #####
+    # The hardware doesn't change while we run, ask system_profiler once
+    run.setCommand(cmd)
+    retval, reterr, _ = run.communicate(ttl=-1)
     
     if not reterr :
         if retval :
@@ -259,18 +264,12 @@ def waitnoecho (fileDescriptor, timeout=3):
     If timeout is None or negative, then this method to block forever until
     ECHO flag is False.
 
+    Wakes up on output from the terminal, or with a backoff, rather than
+    sleeping a tenth of a second between checks.
+
     Borrowed from pexpect - acceptable to license
     """
-    if timeout is not None and timeout > 0:
-        end_time = time.time() + timeout
-    while True:
-        if not getecho(fileDescriptor):
-            return True
-        if timeout < 0 and timeout is not None:
-            return False
-        if timeout is not None:
-            timeout = end_time - time.time()
-        time.sleep(0.1)
+    return waitForNoEcho(fileDescriptor, timeout, fileDescriptor)
 
 ###########################################################################
 
@@ -0,0 +1,289 @@
+"""
+Write log records from a background thread.
+
+The file, console and syslog handlers CyLogger sets up write in the thread
+that logs, so a slow disk or syslog shows up in whatever that thread is
+timing.  A QueueHandler takes their place on the logger.  It puts records
+on a bounded queue and returns, and a QueueListener thread hands them to
+the real handlers, which format and write them.
+
+When the queue is full the OverflowPolicy decides what gives: the caller
+waits for room, the oldest record is dropped, or only a sample of the new
+records gets in.  Running listeners are stopped, flushing their queues,
+when the program exits.
+"""
+from __future__ import absolute_import
+import time
+import atexit
+import logging
+import threading
+import weakref
+from collections import deque
+
+#####
+# Listeners running, stopped when the program exits
+_listeners = weakref.WeakSet()
+
+
+class InvalidOverflowPolicyError(Exception):
+    """
+    Custom Exception
+    """
+    def __init__(self, *args, **kwargs):
+        Exception.__init__(self, *args, **kwargs)
+
+
+class OverflowPolicy(object):
+    """
+    What a QueueHandler does with a record when its queue is full.
+
+    BLOCK       - wait for the listener to make room (default), nothing is
+                  lost
+    DROP_OLDEST - drop the oldest queued record to make room
+    SAMPLE      - let one in every sampleRate new records in, in place of
+                  the oldest, and drop the others
+    """
+    BLOCK = "block"
+    DROP_OLDEST = "drop-oldest"
+    SAMPLE = "sample"
+    ALL = [BLOCK, DROP_OLDEST, SAMPLE]
+
+
+class QueueHandler(logging.Handler):
+    """
+    Handler putting records on a bounded queue for a QueueListener.
+
+    @method emit(self, record)
+    @method get(self)
+    @method taskDone(self)
+    @method join(self, timeout=None)
+    @method close(self)
+    """
+    def __init__(self, size=10000, overflow=OverflowPolicy.BLOCK,
+                 sampleRate=10):
+        """
+        @param: size - most records queued
+        @param: overflow - OverflowPolicy for a full queue
+        @param: sampleRate - with SAMPLE, one in this many records gets in
+        """
+        logging.Handler.__init__(self)
+        if overflow not in OverflowPolicy.ALL:
+            raise InvalidOverflowPolicyError("Not an overflow policy: " +
+                                             str(overflow))
+        self.size = max(1, int(size))
+        self.overflow = overflow
+        self.sampleRate = max(1, int(sampleRate))
+        self.records = deque()
+        self.condition = threading.Condition(threading.Lock())
+        self.unfinished = 0
+        self.overflowed = 0
+        self.dropped = 0
+        self.closing = False
+        #####
+        # Where records go once the listener has stopped
+        self.fallback = None
+
+    ###########################################################################
+
+    def emit(self, record):
+        """
+        Queue a record.  Formatting is left to the listener, only the
+        message is put together here, while its arguments are as they
+        were when it was logged.
+        """
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            #####
+            # Tracebacks hold on to frames, keep the text instead
+            self.format(record)
+            record.exc_info = None
+        with self.condition:
+            fallback = self.fallback
+            if fallback is None:
+                if len(self.records) >= self.size:
+                    self.overflowed += 1
+                    if self.overflow == OverflowPolicy.BLOCK:
+                        while len(self.records) >= self.size and \
+                              self.fallback is None:
+                            self.condition.wait()
+                        fallback = self.fallback
+                    elif self.overflow == OverflowPolicy.SAMPLE and \
+                         self.overflowed % self.sampleRate:
+                        self.dropped += 1
+                        return
+                    else:
+                        self.records.popleft()
+                        self.unfinished -= 1
+                        self.dropped += 1
+                if fallback is None:
+                    self.records.append(record)
+                    self.unfinished += 1
+                    self.condition.notify_all()
+                    return
+        #####
+        # Written outside the condition, so the listener isn't held up
+        fallback(record)
+
+    ###########################################################################
+
+    def get(self):
+        """
+        Take the oldest record, waiting for one.
+
+        @returns: the record, None once the queue is closed and empty
+        """
+        with self.condition:
+            while not self.records and not self.closing:
+                self.condition.wait()
+            if not self.records:
+                return None
+            record = self.records.popleft()
+            self.condition.notify_all()
+            return record
+
+    ###########################################################################
+
+    def taskDone(self):
+        """
+        Mark a record taken with get() as handled.
+        """
+        with self.condition:
+            self.unfinished -= 1
+            self.condition.notify_all()
+
+    ###########################################################################
+
+    def join(self, timeout=None):
+        """
+        Wait for the records queued so far to be handled.
+
+        @returns: True if they were, False if the timeout ran out first
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self.condition:
+            while self.unfinished > 0:
+                if deadline is None:
+                    self.condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self.condition.wait(remaining)
+            return True
+
+    ###########################################################################
+
+    def close(self):
+        """
+        Let get() return None once the records queued are taken.
+        """
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        logging.Handler.close(self)
+
+###############################################################################
+
+class QueueListener(object):
+    """
+    Thread handing queued records to the handlers that write them.
+
+    @method start(self)
+    @method stop(self, timeout=5.0)
+    """
+    def __init__(self, queue, handlers):
+        """
+        @param: queue - QueueHandler the records come from
+        @param: handlers - handlers to write them with
+        """
+        self.queue = queue
+        self.handlers = list(handlers)
+        self.thread = None
+        self.reported = 0
+        #####
+        # Records are written by one thread at a time, the listener's or,
+        # once it is stopping, the ones logging them
+        self.lock = threading.RLock()
+
+    ###########################################################################
+
+    def start(self):
+        """
+        Start the thread, and flush the queue when the program exits.
+        """
+        self.thread = threading.Thread(target=self._listen,
+                                       name="QueueListener")
+        self.thread.daemon = True
+        self.thread.start()
+        _listeners.add(self)
+
+    ###########################################################################
+
+    def _listen(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            try:
+                self._handle(record)
+                self._reportDropped()
+            finally:
+                self.queue.taskDone()
+
+    def _handle(self, record):
+        with self.lock:
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def _reportDropped(self):
+        """
+        Say how many records were dropped since the last time, once the
+        queue has drained.
+        """
+        dropped = self.queue.dropped
+        if dropped > self.reported and not self.queue.records:
+            self._handle(logging.makeLogRecord(
+                {"levelno": logging.WARNING, "levelname": "WARNING",
+                 "msg": str(dropped - self.reported) +
+                        " log records dropped, the log queue was full"}))
+            self.reported = dropped
+
+    ###########################################################################
+
+    def stop(self, timeout=5.0):
+        """
+        Write what is queued, flush the handlers and stop the thread.
+        From the time stop is called, records logged are written in the
+        thread logging them, taking turns with the listener while it
+        drains the queue.  Safe to call more than once.
+        """
+        if self.thread is None:
+            return
+        thread, self.thread = self.thread, None
+        _listeners.discard(self)
+        with self.queue.condition:
+            self.queue.fallback = self._handle
+            self.queue.condition.notify_all()
+        self.queue.close()
+        thread.join(timeout)
+        for handler in self.handlers:
+            try:
+                handler.flush()
+            except Exception:
+                pass
+
+###############################################################################
+
+def _stopListeners():
+    """
+    Flush and stop the listeners still running when the program exits.
+    """
+    for listener in list(_listeners):
+        listener.stop()
+
+atexit.register(_stopListeners)
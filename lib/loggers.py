@@ -18,13 +18,13 @@ import re
 import sys
 import time
 import socket
-import inspect
 import datetime
 import traceback
 import logging
 import logging.handlers
 
 from . singleton import Singleton
+from . log_queue import QueueHandler, QueueListener, OverflowPolicy
 #from logging.handlers import RotatingFileHandler
 #sys.path.append("..")
 ###############################################################################
@@ -130,6 +130,8 @@ class CyLogger(Singleton):
         self.syslog = False
         self.logr = None
         self.logrs = {"root" : ""}
+        self.queueHandler = None
+        self.listener = None
 
     #############################################
 
@@ -182,7 +184,10 @@ class CyLogger(Singleton):
                        logCount=10,
                        size=10000000,
                        syslog=True,
-                       myconsole=True):
+                       myconsole=True,
+                       asynchronous=False,
+                       queueSize=10000,
+                       overflow=OverflowPolicy.BLOCK):
         """
         Sets up some basic logging.  For more configurable logging, use the
         setUpLogger & setUpHandler methods.
@@ -206,6 +211,17 @@ class CyLogger(Singleton):
 
         @param: console: Whether or not to log to the console. Bool
 
+        @param: asynchronous: Write the logs from a background thread, so
+                              logging costs the caller a queue append.
+                              Bool
+
+        @param: queueSize: if asynchronous, the most records waiting to be
+                           written.  Int
+
+        @param: overflow: if asynchronous, an OverflowPolicy, what to do
+                          with a record when the queue is full: block,
+                          drop-oldest or sample.  String
+
         @NOTE: This only sets up the root logger.
 
         @note: Interface borrowed from Stonix's LogDispatcher.initializeLogs
@@ -282,22 +298,42 @@ class CyLogger(Singleton):
                 print("Socket error, can't connect to syslog...")
                 self.syslog = False
 
+        #####
+        # Handlers the logs are written with, in the calling thread, or
+        # in the listener's thread if asynchronous
+        if self.listener is not None:
+            #####
+            # Set up again, stop the last listener after it has written
+            # what it has
+            self.listener.stop()
+            self.logr.removeHandler(self.queueHandler)
+            self.listener = None
+            self.queueHandler = None
+        if asynchronous:
+            self.queueHandler = QueueHandler(queueSize, overflow)
+            self.logr.addHandler(self.queueHandler)
+            self.listener = QueueListener(self.queueHandler, [])
+            self.listener.start()
+            addHandler = self.listener.handlers.append
+        else:
+            addHandler = self.logr.addHandler
+
         #####
         # Add applicable handlers to the logger
         if not self.rotate and self.fileHandler:
-            self.logr.addHandler(fileHandler)
+            addHandler(fileHandler)
             self.logr.log(LogPriority.DEBUG,"Added FileHandler")
         elif self.rotate:
-            self.logr.addHandler(rotHandler)
+            addHandler(rotHandler)
             self.logr.log(LogPriority.DEBUG,"Added RotatingFileHandler")
             #self.doRollover(rotHandler)
 
         if myconsole:
-            self.logr.addHandler(conHandler)
+            addHandler(conHandler)
             self.logr.log(LogPriority.DEBUG,"Added StreamHandler")
         if self.syslog:
             try:
-                self.logr.addHandler(sysHandler)
+                addHandler(sysHandler)
                 self.logr.log(LogPriority.DEBUG,"Added SyslogHanlder")
             except socket.error:
                 self.log(40, "Syslog not accepting connections!")
@@ -333,75 +369,70 @@ class CyLogger(Singleton):
 
     #############################################
 
-    def log(self, priority, msg):
+    def flush(self, timeout=None):
+        """
+        Wait for the logs queued so far to be written, when logging
+        asynchronously.  For instance before timing something, so the
+        writes don't land in the measurement.
+
+        @returns: True if they were written, False if the timeout ran out
+
+        @author: Roy Nielsen
+        """
+        if self.queueHandler is None:
+            return True
+        return self.queueHandler.join(timeout)
+
+    #############################################
+
+    def isEnabledFor(self, priority):
+        """
+        Whether a message of this priority would be logged, so callers can
+        skip building messages that would be dropped.
+
+        @author: Roy Nielsen
+        """
+        return self.logr is not None and self.logr.isEnabledFor(priority)
+
+    #############################################
+
+    def log(self, priority, msg, stacklevel=1):
         """
         Interface to work similar to Stonix's LogDispatcher.py
 
+        @param: stacklevel - 1 to name the caller in the prefix, 2 for its
+                             caller, for helpers that log for others
+
         @note: Stonix's LogDispatcher.py authored by: scmcleni
+        @note: Checks the level before anything else, so a message that
+               won't be logged costs a dictionary lookup and a level
+               check.  Caller, timestamp and prefix are only worked out
+               for messages that are.
 
         @author: Roy Nielsen
         """
-        pri = str(priority)
-        if re.match("^\d\d$", pri) and self.validateLevel():
-            validatedLvl = int(pri)
-        else:
-            raise IllegalLoggingLevelError("Cannot log at this priority level: " + pri)
-        
-        if not msg:
+        try:
+            validatedLvl = PRIORITIES.get(priority)
+        except TypeError:
+            validatedLvl = None
+        if validatedLvl is None:
+            raise IllegalLoggingLevelError("Cannot log at this priority level: " + str(priority))
+
+        logr = self.logr
+        if not msg or logr is None or \
+           logr.manager.disable >= validatedLvl or \
+           validatedLvl < logr.getEffectiveLevel():
             return
-        
-        ####
-        # Use the datetime library to get the time for a timestamp
-        # using format YYYYi-MM-DD-HH-MM-SS
-        # Only dash separators are used to make for easy numeric processing
-        # using local time so the time stamp can be correlated with 
-        # system logs...
-        datestamp = datetime.datetime.now()
-        timestamp = datestamp.strftime("%Y-%m-%d-%H-%M-%S")
+        self.validateLevel()
+        pri = str(validatedLvl)
 
         #####
-        # Get the name of the program using this library
-        prog = sys.argv[0].split("/")[-1]
-
-        #####
-        # Get the filename of the code calling CrazyLogger.log()
-        # members = inspect.getmembers(inspect.stack(), inspect.iscode)
-        # print "Members: " + str(members)
-        # co_filename = members[1][3]
-
-        (frame, fullLengthFilename, line_number, function_name, lines, index) = inspect.getouterframes(inspect.currentframe())[1]
-        filename = fullLengthFilename.split("/")[-1]
-
-        if not self.syslog:
-            #####
-            # longPrefix message to be in the format: 
-            # <timestamp> <calling_script_name> : <filename_of_calling_function>, <name_of_calling_function> (<line number of calling function>)
-            longPrefix = '{} {} : {}, {} ({}) '.format(str(timestamp),
-                                                       str(prog), 
-                                                       str(filename), 
-                                                       str(function_name), 
-                                                       str(line_number))
-            #####
-            # shorterFormat message to be in the format: 
-            # <timestamp> <calling_script_name> : <name_of_calling_function> (<line number of calling function>)
-            shortFormat = '{} {} : {} ({}) '.format(str(timestamp),
-                                                    str(prog),
-                                                    str(function_name),
-                                                    str(line_number))
+        # Quiet, no prefix or formatting...
+        if int(self.lvl) > 0 and int(self.lvl) < 10:
+            prefix = ""
         else:
-            #####
-            # longPrefix message to be in the format: 
-            # <calling_script_name> : <filename_of_calling_function>, <name_of_calling_function> (<line number of calling function>)
-            longPrefix = '{} : {}, {} ({}) '.format(str(prog), 
-                                                    str(filename), 
-                                                    str(function_name), 
-                                                    str(line_number))
-            #####
-            # shorterFormat message to be in the format: 
-            # <calling_script_name> : <name_of_calling_function> (<line number of calling function>)
-            shortFormat = '{} : {} ({}) '.format(str(prog),
-                                                 str(function_name), 
-                                                 str(line_number))
+            prefix = self._prefix(stacklevel + 1) + "DEBUG: (" + pri + ") "
+
         msg_list = []
         if isinstance(msg, list):
             msg_list = msg
@@ -416,42 +447,66 @@ class CyLogger(Singleton):
             msg_list = msg
 
         for line in msg_list:
+            try:
+                logr.log(validatedLvl, prefix + str(line))
+            except Exception, err:
+                logr.log(LogPriority.DEBUG, str(traceback.format_exc()))
+                logr.log(LogPriority.DEBUG, str(err))
+
+    #############################################
+
+    def _prefix(self, depth):
+        """
+        Prefix of a message, naming the code that logged it, depth frames
+        up from here.
+
+        @author: Roy Nielsen
+        """
+        #####
+        # Get the name of the program using this library
+        prog = sys.argv[0].split("/")[-1]
+
+        #####
+        # Get the filename of the code calling CrazyLogger.log(), from its
+        # frame alone, inspect.getouterframes would read the source of
+        # every frame on the stack
+        frame = sys._getframe(depth)
+        filename = frame.f_code.co_filename.split("/")[-1]
+        function_name = frame.f_code.co_name
+        line_number = frame.f_lineno
+
+        if self.syslog:
             #####
-            # Process via logging level
-            if int(self.lvl) > 0 and int(self.lvl) < 10:
-                # Quiet, no prefix or formatting...
-                self.logr.log(validatedLvl, str(line))
-    
-            elif int(self.lvl) >= 10 and int(self.lvl) < 20:
-                #####
-                # Debug
-                self.logr.log(validatedLvl, longPrefix + "DEBUG: (" + pri + ") " + str(line))
-            elif int(self.lvl) >= 20 and int(self.lvl) < 30:
-                #####
-                # Info
-                self.logr.log(validatedLvl, longPrefix + "DEBUG: (" + pri + ") " + str(line))
-            elif int(self.lvl) >=30 and int(self.lvl) < 40:
-                #####
-                # Warning
-                try:
-                    self.logr.log(validatedLvl, longPrefix + "DEBUG: (" + str(pri) + ") " + str(line))
-                except Exception, err:
-                    self.logr.log(LogPriority.DEBUG, str(traceback.format_exc()))
-                    self.logr.log(LogPriority.DEBUG, str(err))
-            elif int(self.lvl) >= 40 and int(self.lvl) < 50:
-                #####
-                # Error
-                self.logr.log(validatedLvl, longPrefix + "DEBUG: (" + pri + ") " + str(line))
-            elif int(self.lvl) >= 50 and int(self.lvl) < 60:
-                #####
-                # Critical
-                self.logr.log(validatedLvl, longPrefix + "DEBUG: (" + pri + ") " + str(line))
-            else:
-                raise IllegalLoggingLevelError("Not a valid value for a logging level.")
+            # longPrefix message to be in the format:
+            # <calling_script_name> : <filename_of_calling_function>, <name_of_calling_function> (<line number of calling function>)
+            return '{} : {}, {} ({}) '.format(prog, filename, function_name,
+                                              line_number)
+        ####
+        # Use the datetime library to get the time for a timestamp
+        # using format YYYYi-MM-DD-HH-MM-SS
+        # Only dash separators are used to make for easy numeric processing
+        # using local time so the time stamp can be correlated with
+        # system logs...
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+        #####
+        # longPrefix message to be in the format:
+        # <timestamp> <calling_script_name> : <filename_of_calling_function>, <name_of_calling_function> (<line number of calling function>)
+        return '{} {} : {}, {} ({}) '.format(timestamp, prog, filename,
+                                             function_name, line_number)
 
 ###############################################################################
 # Helper class
 
+#####
+# Priorities CyLogger.log takes, two digit numbers or their strings, to
+# the number
+PRIORITIES = {}
+for _level in range(10, 100):
+    PRIORITIES[_level] = _level
+    PRIORITIES[str(_level)] = _level
+del _level
+
+
 class LogPriority(object):
     """
     Similar to LogPriority in the Stonix project LogDispatcher, only using
@@ -19,6 +19,7 @@ from subprocess import Popen
 from .manage_user_template import ManageUserTemplate
 from .manage_user_template import BadUserInfoError
 from lib.run_commands import RunWith
+from lib.command_batch import CommandBatch
 from lib.loggers import LogPriority as lp
 from lib.loggers import CyLogger
 from lib.libHelperExceptions import NotACyLoggerError
@@ -367,24 +368,29 @@ class MacOSUser(ManageUserTemplate):
         success = False
         grps = "/usr/bin/groups"
 
-        for user in self.userData:
-            #####
-            # Run the 'groups <user>' command to acquire the user's groups
-            cmd = [grps, user]
-            self.runWith.setCommand(cmd)
-            self.runWith.communicate()
-            retval, reterr, retcode = self.runWith.getNlogReturns()
+        #####
+        # Run 'groups <user>' for every user at once, instead of one at a
+        # time, to acquire the users' groups
+        users = list(self.userData)
+        batch = CommandBatch(self.logger)
+        for user, result in zip(users, batch.run([[grps, user]
+                                                  for user in users])):
             #####
             # If there is no error, process the data.
-            if not reterr:
+            if result.ok and not result.stderr:
                 #####
                 # Acquire the user's groups from the output
-                userGrps = retval.split()
+                userGrps = result.stdout.split()
                 #####
                 # create a dictionary, which will later be added to userData
                 # class variable.
                 groups = {'groups' : userGrps}
                 #####
                 # Add the groups the user is a member of.
-                self.userData[user] += groups
+                self.userData[user].update(groups)
+                success = True
+            else:
+                self.logger.log(lp.INFO, "Could not acquire groups for " +
+                                str(user) + ": " +
+                                str(result.error or result.stderr))
         return success
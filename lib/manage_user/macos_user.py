@@ -84,6 +84,8 @@ class MacOSUser(ManageUserTemplate):
     @method rmUser
     @method rmUserFromGroup
     @method rmUserHome
+    #----- Helper processes
+    @method closeHelpers
 
     @author: Roy Nielsen
     """
@@ -97,6 +99,9 @@ class MacOSUser(ManageUserTemplate):
         userUid
         userPriGid
         userHomeDir
+        persistent - when running as root, run dscl as the user through one
+                     long lived helper process instead of su for every
+                     command, stop it with closeHelpers()
         """
         if 'logDispatcher' not in kwargs:
             raise ValueError("Variable 'logDispatcher' a required " +
@@ -107,6 +112,7 @@ class MacOSUser(ManageUserTemplate):
 
         self.dscl = "/usr/bin/dscl"
         self.runner = RunWith(self.logger)
+        self.persistent = kwargs.get('persistent', False)
 
         self.users = self.getUsers()
 
@@ -908,6 +914,9 @@ class MacOSUser(ManageUserTemplate):
         success = False
 
         if self.isSaneUserName(user):
+            #####
+            # Don't leave a helper running as a user that is gone
+            self.closeHelpers()
             cmd = [self.dscl, ".", "-delete", "/Users/" + str(user)]
             self.runner.setCommand(cmd)
             self.runner.communicate()
@@ -1095,21 +1104,22 @@ class MacOSUser(ManageUserTemplate):
             cmd = [self.dscl] + subCmd
             #####
             # set up the command
-            self.runWith.setCommand(cmd)
+            self.runner.setCommand(cmd)
             
             if re.match("^0$", str(uid)):
                 #####
                 # If the running process is running as an admin, lower to the
                 # user context to run dscl as the user.  The user proerty
                 # should be set with the setUser method. Lift = elevator...
-                output, error, retcode = self.runWith.liftDown(self.userName)
+                output, error, retcode = self.runner.liftDown(
+                    self.userName, persistent=self.persistent)
                 self.logger.log(lp.ERROR, "Took the lift down...")
                 if not str(error).strip():
                     success = True
             else:
                 #####
                 # Run the command
-                output, error, retcode = self.runWith.communicate()
+                output, error, retcode = self.runner.communicate()
                 self.logger.log(lp.INFO, "DSCL cmd ran in current context..")
 
                 if not str(error).strip():
@@ -1228,6 +1238,16 @@ class MacOSUser(ManageUserTemplate):
 
     # ----------------------------------------------------------------------
 
+    def closeHelpers(self):
+        """
+        Stop the helper processes the persistent option started.
+
+        @author: Roy Nielsen
+        """
+        self.runner.closeCoprocesses()
+
+    # ----------------------------------------------------------------------
+
     def isUserAnAdmin(self, userName=""):
         """
         Check if this user is in this group
@@ -0,0 +1,229 @@
+"""
+Start commands with posix_spawn instead of fork and exec.
+
+subprocess.Popen forks the whole python process before exec'ing the
+command, copying its page tables, which gets slow once the process holds a
+large heap.  posix_spawn, called through ctypes on the libc handle RunWith
+already has, starts the command without that copy: glibc does it with
+vfork semantics, and macOS in the kernel.
+
+Only plain commands are handled: an argv list or a shell string, an
+environment, stdout and stderr pipes, and optionally a new process group.
+Anything else, a cwd, close_fds or a preexec_fn, is left to Popen, see
+RunWith.setSpawn.
+"""
+from __future__ import absolute_import
+import os
+import errno
+import fcntl
+import signal
+import ctypes
+
+#####
+# Flag for posix_spawnattr_setflags, the same on Linux and macOS
+POSIX_SPAWN_SETPGROUP = 0x02
+
+#####
+# posix_spawn_file_actions_t and posix_spawnattr_t are opaque, sized
+# differently by each libc.  These are larger than any of them.
+FILE_ACTIONS_SIZE = 256
+ATTR_SIZE = 1024
+
+
+class SpawnError(Exception):
+    """
+    Custom Exception
+    """
+    def __init__(self, *args, **kwargs):
+        Exception.__init__(self, *args, **kwargs)
+
+
+class SpawnedProcess(object):
+    """
+    The parts of a Popen object readPipes and terminateGroup use, for a
+    process started with posix_spawn.
+    """
+    def __init__(self, pid, stdout, stderr):
+        self.pid = pid
+        self.stdin = None
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+
+    def _setStatus(self, status):
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+
+    def poll(self):
+        if self.returncode is None:
+            try:
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+            except OSError, err:
+                if err.errno != errno.ECHILD:
+                    raise
+                self.returncode = 0
+            else:
+                if pid == self.pid:
+                    self._setStatus(status)
+        return self.returncode
+
+    def wait(self):
+        while self.returncode is None:
+            try:
+                _, status = os.waitpid(self.pid, 0)
+            except OSError, err:
+                if err.errno == errno.EINTR:
+                    continue
+                if err.errno != errno.ECHILD:
+                    raise
+                self.returncode = 0
+            else:
+                self._setStatus(status)
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.returncode is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class Spawner(object):
+    """
+    posix_spawn through ctypes.
+
+    @method available(self)
+    @method spawn(self, command, env=None, shell=False, newGroup=False)
+    """
+    def __init__(self, libc):
+        """
+        @param: libc - ctypes handle on libc, see getLibc
+        """
+        self.posix_spawnp = None
+        try:
+            self.posix_spawnp = libc.posix_spawnp
+            self.actionsInit = libc.posix_spawn_file_actions_init
+            self.actionsDestroy = libc.posix_spawn_file_actions_destroy
+            self.actionsDup2 = libc.posix_spawn_file_actions_adddup2
+            self.attrInit = libc.posix_spawnattr_init
+            self.attrDestroy = libc.posix_spawnattr_destroy
+            self.attrSetFlags = libc.posix_spawnattr_setflags
+            self.attrSetPgroup = libc.posix_spawnattr_setpgroup
+        except AttributeError:
+            self.posix_spawnp = None
+            return
+        self.posix_spawnp.restype = ctypes.c_int
+        self.posix_spawnp.argtypes = [ctypes.POINTER(ctypes.c_int),
+                                      ctypes.c_char_p, ctypes.c_void_p,
+                                      ctypes.c_void_p,
+                                      ctypes.POINTER(ctypes.c_char_p),
+                                      ctypes.POINTER(ctypes.c_char_p)]
+        self.actionsDup2.argtypes = [ctypes.c_void_p, ctypes.c_int,
+                                     ctypes.c_int]
+        self.attrSetFlags.argtypes = [ctypes.c_void_p, ctypes.c_short]
+        self.attrSetPgroup.argtypes = [ctypes.c_void_p, ctypes.c_int]
+
+    ###########################################################################
+
+    def available(self):
+        """
+        @returns: True if libc has posix_spawnp
+        """
+        return self.posix_spawnp is not None
+
+    ###########################################################################
+
+    def _strings(self, values):
+        """
+        NULL terminated array of C strings.
+        """
+        array = (ctypes.c_char_p * (len(values) + 1))()
+        array[:len(values)] = values
+        array[len(values)] = None
+        return array
+
+    ###########################################################################
+
+    def _pipe(self):
+        """
+        A pipe neither end of which is inherited by commands, the child's
+        end is dup2'ed onto stdout or stderr, which clears the flag there.
+        Keeps commands other threads start from holding our pipes open.
+        """
+        ends = os.pipe()
+        for fd in ends:
+            fcntl.fcntl(fd, fcntl.F_SETFD,
+                        fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        return ends
+
+    ###########################################################################
+
+    def _check(self, result, what):
+        if result != 0:
+            raise SpawnError(what + " failed: " + os.strerror(result))
+
+    ###########################################################################
+
+    def spawn(self, command, env=None, shell=False, newGroup=False):
+        """
+        Start a command with its stdout and stderr on pipes.
+
+        @param: command - argv list, or a string for the shell
+        @param: env - environment dictionary, os.environ if None
+        @param: shell - run a string with /bin/sh -c, like Popen
+        @param: newGroup - make the command lead its own process group, for
+                           terminateGroup
+
+        @returns: SpawnedProcess
+        """
+        if not self.available():
+            raise SpawnError("posix_spawnp is not available")
+        if isinstance(command, basestring):
+            command = [command]
+        if shell:
+            command = ["/bin/sh", "-c"] + list(command)
+        if env is None:
+            env = os.environ
+        argv = self._strings([str(arg) for arg in command])
+        envp = self._strings(["%s=%s" % item for item in env.items()])
+
+        outRead, outWrite = self._pipe()
+        errRead, errWrite = self._pipe()
+        actions = ctypes.create_string_buffer(FILE_ACTIONS_SIZE)
+        attr = ctypes.create_string_buffer(ATTR_SIZE)
+        pid = ctypes.c_int(0)
+        try:
+            self._check(self.actionsInit(actions), "file actions")
+            self._check(self.attrInit(attr), "attributes")
+            try:
+                self._check(self.actionsDup2(actions, outWrite, 1), "dup2")
+                self._check(self.actionsDup2(actions, errWrite, 2), "dup2")
+                if newGroup:
+                    self._check(self.attrSetFlags(attr,
+                                                  POSIX_SPAWN_SETPGROUP),
+                                "flags")
+                    self._check(self.attrSetPgroup(attr, 0), "pgroup")
+                result = self.posix_spawnp(ctypes.byref(pid), argv[0],
+                                           actions, attr, argv, envp)
+            finally:
+                self.actionsDestroy(actions)
+                self.attrDestroy(attr)
+            if result != 0:
+                #####
+                # The same error Popen raises for a missing command
+                raise OSError(result, os.strerror(result))
+        except:
+            os.close(outRead)
+            os.close(errRead)
+            raise
+        finally:
+            os.close(outWrite)
+            os.close(errWrite)
+        return SpawnedProcess(pid.value, os.fdopen(outRead, "rb"),
+                              os.fdopen(errRead, "rb"))
@@ -0,0 +1,371 @@
+"""
+Run a command on a pseudo terminal and talk to it, expect style.
+
+Commands like su and sudo only ask for a password on a terminal.  The
+session blocks in select with a timeout until the child writes something or
+exits, so waiting costs no CPU.  Output is appended to one bytearray, and
+prompts are found by matching regular expressions against it from a saved
+offset, so each expect only looks at what has arrived since the last one.
+Time spent in each phase (spawn, waiting for a prompt, reading output) is
+recorded in the session's timings.
+
+select is used rather than poll because poll doesn't work on pty devices
+on the Mac.
+"""
+from __future__ import absolute_import
+import os
+import re
+import pty
+import time
+import errno
+import select
+import termios
+from subprocess import Popen
+
+from . loggers import CyLogger
+from . loggers import LogPriority as lp
+from . libHelperExceptions import NotACyLoggerError
+
+
+class PtySessionError(Exception):
+    """
+    Thrown when the session is used before spawn or after close.
+    """
+    def __init__(self, *args, **kwargs):
+        Exception.__init__(self, *args, **kwargs)
+
+
+def waitForNoEcho(fd, timeout=3, readable=None):
+    """
+    Wait until the terminal ECHO flag is turned off, which is usually how a
+    child asks for a password.
+
+    The terminal doesn't signal a change of mode, so the flag is checked
+    again each time the terminal has output to read, or after a wait that
+    starts at a millisecond and backs off to 50ms.
+
+    @param: fd - file descriptor of the terminal
+    @param: timeout - seconds to wait, None or negative to wait forever
+    @param: readable - file descriptor to wake up on, the pty master
+
+    @returns: True if ECHO went off, False on timeout
+    """
+    deadline = None
+    if timeout is not None and timeout >= 0:
+        deadline = time.time() + timeout
+    delay = 0.001
+    while True:
+        if not termios.tcgetattr(fd)[3] & termios.ECHO:
+            return True
+        wait = delay
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            wait = min(wait, remaining)
+        if readable is None:
+            time.sleep(wait)
+        else:
+            try:
+                select.select([readable], [], [], wait)
+            except select.error, err:
+                if err.args[0] != errno.EINTR:
+                    raise
+        delay = min(delay * 2, 0.05)
+
+###############################################################################
+
+class PtySession(object):
+    """
+    A command running on a pseudo terminal.
+
+    @method spawn(self)
+    @method send(self, data)
+    @method sendline(self, line="")
+    @method expect(self, patterns, timeout=None)
+    @method expectFirst(self, patterns, timeout=3)
+    @method waitnoecho(self, timeout=3)
+    @method readToEof(self, timeout=None)
+    @method close(self)
+    @method getOutput(self)
+    """
+    def __init__(self, command, logger, env=None, chunkSize=4096,
+                 searchWindow=4096):
+        """
+        @param: command - argv list to run
+        @param: logger - CyLogger instance
+        @param: env - environment for the command, None to inherit
+        @param: chunkSize - bytes to read from the terminal at a time
+        @param: searchWindow - how far back into already searched output
+                               a new search looks, so a prompt split
+                               across reads is still found
+        """
+        if isinstance(logger, CyLogger):
+            self.logger = logger
+        else:
+            raise NotACyLoggerError("Passed in value for logger" +
+                                    " is invalid, try again.")
+        self.command = command
+        self.env = env
+        self.chunkSize = chunkSize
+        self.searchWindow = searchWindow
+        self.proc = None
+        self.master = None
+        self.eof = False
+        #####
+        # All the output, what is before consumed has been matched or read
+        # out, and what is before searched has been looked at by expect.
+        self.buffer = bytearray()
+        self.consumed = 0
+        self.searched = 0
+        self.before = ""
+        self.match = None
+        self.retcode = None
+        self.timings = []
+        self.phaseStart = None
+
+    ###########################################################################
+
+    def _mark(self, phase):
+        """
+        Record the time spent since the last mark under the phase name.
+        """
+        now = time.time()
+        self.timings.append((phase, now - self.phaseStart))
+        self.phaseStart = now
+
+    ###########################################################################
+
+    def spawn(self):
+        """
+        Start the command with the slave end of a new pty as its terminal.
+        """
+        self.phaseStart = time.time()
+        master, slave = pty.openpty()
+        try:
+            self.proc = Popen(self.command, stdin=slave, stdout=slave,
+                              stderr=slave, env=self.env, close_fds=True)
+        except:
+            os.close(master)
+            raise
+        finally:
+            #####
+            # Only the child holds the slave end, so reading the master
+            # reports EOF once the child and its children have exited.
+            os.close(slave)
+        self.master = master
+        self._mark("spawn")
+        return self
+
+    ###########################################################################
+
+    def _read(self, timeout):
+        """
+        Wait up to timeout seconds for output and read one chunk of it.
+
+        @returns: True if something was read, False on timeout or EOF
+        """
+        if self.master is None:
+            raise PtySessionError("Session is not running")
+        if self.eof:
+            return False
+        try:
+            ready, _, _ = select.select([self.master], [], [], timeout)
+        except select.error, err:
+            if err.args[0] == errno.EINTR:
+                return True
+            raise
+        if not ready:
+            return False
+        try:
+            data = os.read(self.master, self.chunkSize)
+        except OSError, err:
+            #####
+            # Linux reports EIO on the master once the slave is gone
+            if err.errno != errno.EIO:
+                raise
+            data = ""
+        if not data:
+            self.eof = True
+            return False
+        self.buffer.extend(data)
+        return True
+
+    ###########################################################################
+
+    def send(self, data):
+        """
+        Write to the command's terminal.
+        """
+        if self.master is None:
+            raise PtySessionError("Session is not running")
+        while data:
+            written = os.write(self.master, data)
+            data = data[written:]
+
+    ###########################################################################
+
+    def sendline(self, line=""):
+        """
+        Write a line to the command's terminal.
+        """
+        self.send(line + "\n")
+
+    ###########################################################################
+
+    def expect(self, patterns, timeout=None):
+        """
+        Wait for output matching one of the patterns.
+
+        @param: patterns - regular expression, or list of them
+        @param: timeout - seconds to wait, None to wait forever
+
+        @returns: index of the pattern that matched, or None on timeout or
+                  EOF.  self.before holds the output before the match and
+                  self.match the match object, over the session's buffer.
+                  Output after the match is left for the next expect or
+                  readToEof.
+        """
+        patterns = self._compile(patterns)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            start = max(self.consumed, self.searched - self.searchWindow)
+            best = None
+            for index, pattern in enumerate(patterns):
+                match = pattern.search(self.buffer, start)
+                if match and (best is None or
+                              match.start() < best[1].start()):
+                    best = (index, match)
+            self.searched = len(self.buffer)
+            if best is not None:
+                return self._matched(*best)
+
+            wait = None
+            if deadline is not None:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    break
+            if not self._read(wait) and (self.eof or deadline is not None
+                                         and time.time() >= deadline):
+                break
+        self.before = str(self.buffer[self.consumed:])
+        self.match = None
+        self._mark("expect")
+        return None
+
+    def _compile(self, patterns):
+        if isinstance(patterns, basestring):
+            patterns = [patterns]
+        return [re.compile(pattern, re.M) for pattern in patterns]
+
+    def _matched(self, index, match):
+        """
+        Consume the output up to the end of the match.
+        """
+        self.before = str(self.buffer[self.consumed:match.start()])
+        self.match = match
+        self.consumed = match.end()
+        self.searched = self.consumed
+        self._mark("expect")
+        return index
+
+    ###########################################################################
+
+    def expectFirst(self, patterns, timeout=3):
+        """
+        See whether the first output since the last match is one of the
+        patterns, such as a prompt the command writes before anything else.
+
+        Only the first read is looked at, so output the command writes
+        later can't be taken for the prompt, and a command that doesn't
+        prompt costs one read rather than the whole timeout.
+
+        @param: patterns - regular expression, or list of them, matched at
+                           the start of the output
+        @param: timeout - seconds to wait for the first output
+
+        @returns: index of the pattern that matched, or None.  Output that
+                  didn't match is left for expect or readToEof.
+        """
+        patterns = self._compile(patterns)
+        if len(self.buffer) == self.consumed:
+            self._read(timeout)
+        for index, pattern in enumerate(patterns):
+            match = pattern.match(self.buffer, self.consumed)
+            if match:
+                return self._matched(index, match)
+        self.before = ""
+        self.match = None
+        self._mark("expect")
+        return None
+
+    ###########################################################################
+
+    def waitnoecho(self, timeout=3):
+        """
+        Wait for the command to turn terminal echo off, as it does before
+        reading a password.
+
+        @returns: True if ECHO went off, False on timeout
+        """
+        if self.master is None:
+            raise PtySessionError("Session is not running")
+        result = waitForNoEcho(self.master, timeout, self.master)
+        self._mark("waitnoecho")
+        return result
+
+    ###########################################################################
+
+    def readToEof(self, timeout=None):
+        """
+        Read until the command and everything holding its terminal exits.
+
+        @param: timeout - seconds to wait, None to wait forever
+
+        @returns: output since the last expect match
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while not self.eof:
+            wait = None
+            if deadline is not None:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    break
+            self._read(wait)
+        output = str(self.buffer[self.consumed:])
+        self.consumed = len(self.buffer)
+        self.searched = self.consumed
+        self._mark("read")
+        return output
+
+    ###########################################################################
+
+    def close(self):
+        """
+        Close the terminal and wait for the command.
+
+        @returns: the command's return code
+        """
+        if self.master is not None:
+            os.close(self.master)
+            self.master = None
+        if self.proc is not None:
+            self.proc.wait()
+            self.retcode = self.proc.returncode
+        self._mark("close")
+        self.logger.log(lp.DEBUG, "pty session timings: " +
+                        ", ".join([phase + " %.3fs" % seconds
+                                   for phase, seconds in self.timings]))
+        return self.retcode
+
+    ###########################################################################
+
+    def getOutput(self):
+        """
+        Everything the command has written to its terminal.
+        """
+        return str(self.buffer)
@@ -0,0 +1,298 @@
+"""
+Shared memory arena backed by files on a ramdisk.
+
+Each named region is a file in the arena directory, mapped with mmap so
+cooperating processes can attach to it by name and share the data without
+copying it through a pipe or socket.  Released regions are kept on per-size
+free lists and handed out again instead of creating and truncating new files.
+Their pages are dropped when they are released, so a reused region reads
+back as zeros, the same as a new one.
+
+@note: Sizes are rounded up to a power of two (at least one page) so a free
+       region can be reused for any request in the same size class.
+"""
+from __future__ import absolute_import
+import os
+import re
+import mmap
+
+from . loggers import CyLogger
+from . loggers import LogPriority as lp
+from . libHelperExceptions import NotACyLoggerError
+
+
+class ArenaError(Exception):
+    """
+    Thrown when an arena region can't be allocated, attached or released.
+    """
+    def __init__(self, *args, **kwargs):
+        Exception.__init__(self, *args, **kwargs)
+
+###############################################################################
+
+class ArenaRegion(object):
+    """
+    A named, mmap'ed region of a RamdiskArena.
+
+    @note: map is the mmap object, and may be sliced, read and written
+           like a bytearray.  view() returns a memoryview where the python
+           version supports one on mmap objects.
+    """
+    def __init__(self, name, path, size, capacity, fd, memmap):
+        """
+        Initialization method
+        """
+        self.name = name
+        self.path = path
+        self.size = size
+        self.capacity = capacity
+        self.fd = fd
+        self.map = memmap
+
+    def view(self):
+        """
+        Zero-copy view of the region.  memoryview on python versions that
+        support it on mmap, otherwise the mmap object itself.
+        """
+        try:
+            return memoryview(self.map)
+        except TypeError:
+            return self.map
+
+    def close(self):
+        """
+        Unmap the region and close the backing file descriptor.  The region
+        file is left alone, so other processes can stay attached.
+        """
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+###############################################################################
+
+class RamdiskArena(object):
+    """
+    Allocator for named, mmap-able regions in a directory on a ramdisk.
+
+    @method alloc(self, name, size)
+    @method attach(self, name)
+    @method release(self, name)
+    @method getRegion(self, name)
+    @method getStats(self)
+    @method close(self)
+    @method destroy(self)
+    """
+    def __init__(self, path, logger, minBlock=mmap.PAGESIZE, gate=None):
+        """
+        @param: path - directory to keep the arena in, usually on a mounted
+                       ramdisk.  Created if it does not exist yet.
+        @param: logger - CyLogger instance
+        @param: minBlock - smallest size class, in bytes
+        @param: gate - optional callable, new allocations are refused while
+                       it returns False
+        """
+        if isinstance(logger, CyLogger):
+            self.logger = logger
+        else:
+            raise NotACyLoggerError("Passed in value for logger" +
+                                    " is invalid, try again.")
+        self.path = path
+        self.freePath = os.path.join(path, ".free")
+        #####
+        # Requested size of each region, one small file per region, so
+        # attach() can map what was asked for rather than the capacity
+        self.sizesPath = os.path.join(path, ".sizes")
+        self.minBlock = max(int(minBlock), mmap.PAGESIZE)
+        self.gate = gate
+        self.regions = {}
+        #####
+        # size class -> list of released region files ready for reuse
+        self.freeLists = {}
+        self.freeCount = 0
+        self.allocations = 0
+        self.reuses = 0
+        self.releases = 0
+        for directory in [self.path, self.freePath, self.sizesPath]:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+        self.logger.log(lp.DEBUG, "Arena initialized at: " + str(self.path))
+
+    ###########################################################################
+
+    def _sizeClass(self, size):
+        """
+        Round a requested size up to its power of two size class.
+        """
+        sizeClass = self.minBlock
+        while sizeClass < size:
+            sizeClass = sizeClass << 1
+        return sizeClass
+
+    ###########################################################################
+
+    def _regionPath(self, name):
+        """
+        Validate a region name, and return the path to its backing file.
+        """
+        if not isinstance(name, basestring) or \
+           not re.match(r"^[A-Za-z0-9_\-][A-Za-z0-9_\-\.]*$", name):
+            raise ArenaError("Invalid region name: " + str(name))
+        return os.path.join(self.path, name)
+
+    ###########################################################################
+
+    def _map(self, name, path, size, capacity):
+        """
+        Open and mmap a region file, returning an ArenaRegion.
+        """
+        fd = os.open(path, os.O_RDWR)
+        try:
+            memmap = mmap.mmap(fd, size, mmap.MAP_SHARED,
+                               mmap.PROT_READ | mmap.PROT_WRITE)
+        except Exception:
+            os.close(fd)
+            raise
+        return ArenaRegion(name, path, size, capacity, fd, memmap)
+
+    ###########################################################################
+
+    def alloc(self, name, size):
+        """
+        Allocate a new named region of at least size bytes.
+
+        A released region of the same size class is reused if one is on the
+        free list, otherwise a new region file is created.
+
+        @returns: ArenaRegion
+        """
+        path = self._regionPath(name)
+        size = int(size)
+        if size <= 0:
+            raise ArenaError("Region size must be positive: " + str(size))
+        if name in self.regions or os.path.exists(path):
+            raise ArenaError("Region already exists: " + str(name))
+        if self.gate is not None and not self.gate():
+            raise ArenaError("Allocation refused, ramdisk is under " +
+                             "memory pressure: " + str(name))
+
+        capacity = self._sizeClass(size)
+        freeList = self.freeLists.get(capacity)
+        if freeList:
+            os.rename(freeList.pop(), path)
+            self.freeCount -= 1
+            self.reuses += 1
+        else:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+            try:
+                os.ftruncate(fd, capacity)
+            finally:
+                os.close(fd)
+
+        with open(os.path.join(self.sizesPath, name), "w") as sizeFile:
+            sizeFile.write(str(size))
+        region = self._map(name, path, size, capacity)
+        self.regions[name] = region
+        self.allocations += 1
+        return region
+
+    ###########################################################################
+
+    def attach(self, name):
+        """
+        Attach to a region allocated by this, or a cooperating, process.
+
+        @returns: ArenaRegion mapping the size the region was allocated
+                  with, the whole region file if that isn't known
+        """
+        path = self._regionPath(name)
+        if name in self.regions:
+            return self.regions[name]
+        if not os.path.isfile(path):
+            raise ArenaError("No such region: " + str(name))
+        capacity = os.stat(path).st_size
+        try:
+            with open(os.path.join(self.sizesPath, name)) as sizeFile:
+                size = min(int(sizeFile.read()), capacity)
+        except (IOError, ValueError):
+            size = capacity
+        region = self._map(name, path, size, capacity)
+        self.regions[name] = region
+        return region
+
+    ###########################################################################
+
+    def getRegion(self, name):
+        """
+        Getter for a region this process has allocated or attached.
+        """
+        return self.regions.get(name)
+
+    ###########################################################################
+
+    def release(self, name):
+        """
+        Unmap a region and put its backing file on the free list, with its
+        contents dropped so the next owner can't read them.
+        """
+        region = self.regions.pop(name, None)
+        if region is None:
+            raise ArenaError("Region not held by this arena: " + str(name))
+        #####
+        # Truncating frees the pages, growing it back reads as zeros
+        os.ftruncate(region.fd, 0)
+        os.ftruncate(region.fd, region.capacity)
+        region.close()
+        try:
+            os.unlink(os.path.join(self.sizesPath, name))
+        except OSError:
+            pass
+        self.releases += 1
+        freeName = "%d.%d" % (region.capacity, self.releases)
+        freePath = os.path.join(self.freePath, freeName)
+        os.rename(region.path, freePath)
+        self.freeLists.setdefault(region.capacity, []).append(freePath)
+        self.freeCount += 1
+
+    ###########################################################################
+
+    def getStats(self):
+        """
+        Getter for allocator counters.
+        """
+        return {"regions": len(self.regions),
+                "free": self.freeCount,
+                "allocations": self.allocations,
+                "releases": self.releases,
+                "reuses": self.reuses}
+
+    ###########################################################################
+
+    def close(self):
+        """
+        Unmap every region held by this process.
+        """
+        for region in self.regions.values():
+            region.close()
+        self.regions = {}
+
+    ###########################################################################
+
+    def destroy(self):
+        """
+        Unmap every region and remove the arena directory.
+        """
+        self.close()
+        for directory in [self.freePath, self.sizesPath, self.path]:
+            if not os.path.isdir(directory):
+                continue
+            for item in os.listdir(directory):
+                itemPath = os.path.join(directory, item)
+                if not os.path.isdir(itemPath) or os.path.islink(itemPath):
+                    os.unlink(itemPath)
+            os.rmdir(directory)
+        self.freeLists = {}
+        self.freeCount = 0
+        self.logger.log(lp.DEBUG, "Arena destroyed: " + str(self.path))
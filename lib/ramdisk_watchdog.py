@@ -0,0 +1,249 @@
+"""
+Health watchdog for a mounted ramdisk.
+
+A tmpfs that gets paged out to swap is slower than a disk.  The watchdog
+samples memory pressure (PSI, /proc/pressure/memory), swap activity
+(/proc/vmstat) and the ramdisk's own usage on a timer, and when the ramdisk
+is likely being paged it logs a warning, calls the registered callbacks and,
+optionally, refuses new arena allocations or shrinks the ramdisk.
+
+Sampling is a pread of two small /proc files, kept open between samples,
+and a statvfs of the mount point.  On systems without PSI or /proc/vmstat
+only the usage is sampled.
+"""
+from __future__ import absolute_import
+import os
+import re
+import time
+import threading
+import traceback
+
+from . loggers import CyLogger
+from . loggers import LogPriority as lp
+from . libHelperExceptions import NotACyLoggerError
+
+
+class RamdiskWatchdog(threading.Thread):
+    """
+    Thread that watches a ramdisk for signs of being paged out.
+
+    @method sample(self)
+    @method addCallback(self, callback)
+    @method stop(self, timeout=None)
+    """
+    def __init__(self, mntPoint, logger, interval=5.0, psiThreshold=10.0,
+                 swapThreshold=256, usageThreshold=0.9, refuse=True,
+                 shrink=False, shrinkMargin=16, resize=None,
+                 pressurePath="/proc/pressure/memory",
+                 vmstatPath="/proc/vmstat"):
+        """
+        @param: mntPoint - mount point of the ramdisk to watch
+        @param: logger - CyLogger instance
+        @param: interval - seconds between samples
+        @param: psiThreshold - "some" avg10 memory pressure, in percent, at
+                               or above which the host is under pressure
+        @param: swapThreshold - pages swapped in or out per second at or
+                                above which the host is under pressure
+        @param: usageThreshold - fraction of the ramdisk in use at or above
+                                 which to warn that it is filling up
+        @param: refuse - refuse new arena allocations while under pressure
+        @param: shrink - shrink the ramdisk to what is in use, plus
+                         shrinkMargin megabytes, while under pressure
+        @param: resize - callable taking the new size in megabytes, used
+                         to shrink the ramdisk.  Called on the watchdog's
+                         thread.
+        """
+        threading.Thread.__init__(self, name="RamdiskWatchdog")
+        self.daemon = True
+        if isinstance(logger, CyLogger):
+            self.logger = logger
+        else:
+            raise NotACyLoggerError("Passed in value for logger" +
+                                    " is invalid, try again.")
+        self.mntPoint = mntPoint
+        self.interval = interval
+        self.psiThreshold = psiThreshold
+        self.swapThreshold = swapThreshold
+        self.usageThreshold = usageThreshold
+        self.refuse = refuse
+        self.shrink = shrink
+        self.shrinkMargin = shrinkMargin
+        self.resize = resize
+        self.callbacks = []
+        self.allocationsAllowed = True
+        self.underPressure = False
+        self.filling = False
+        self.lastSample = None
+        self.stopEvent = threading.Event()
+
+        self.pressureFd = self._open(pressurePath)
+        self.vmstatFd = self._open(vmstatPath)
+        self.psiPattern = re.compile(r"^some\s+avg10=([\d\.]+)", re.M)
+        self.swapPattern = re.compile(r"^pswp(?:in|out)\s+(\d+)", re.M)
+        self.lastSwap = None
+        self.lastTime = None
+
+    ###########################################################################
+
+    def _open(self, path):
+        """
+        Open a /proc file to be re-read on every sample, or None if the
+        system doesn't have it.
+        """
+        try:
+            return os.open(path, os.O_RDONLY)
+        except OSError:
+            return None
+
+    ###########################################################################
+
+    def _read(self, fd):
+        """
+        Re-read an already open /proc file from the start.
+        """
+        os.lseek(fd, 0, os.SEEK_SET)
+        return os.read(fd, 8192)
+
+    ###########################################################################
+
+    def addCallback(self, callback):
+        """
+        Register a callable, called with (watchdog, sample) when the ramdisk
+        goes under, or comes out from under, memory pressure.
+        """
+        self.callbacks.append(callback)
+
+    ###########################################################################
+
+    def sample(self):
+        """
+        Take one sample and act on it.
+
+        @returns: dictionary with the psi, swap (pages per second), used and
+                  size (bytes) of the ramdisk and pressure readings.  Values
+                  that can't be read on this system are None.
+        """
+        now = time.time()
+        sample = {"time": now, "psi": None, "swap": None,
+                  "used": None, "size": None, "usage": None}
+
+        if self.pressureFd is not None:
+            match = self.psiPattern.search(self._read(self.pressureFd))
+            if match:
+                sample["psi"] = float(match.group(1))
+
+        if self.vmstatFd is not None:
+            swapped = sum([int(pages) for pages in
+                           self.swapPattern.findall(self._read(self.vmstatFd))])
+            if self.lastSwap is not None and now > self.lastTime:
+                sample["swap"] = (swapped - self.lastSwap) / \
+                                 (now - self.lastTime)
+            self.lastSwap = swapped
+            self.lastTime = now
+
+        try:
+            stats = os.statvfs(self.mntPoint)
+        except OSError:
+            pass
+        else:
+            sample["size"] = stats.f_blocks * stats.f_frsize
+            sample["used"] = (stats.f_blocks - stats.f_bfree) * stats.f_frsize
+            if sample["size"]:
+                sample["usage"] = float(sample["used"]) / sample["size"]
+
+        self.lastSample = sample
+        self._evaluate(sample)
+        return sample
+
+    ###########################################################################
+
+    def _evaluate(self, sample):
+        """
+        Decide if the ramdisk is likely being paged, and act on transitions.
+        """
+        pressure = (sample["psi"] is not None and
+                    sample["psi"] >= self.psiThreshold) or \
+                   (sample["swap"] is not None and
+                    sample["swap"] >= self.swapThreshold)
+        #####
+        # An empty ramdisk has nothing to page out
+        pressure = pressure and bool(sample["used"])
+
+        #####
+        # Warn once when it fills past the threshold, not on every sample
+        filling = sample["usage"] is not None and \
+                  sample["usage"] >= self.usageThreshold
+        if filling and not self.filling:
+            self.logger.log(lp.WARNING, "Ramdisk " + str(self.mntPoint) +
+                            " is " + str(int(sample["usage"] * 100)) +
+                            "% full")
+        self.filling = filling
+
+        if pressure == self.underPressure:
+            return
+        self.underPressure = pressure
+
+        if pressure:
+            self.logger.log(lp.WARNING, "Ramdisk " + str(self.mntPoint) +
+                            " is likely being paged, psi: " +
+                            str(sample["psi"]) + " swap pages/s: " +
+                            str(sample["swap"]))
+            if self.refuse:
+                self.allocationsAllowed = False
+            if self.shrink and self.resize is not None:
+                newSize = sample["used"] / (1024 * 1024) + self.shrinkMargin
+                if newSize * 1024 * 1024 < sample["size"]:
+                    self.logger.log(lp.WARNING, "Shrinking ramdisk to " +
+                                    str(newSize) + "Mb")
+                    self.resize(newSize)
+        else:
+            self.logger.log(lp.INFO, "Memory pressure cleared for ramdisk " +
+                            str(self.mntPoint))
+            self.allocationsAllowed = True
+
+        for callback in self.callbacks:
+            try:
+                callback(self, sample)
+            except Exception, err:
+                self.logger.log(lp.WARNING, "Watchdog callback failed: " +
+                                str(err))
+                self.logger.log(lp.DEBUG, traceback.format_exc())
+
+    ###########################################################################
+
+    def run(self):
+        """
+        Sample every interval seconds until stopped.
+        """
+        while not self.stopEvent.is_set():
+            try:
+                self.sample()
+            except Exception, err:
+                self.logger.log(lp.WARNING, "Watchdog sample failed: " +
+                                str(err))
+            self.stopEvent.wait(self.interval)
+        self._close()
+
+    ###########################################################################
+
+    def _close(self):
+        """
+        Close the /proc files kept open for sampling.
+        """
+        for fd in [self.pressureFd, self.vmstatFd]:
+            if fd is not None:
+                os.close(fd)
+        self.pressureFd = None
+        self.vmstatFd = None
+
+    ###########################################################################
+
+    def stop(self, timeout=None):
+        """
+        Stop sampling, and wait for the thread to exit.
+        """
+        self.stopEvent.set()
+        if self.is_alive():
+            self.join(timeout)
+        else:
+            self._close()
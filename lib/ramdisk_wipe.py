@@ -0,0 +1,278 @@
+"""
+Engine for quickly clearing the contents of a ramdisk.
+
+Directories are walked breadth first with an explicit work list, so tree
+depth is not limited by the python recursion limit.  Files are removed by a
+pool of threads, in chunks, with unlinkat(2) relative to an open descriptor
+of their directory.  unlinkat never follows a symlink, it removes the link,
+and every directory is opened with O_NOFOLLOW and checked to be the same
+inode that was found when it was listed, on the ramdisk's device, before
+anything in it is touched.  A symlink can't lead the wipe outside of the
+mount point, even if one is swapped in while the wipe runs.
+
+Empty directories are removed last, deepest first.
+"""
+from __future__ import absolute_import
+import os
+import stat
+import time
+import errno
+import ctypes
+from multiprocessing.pool import ThreadPool
+
+from . loggers import CyLogger
+from . loggers import LogPriority as lp
+from . getLibc import getLibc
+from . libHelperExceptions import NotACyLoggerError
+
+#####
+# Value of AT_REMOVEDIR for unlinkat(2), differs between Linux and the Mac
+if os.uname()[0] == "Darwin":
+    AT_REMOVEDIR = 0x80
+else:
+    AT_REMOVEDIR = 0x200
+
+O_DIRECTORY = getattr(os, "O_DIRECTORY", 0)
+O_NOFOLLOW = getattr(os, "O_NOFOLLOW", 0)
+
+
+class WipeError(Exception):
+    """
+    Thrown when the directory to wipe can't be used.
+    """
+    def __init__(self, *args, **kwargs):
+        Exception.__init__(self, *args, **kwargs)
+
+###############################################################################
+
+class WipeEngine(object):
+    """
+    Remove everything below a directory, leaving the directory itself.
+
+    @method wipe(self)
+    """
+    def __init__(self, root, logger, workers=8, chunkSize=256, dirBatch=64):
+        """
+        @param: root - directory to empty, usually a ramdisk mount point
+        @param: logger - CyLogger instance
+        @param: workers - number of unlink threads
+        @param: chunkSize - names handed to a thread at a time
+        @param: dirBatch - directories held open at a time
+        """
+        if isinstance(logger, CyLogger):
+            self.logger = logger
+        else:
+            raise NotACyLoggerError("Passed in value for logger" +
+                                    " is invalid, try again.")
+        self.root = os.path.realpath(root)
+        self.workers = max(1, int(workers))
+        self.chunkSize = max(1, int(chunkSize))
+        self.dirBatch = max(1, int(dirBatch))
+        self.idents = {}
+
+        try:
+            libc = ctypes.CDLL(getLibc()._name, use_errno=True)
+            self.unlinkat = libc.unlinkat
+            self.unlinkat.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                      ctypes.c_int]
+            self.unlinkat.restype = ctypes.c_int
+        except (AttributeError, OSError):
+            self.unlinkat = None
+
+    ###########################################################################
+
+    def _opendir(self, rel):
+        """
+        Open a directory below the root without following symlinks.
+
+        @returns: file descriptor, or None if what got opened is not the
+                  directory found while walking the tree.
+        """
+        path = os.path.join(self.root, rel)
+        try:
+            fd = os.open(path, os.O_RDONLY | O_DIRECTORY | O_NOFOLLOW)
+        except OSError, err:
+            self.logger.log(lp.WARNING, "Skipping " + str(path) + ": " +
+                            str(err))
+            return None
+        st = os.fstat(fd)
+        if (st.st_dev, st.st_ino) != self.idents.get(rel):
+            os.close(fd)
+            self.logger.log(lp.WARNING, "Skipping " + str(path) +
+                            ", it leads outside of " + str(self.root))
+            return None
+        return fd
+
+    ###########################################################################
+
+    def _listdir(self, fd, rel):
+        """
+        List a directory, by descriptor where the python version allows.
+        """
+        try:
+            return os.listdir(fd)
+        except TypeError:
+            return os.listdir(os.path.join(self.root, rel))
+
+    ###########################################################################
+
+    def _dirIdent(self, rel, name):
+        """
+        lstat check used to tell a directory from an unlink failure.
+
+        @returns: (device, inode) of a real directory on the root's
+                  filesystem, otherwise None
+        """
+        try:
+            st = os.lstat(os.path.join(self.root, rel, name))
+        except OSError:
+            return None
+        if not stat.S_ISDIR(st.st_mode) or st.st_dev != self.idents[""][0]:
+            return None
+        return (st.st_dev, st.st_ino)
+
+    ###########################################################################
+
+    def _unlinkChunk(self, task):
+        """
+        Unlink a chunk of names in one directory.  Runs in a pool thread.
+
+        @returns: (files removed, [(subdirectory, ident)...], errors)
+        """
+        fd, rel, names = task
+        removed = 0
+        subdirs = []
+        errors = 0
+        for name in names:
+            if self.unlinkat is not None:
+                if self.unlinkat(fd, name, 0) == 0:
+                    removed += 1
+                    continue
+                err = ctypes.get_errno()
+            else:
+                path = os.path.join(self.root, rel, name)
+                try:
+                    if not stat.S_ISDIR(os.lstat(path).st_mode):
+                        os.unlink(path)
+                        removed += 1
+                        continue
+                    err = errno.EISDIR
+                except OSError, oserr:
+                    err = oserr.errno
+            if err == errno.ENOENT:
+                continue
+            ident = None
+            if err in [errno.EISDIR, errno.EPERM]:
+                ident = self._dirIdent(rel, name)
+            if ident is not None:
+                subdirs.append((os.path.join(rel, name), ident))
+            else:
+                errors += 1
+        return removed, subdirs, errors
+
+    ###########################################################################
+
+    def _rmdir(self, parentFd, rel, name):
+        """
+        Remove an empty directory relative to its parent's descriptor.
+        """
+        if self.unlinkat is not None:
+            if self.unlinkat(parentFd, name, AT_REMOVEDIR) == 0:
+                return True
+            return False
+        try:
+            os.rmdir(os.path.join(self.root, rel, name))
+        except OSError:
+            return False
+        return True
+
+    ###########################################################################
+
+    def wipe(self):
+        """
+        Remove everything below the root directory.
+
+        @returns: dictionary with the files and dirs removed, errors,
+                  directories skipped, elapsed seconds and filesPerSecond.
+        """
+        start = time.time()
+        stats = {"files": 0, "dirs": 0, "errors": 0, "skipped": 0}
+
+        if not os.path.isdir(self.root):
+            raise WipeError("Not a directory: " + str(self.root))
+        st = os.stat(self.root)
+        self.idents = {"": (st.st_dev, st.st_ino)}
+
+        frontier = [""]
+        discovered = []
+        pool = ThreadPool(self.workers)
+        try:
+            #####
+            # Remove files breadth first, collecting directories as we go
+            while frontier:
+                batch = frontier[:self.dirBatch]
+                frontier = frontier[self.dirBatch:]
+                fds = []
+                tasks = []
+                for rel in batch:
+                    fd = self._opendir(rel)
+                    if fd is None:
+                        stats["skipped"] += 1
+                        continue
+                    fds.append(fd)
+                    names = self._listdir(fd, rel)
+                    for i in range(0, len(names), self.chunkSize):
+                        tasks.append((fd, rel, names[i:i + self.chunkSize]))
+                try:
+                    for removed, subdirs, errors in \
+                            pool.imap_unordered(self._unlinkChunk, tasks):
+                        stats["files"] += removed
+                        stats["errors"] += errors
+                        for subdir, ident in subdirs:
+                            self.idents[subdir] = ident
+                            frontier.append(subdir)
+                            discovered.append(subdir)
+                finally:
+                    for fd in fds:
+                        os.close(fd)
+        finally:
+            pool.close()
+            pool.join()
+
+        #####
+        # Children are always discovered after their parents, so going
+        # through the list backwards removes the deepest directories first.
+        parentRel = None
+        parentFd = None
+        try:
+            for rel in reversed(discovered):
+                parent, name = os.path.split(rel)
+                if parent != parentRel:
+                    if parentFd is not None:
+                        os.close(parentFd)
+                    parentRel = parent
+                    parentFd = self._opendir(parent)
+                if parentFd is None:
+                    stats["skipped"] += 1
+                elif self._rmdir(parentFd, parent, name):
+                    stats["dirs"] += 1
+                else:
+                    stats["errors"] += 1
+        finally:
+            if parentFd is not None:
+                os.close(parentFd)
+
+        stats["elapsed"] = time.time() - start
+        if stats["elapsed"] > 0:
+            stats["filesPerSecond"] = stats["files"] / stats["elapsed"]
+        else:
+            stats["filesPerSecond"] = float(stats["files"])
+        self.logger.log(lp.INFO, "Wiped " + str(stats["files"]) + " files, " +
+                        str(stats["dirs"]) + " dirs from " + str(self.root) +
+                        " in " + "%.3f" % stats["elapsed"] + "s (" +
+                        str(int(stats["filesPerSecond"])) + " files/s)")
+        if stats["errors"] or stats["skipped"]:
+            self.logger.log(lp.WARNING, "Wipe errors: " +
+                            str(stats["errors"]) + " skipped: " +
+                            str(stats["skipped"]))
+        return stats
@@ -0,0 +1,127 @@
+"""
+What the commands RunWith runs cost the machine.
+
+Popen reaps a child with waitpid, which throws away what the kernel knows
+about it: its CPU time, its memory high water mark, its page faults and
+context switches.  reap() reaps it with wait4 instead, and keeps that as a
+ResourceUsage on the process object, for the CommandResult.  CommandMetrics
+adds them up per executable, to find the commands worth caching or
+replacing with a system call.
+"""
+from __future__ import absolute_import
+import os
+import sys
+import errno
+
+#####
+# Fields of a ResourceUsage, in the order they are exported
+USAGE_FIELDS = ["userTime", "systemTime", "maxRss", "minorFaults",
+                "majorFaults", "voluntarySwitches", "involuntarySwitches"]
+
+
+class ResourceUsage(object):
+    """
+    Read only record of the resources one finished process used.
+
+    userTime and systemTime are CPU seconds, maxRss is the peak resident
+    set in kilobytes, the faults and switches are counts.
+    """
+    __slots__ = USAGE_FIELDS
+
+    def __init__(self, userTime=0.0, systemTime=0.0, maxRss=0, minorFaults=0,
+                 majorFaults=0, voluntarySwitches=0, involuntarySwitches=0):
+        for name, value in [("userTime", userTime),
+                            ("systemTime", systemTime), ("maxRss", maxRss),
+                            ("minorFaults", minorFaults),
+                            ("majorFaults", majorFaults),
+                            ("voluntarySwitches", voluntarySwitches),
+                            ("involuntarySwitches", involuntarySwitches)]:
+            object.__setattr__(self, name, value)
+
+    @classmethod
+    def fromRusage(cls, rusage):
+        """
+        @param: rusage - struct_rusage from os.wait4 or resource.getrusage
+        """
+        maxRss = rusage.ru_maxrss
+        if sys.platform == "darwin":
+            #####
+            # Bytes on the Mac, kilobytes everywhere else
+            maxRss = maxRss // 1024
+        return cls(rusage.ru_utime, rusage.ru_stime, maxRss,
+                   rusage.ru_minflt, rusage.ru_majflt, rusage.ru_nvcsw,
+                   rusage.ru_nivcsw)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ResourceUsage is read only")
+
+    def __delattr__(self, name):
+        raise AttributeError("ResourceUsage is read only")
+
+    @property
+    def cpuTime(self):
+        """
+        User and system CPU seconds together.
+        """
+        return self.userTime + self.systemTime
+
+    def asDict(self):
+        """
+        @returns: dictionary of the fields, for JSON
+        """
+        return dict([(name, getattr(self, name)) for name in USAGE_FIELDS])
+
+    def __repr__(self):
+        return "ResourceUsage(cpu=" + str(round(self.cpuTime, 6)) + \
+               ", maxRss=" + str(self.maxRss) + ")"
+
+###############################################################################
+
+def reap(proc, block=True):
+    """
+    Reap a process with wait4, like proc.wait(), or proc.poll() when block
+    is False, keeping what it used as proc.rusage.
+
+    @param: proc - Popen object, or anything with pid and returncode like
+                   a SpawnedProcess
+
+    @returns: the process' return code, None if block is False and it is
+              still running
+
+    @note: If something else already reaped the process, its exit code
+           is lost along with what it used, and Popen and SpawnedProcess
+           both report 0.
+    """
+    if proc.returncode is not None:
+        return proc.returncode
+    while True:
+        try:
+            pid, status, rusage = os.wait4(proc.pid,
+                                           0 if block else os.WNOHANG)
+        except OSError, err:
+            if err.errno == errno.EINTR:
+                continue
+            if err.errno != errno.ECHILD:
+                raise
+            #####
+            # Reaped by someone else, what it used and how it exited are
+            # gone
+            return proc.wait() if block else proc.poll()
+        break
+    if pid == 0:
+        return None
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    proc.rusage = ResourceUsage.fromRusage(rusage)
+    return proc.returncode
+
+###############################################################################
+
+def usageOf(proc):
+    """
+    @returns: the ResourceUsage reap() kept for a process, None if it
+              wasn't reaped with reap()
+    """
+    return getattr(proc, "rusage", None)
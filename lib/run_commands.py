@@ -8,18 +8,25 @@ Inspiration for some of the below found on the internet.
 from __future__ import absolute_import
 import os
 import re
-import pty
 import time
-import types
+import errno
+import shutil
+import signal
 import select
 import termios
-import threading
 import traceback
 from subprocess import Popen, PIPE
+from collections import Mapping
 
 from . loggers import CyLogger
 from . loggers import LogPriority as lp
 from . getLibc import getLibc
+from . pty_session import PtySession, waitForNoEcho
+from . coprocess import Coprocess
+from . spooled_output import SpooledOutput
+from . posix_spawn import Spawner
+from . environ_overlay import makeTempEnviron
+from . resource_usage import reap, usageOf
 
 
 class OSNotValidForRunWith(BaseException):
@@ -46,24 +53,255 @@ class SetCommandTypeError(BaseException):
         BaseException.__init__(self, *args, **kwargs)
 
 
+class InvalidSyncPolicyError(BaseException):
+    """
+    Custom Exception
+    """
+    def __init__(self, *args, **kwargs):
+        BaseException.__init__(self, *args, **kwargs)
+
+
+class SyncPolicy(object):
+    """
+    How RunWith flushes filesystem buffers after running a command.
+
+    NONE      - don't flush (default)
+    SYNCFS    - syncfs(2) the filesystems holding the target paths, falls
+                back to a global sync where syncfs isn't available, or
+                without targets
+    FDATASYNC - fdatasync(2) each of the target files
+    GLOBAL    - sync(2), flushes every dirty page on the host
+    """
+    NONE = "none"
+    SYNCFS = "syncfs"
+    FDATASYNC = "fdatasync"
+    GLOBAL = "global"
+    ALL = [NONE, SYNCFS, FDATASYNC, GLOBAL]
+
+
+class CommandResult(object):
+    """
+    Read only record of one finished command.
+
+    @note: error is the text of an exception raised trying to run the
+           command, retcode is None when there is one.
+    @note: usage is the ResourceUsage of the process, None where it isn't
+           known.
+    """
+    __slots__ = ["command", "stdout", "stderr", "retcode", "elapsed",
+                 "timedOut", "error", "index", "usage"]
+
+    def __init__(self, command, stdout="", stderr="", retcode=None,
+                 elapsed=0.0, timedOut=False, error=None, index=None,
+                 usage=None):
+        for name, value in [("command", command), ("stdout", stdout),
+                            ("stderr", stderr), ("retcode", retcode),
+                            ("elapsed", elapsed), ("timedOut", timedOut),
+                            ("error", error), ("index", index),
+                            ("usage", usage)]:
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CommandResult is read only")
+
+    def __delattr__(self, name):
+        raise AttributeError("CommandResult is read only")
+
+    @property
+    def ok(self):
+        """
+        True if the command ran, in time, and exited zero.
+        """
+        return self.retcode == 0 and not self.timedOut and self.error is None
+
+    def getReturns(self):
+        """
+        @returns: (stdout, stderr, retcode), like RunWith.getReturns
+        """
+        return self.stdout, self.stderr, self.retcode
+
+    def __repr__(self):
+        return "CommandResult(" + repr(self.command) + ", retcode=" + \
+               str(self.retcode) + ", timedOut=" + str(self.timedOut) + ")"
+
+
+def terminateGroup(proc, grace=2.0):
+    """
+    Send SIGTERM to a process' whole process group, then SIGKILL for
+    anything in the group still around once the group is gone or grace
+    seconds pass, whichever is first.  Children that outlive the process
+    get the same grace to clean up.  The process must lead its own group,
+    see Popen(preexec_fn=os.setsid).
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except OSError:
+        return
+    deadline = time.time() + grace
+    delay = 0.001
+    while time.time() < deadline:
+        #####
+        # Reap the process, as a zombie it would still count as a member
+        reap(proc, block=False)
+        try:
+            os.killpg(proc.pid, 0)
+        except OSError:
+            return
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def readPipes(proc, timeout=None, chunkSize=65536, onTimeout=None,
+              spill=None, spillDir=None, drain=1.0):
+    """
+    Read a process' stdout and stderr at the same time, with select, until
+    both are closed or the timeout runs out.  The process is killed if the
+    timeout runs out, and what it wrote up to then is kept.  The process is
+    reaped with reap(), so what it used is left as proc.rusage.
+
+    @param: proc - Popen object started with stdout=PIPE and stderr=PIPE
+    @param: timeout - seconds to wait, None to wait forever
+    @param: onTimeout - callable taking proc, to stop it when the timeout
+                        runs out, instead of proc.kill()
+    @param: spill - bytes of each stream to keep in memory before moving it
+                    to a file, None to keep it all in memory
+    @param: spillDir - directory for those files, for instance a ramdisk
+    @param: drain - most seconds to keep reading what is left in the pipes
+                    after a timeout, a process outside the group may still
+                    hold them open and write
+
+    @returns: (stdout, stderr, timedOut).  stdout and stderr are
+              SpooledOutput objects if spill is set, strings if not.
+    """
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    pipes = [pipe for pipe in [proc.stdout, proc.stderr] if pipe is not None]
+    if spill is None:
+        chunks = dict([(pipe.fileno(), []) for pipe in pipes])
+        writers = dict([(fd, chunks[fd].append) for fd in chunks])
+    else:
+        chunks = dict([(pipe.fileno(), SpooledOutput(spill, spillDir))
+                       for pipe in pipes])
+        writers = dict([(fd, chunks[fd].write) for fd in chunks])
+    streams = chunks.keys()
+    timedOut = False
+    while streams:
+        wait = None
+        if deadline is not None:
+            wait = deadline - time.time()
+            if wait <= 0:
+                timedOut = True
+                break
+        try:
+            ready, _, _ = select.select(streams, [], [], wait)
+        except select.error, err:
+            if err.args[0] == errno.EINTR:
+                continue
+            raise
+        for fd in ready:
+            data = os.read(fd, chunkSize)
+            if data:
+                writers[fd](data)
+            else:
+                streams.remove(fd)
+    if timedOut:
+        try:
+            if onTimeout is None:
+                proc.kill()
+            else:
+                onTimeout(proc)
+        except OSError:
+            pass
+        #####
+        # Keep what was written before the kill and is still in the pipes
+        drainUntil = time.time() + drain
+        while streams and time.time() < drainUntil:
+            ready, _, _ = select.select(streams, [], [], 0.1)
+            if not ready:
+                break
+            for fd in ready:
+                data = os.read(fd, chunkSize)
+                if data:
+                    writers[fd](data)
+                else:
+                    streams.remove(fd)
+    reap(proc)
+
+    output = []
+    for pipe in [proc.stdout, proc.stderr]:
+        if pipe is None:
+            output.append("" if spill is None else SpooledOutput(spill,
+                                                                 spillDir))
+        elif spill is None:
+            output.append("".join(chunks[pipe.fileno()]))
+            pipe.close()
+        else:
+            output.append(chunks[pipe.fileno()])
+            pipe.close()
+    return output[0], output[1], timedOut
+
+
+def printable(command):
+    """
+    The command as one string, for messages.
+    """
+    if isinstance(command, (list, tuple)):
+        return " ".join(command)
+    return str(command)
+
+
+def preview(value, limit=1024):
+    """
+    The start of a command, or of its output, for a log message, at most
+    limit characters, marked if there is more.  Output that spilled to a
+    file gives its own preview, see SpooledOutput.
+    """
+    if isinstance(value, SpooledOutput):
+        return value.preview(limit)
+    if isinstance(value, (list, tuple)):
+        value = printable(value)
+    elif not isinstance(value, basestring):
+        value = str(value)
+    if limit is None or len(value) <= limit:
+        return value
+    return value[:limit] + "... (" + str(len(value)) + " bytes)"
+
+
 class RunWith(object):
     """
     Class that will run commands in various ways.
 
     @method setCommand(self, command=[])
+    @method setSyncPolicy(self, policy, targets=None)
+    @method setCache(self, cache)
+    @method setSpill(self, threshold, directory=None)
+    @method setSpawn(self, enabled=True)
+    @method setTempDir(self, directory, xdgCache=False)
+    @method setTrace(self, trace)
+    @method setLogPreview(self, size)
+    @method setMetrics(self, metrics)
     @method getStdout(self)
     @method getStderr(self)
     @method getReturnCode(self)
+    @method getUsage(self)
     @method getReturns(self)
     @method getNlogReturns(self)
     @method getNprintReturns(self)
+    @method run(self, command, ...)
     @method communicate(self)
     @method wait(self)
+    @method stream(self, chk_string=None)
     @method waitNpassThruStdout(self)
     @method killProc(self)
     @method timeout(self, seconds=0)
     @method runAs(self, user="", password="")
     @method liftDown(self)
+    @method closeCoprocesses(self)
     @method getecho(self)
     @method waitnoecho(self)
     @method runAsWithSudo(self, user="", password="")
@@ -73,7 +311,8 @@ class RunWith(object):
 
     @author: Roy Nielsen
     """
-    def __init__(self, logger):
+    def __init__(self, logger, syncPolicy=SyncPolicy.NONE, syncTargets=None,
+                 cache=None, metrics=None):
         if isinstance(logger, CyLogger):
             self.logger = logger
         else:
@@ -83,15 +322,33 @@ class RunWith(object):
         self.stdout = None
         self.stderr = None
         self.retcode = None
+        self.usage = None
         self.module_version = '20160224.184019.673753'
         self.printcmd = None
         self.myshell = None
         self.prompt = ""
         self.environ = None
         self.cfds = None
+        self.timings = []
+        self.coprocesses = {}
+        self.coprocessIdle = 60
+        self.cache = cache
+        self.metrics = metrics
+        self.metricsCommand = None
+        self.spill = None
+        self.spillDir = None
+        self.spawner = None
+        self.tempRoot = None
+        self.tempXdgCache = False
+        self.trace = None
+        self.logPreview = 1024
+        self.syncTime = 0.0
         #####
         # setting up to call ctypes to do a filesystem sync
         self.libc = getLibc()
+        self.syncPolicy = SyncPolicy.NONE
+        self.syncTargets = []
+        self.setSyncPolicy(syncPolicy, syncTargets)
 
     def setCommand(self, command, env=None, myshell=None, close_fds=None):
         """
@@ -99,34 +356,16 @@ class RunWith(object):
 
         @author: Roy Nielsen
         """
+        self.myshell = self._checkCommand(command, myshell)
+        self.command = command
         #####
-        # Handle Popen's shell, or "myshell"...
-        if command and isinstance(command, list):
-            try:
-                self.printcmd = " ".join(command)
-                self.command = command
-                if myshell is None or not isinstance(myshell, bool):
-                    self.myshell = False
-                else:
-                    self.myshell = myshell
-            except TypeError:
-                raise SetCommandTypeError("Can only be passed a command " +
-                                          "string or a list only containing " +
-                                          "string elements for a command.")
-        elif command and isinstance(command, basestring):
-            self.command = command
-            self.printcmd = command
-            if myshell is None or not isinstance(myshell, bool):
-                self.myshell = True
-            else:
-                self.myshell = myshell
-        else:
-            raise SetCommandTypeError("Command cannot be this type: " +
-                            str(type(command)))
+        # Joined only if a message asks for it, see printcmd
+        self._printcmd = None
+        self._printSource = command
 
         self.logger.log(lp.DEBUG, "myshell: " + str(self.myshell))
 
-        if env and isinstance(env, dict):
+        if env and isinstance(env, Mapping):
             self.environ = env
         else:
             self.environ = None
@@ -138,6 +377,289 @@ class RunWith(object):
 
     ###########################################################################
 
+    def _checkCommand(self, command, myshell=None):
+        """
+        Validate a command.
+
+        @returns: whether to run it with the shell.  A string runs with the
+                  shell, and a list without, unless myshell says otherwise.
+        """
+        #####
+        # Handle Popen's shell, or "myshell"...
+        if command and isinstance(command, list):
+            for item in command:
+                if not isinstance(item, basestring):
+                    raise SetCommandTypeError("Can only be passed a " +
+                                              "command string or a list " +
+                                              "only containing string " +
+                                              "elements for a command.")
+            if myshell is None or not isinstance(myshell, bool):
+                myshell = False
+        elif command and isinstance(command, basestring):
+            if myshell is None or not isinstance(myshell, bool):
+                myshell = True
+        else:
+            raise SetCommandTypeError("Command cannot be this type: " +
+                            str(type(command)))
+        return myshell
+
+    ###########################################################################
+
+    def _getPrintcmd(self):
+        if self._printcmd is None and self._printSource is not None:
+            self._printcmd = printable(self._printSource)
+        return self._printcmd
+
+    def _setPrintcmd(self, printcmd):
+        self._printcmd = printcmd
+        self._printSource = None
+
+    printcmd = property(_getPrintcmd, _setPrintcmd,
+                        doc="The command set with setCommand, as a string")
+
+    ###########################################################################
+
+    def setLogPreview(self, size):
+        """
+        Log at most size characters of a command's output, None for all of
+        it.
+        """
+        self.logPreview = size
+
+    ###########################################################################
+
+    def _log(self, priority, message, *args):
+        """
+        Log message % args, building it only if the logger keeps messages
+        of this priority.  Commands and output in args are cut to the
+        log preview size.
+        """
+        if not self.logger.isEnabledFor(priority):
+            return
+        self.logger.log(priority, message %
+                        tuple([preview(arg, self.logPreview) for arg in args]),
+                        stacklevel=2)
+
+    ###########################################################################
+
+    def setSyncPolicy(self, policy, targets=None):
+        """
+        Set how to flush filesystem buffers after each command.
+
+        @param: policy - one of the SyncPolicy values
+        @param: targets - list of paths.  Mount points, or any path on the
+                          filesystem, for SyncPolicy.SYNCFS, files for
+                          SyncPolicy.FDATASYNC.
+
+        @note: every run method also takes sync and syncTargets arguments
+               to override the policy for one call.
+        """
+        if policy not in SyncPolicy.ALL:
+            raise InvalidSyncPolicyError("Not a valid sync policy: " +
+                                         str(policy))
+        self.syncPolicy = policy
+        if isinstance(targets, basestring):
+            targets = [targets]
+        self.syncTargets = list(targets or [])
+
+    ###########################################################################
+
+    def setCache(self, cache):
+        """
+        Set the CommandCache communicate(cache=True) keeps results in, None
+        to stop caching.
+        """
+        self.cache = cache
+
+    ###########################################################################
+
+    def setSpill(self, threshold, directory=None):
+        """
+        Keep at most threshold bytes of each of a command's stdout and
+        stderr in memory, moving the rest to a file in directory, ideally
+        on a ramdisk.  run() then returns SpooledOutput objects instead of
+        strings, which log only a preview.  communicate(), timeout() and
+        the getters still give the whole output as strings.  None to keep
+        all output in memory again.
+
+        @param: threshold - bytes per stream, or None
+        @param: directory - where to put the files, the system temp dir if
+                            None
+        """
+        self.spill = threshold
+        self.spillDir = directory
+
+    ###########################################################################
+
+    def setSpawn(self, enabled=True):
+        """
+        Start commands run() handles with posix_spawn instead of Popen, so
+        a large python heap isn't forked for each one.  Commands that need
+        a cwd or close_fds still go through Popen, as do all of them if libc
+        has no posix_spawn.
+
+        @returns: True if posix_spawn will be used
+        """
+        self.spawner = None
+        if enabled and self.libc:
+            spawner = Spawner(self.libc)
+            if spawner.available():
+                self.spawner = spawner
+        return self.spawner is not None
+
+    ###########################################################################
+
+    def setTempDir(self, directory, xdgCache=False):
+        """
+        Give each command run() runs its own directory under directory, a
+        ramdisk's mount point for instance, with TMPDIR, TMP and TEMP
+        pointing at it.  The directory is removed once the command is done.
+        The rest of the command's environment is left as it was.
+
+        @param: directory - where to make the directories, None to stop
+        @param: xdgCache - point XDG_CACHE_HOME there too
+        """
+        self.tempRoot = directory
+        self.tempXdgCache = xdgCache
+
+    ###########################################################################
+
+    def setTrace(self, trace):
+        """
+        Record the commands run() runs to a trace, or answer them from one
+        instead of running them, see command_trace.  None to stop.
+
+        @param: trace - TraceRecorder or TraceReplayer
+        """
+        self.trace = trace
+
+    ###########################################################################
+
+    def setMetrics(self, metrics):
+        """
+        Set the CommandMetrics collector to record each command's timings
+        in, None to stop collecting.
+        """
+        self.metrics = metrics
+
+    ###########################################################################
+
+    def _startMetrics(self):
+        """
+        Note the start of a command, when collecting metrics.
+
+        @returns: start time, or None when not collecting
+        """
+        if self.metrics is None:
+            return None
+        self.metricsCommand = self.command
+        self.syncTime = 0.0
+        return time.time()
+
+    ###########################################################################
+
+    def _recordMetrics(self, start, spawned=None, waited=None, failed=False,
+                       outputBytes=None):
+        """
+        Record a finished command, when collecting metrics.
+
+        @param: start - what _startMetrics returned
+        @param: spawned - time the process was started
+        @param: waited - time the process was done, before any sync
+        """
+        if start is None:
+            return
+        now = time.time()
+        if spawned is None:
+            spawned = start
+        if waited is None:
+            waited = now - self.syncTime
+        if outputBytes is None:
+            outputBytes = 0
+            for output in [self.stdout, self.stderr]:
+                if isinstance(output, basestring):
+                    outputBytes += len(output)
+        self.metrics.record(self.metricsCommand, now - start, spawned - start,
+                            max(0.0, waited - spawned), self.syncTime,
+                            outputBytes, failed or self.retcode != 0)
+
+    ###########################################################################
+
+    def sync(self, policy=None, targets=None):
+        """
+        Flush filesystem buffers per the sync policy, or the policy and
+        targets passed in.
+        """
+        if self.metrics is None:
+            return self._sync(policy, targets)
+        start = time.time()
+        try:
+            self._sync(policy, targets)
+        finally:
+            self.syncTime += time.time() - start
+
+    ###########################################################################
+
+    def _sync(self, policy, targets):
+        """
+        Flush filesystem buffers, see sync.
+        """
+        if policy is None:
+            policy = self.syncPolicy
+        if policy == SyncPolicy.NONE:
+            return
+        if targets is None:
+            targets = self.syncTargets
+        elif isinstance(targets, basestring):
+            targets = [targets]
+
+        if policy == SyncPolicy.GLOBAL:
+            self.libc.sync()
+        elif policy == SyncPolicy.SYNCFS:
+            syncfs = getattr(self.libc, "syncfs", None)
+            if syncfs is None or not targets:
+                #####
+                # Nothing to pick the filesystems by, flush them all
+                self.libc.sync()
+                return
+            for target in targets:
+                try:
+                    fd = os.open(target, os.O_RDONLY)
+                except OSError, err:
+                    self.logger.log(lp.WARNING, "Cannot syncfs " +
+                                    str(target) + ": " + str(err))
+                    continue
+                try:
+                    if syncfs(fd) != 0:
+                        self.logger.log(lp.WARNING, "syncfs failed for " +
+                                        str(target))
+                finally:
+                    os.close(fd)
+        elif policy == SyncPolicy.FDATASYNC:
+            fdatasync = getattr(os, "fdatasync", os.fsync)
+            for target in targets:
+                try:
+                    fd = os.open(target, os.O_RDONLY)
+                except OSError, err:
+                    self.logger.log(lp.WARNING, "Cannot fdatasync " +
+                                    str(target) + ": " + str(err))
+                    continue
+                try:
+                    fdatasync(fd)
+                except OSError, err:
+                    #####
+                    # The command has run, a pipe or device that can't be
+                    # synced mustn't lose its result
+                    self.logger.log(lp.WARNING, "fdatasync failed for " +
+                                    str(target) + ": " + str(err))
+                finally:
+                    os.close(fd)
+        else:
+            raise InvalidSyncPolicyError("Not a valid sync policy: " +
+                                         str(policy))
+
+    ###########################################################################
+
     def getStdout(self):
         """
         Getter for the standard output of the last command.
@@ -168,6 +690,15 @@ class RunWith(object):
 
     ###########################################################################
 
+    def getUsage(self):
+        """
+        Getter for the ResourceUsage of the last command run with
+        communicate() or timeout(), None if it isn't known.
+        """
+        return self.usage
+
+    ###########################################################################
+
     def getReturns(self):
         """
         Getter for the retval, reterr & retcode of the last command.
@@ -186,9 +717,9 @@ class RunWith(object):
 
         @author: Roy Nielsen
         """
-        self.logger.log(lp.INFO, "Output: " + str(self.stdout))
-        self.logger.log(lp.INFO, "Error: " + str(self.stderr))
-        self.logger.log(lp.INFO, "Return code: " + str(self.retcode))
+        self._log(lp.INFO, "Output: %s", self.stdout)
+        self._log(lp.INFO, "Error: %s", self.stderr)
+        self._log(lp.INFO, "Return code: %s", self.retcode)
         return self.stdout, self.stderr, self.retcode
 
     ###########################################################################
@@ -208,7 +739,143 @@ class RunWith(object):
 
     ###########################################################################
 
-    def communicate(self, silent=True):
+    def _spawn(self, command, env, myshell, cwd=None, close_fds=None,
+               newGroup=False):
+        """
+        Start a command with its stdout and stderr on pipes, with
+        posix_spawn if setSpawn turned it on and the command allows, with
+        Popen otherwise.
+
+        @param: newGroup - make the command lead its own process group, for
+                           terminateGroup
+
+        @returns: Popen or SpawnedProcess
+        """
+        if self.spawner is not None and not cwd and not close_fds:
+            return self.spawner.spawn(command, env, myshell, newGroup)
+        preexec = None
+        if newGroup:
+            preexec = os.setsid
+        return Popen(command, stdout=PIPE, stderr=PIPE, shell=myshell,
+                     env=env, cwd=cwd, close_fds=bool(close_fds),
+                     preexec_fn=preexec)
+
+    ###########################################################################
+
+    def run(self, command, env=None, myshell=None, close_fds=None, cwd=None,
+            timeout=None, grace=2.0, cache=False, ttl=None, sync=None,
+            syncTargets=None, silent=True, spill=None):
+        """
+        Run a command, and return what happened as a CommandResult.
+
+        Nothing about the command is kept on the RunWith, unlike with
+        setCommand and communicate, so one RunWith can be shared by any
+        number of threads running commands at the same time.
+
+        @param: command - argv list, or a string
+        @param: env - environment for the command, None to inherit
+        @param: myshell - run with the shell, by default a string is and a
+                          list is not
+        @param: close_fds - close other file descriptors in the child
+        @param: cwd - directory to run the command in
+        @param: timeout - seconds before the command, and everything it
+                          started, is stopped.  See timeout().
+        @param: grace - seconds between SIGTERM and SIGKILL on a timeout
+        @param: cache - look the command up in, and keep its result in, the
+                        cache set with setCache.  Only for read only
+                        commands, and only successful results are kept.
+        @param: ttl - seconds to keep this result, implies cache=True
+        @param: sync - SyncPolicy to use for this command, instead of the
+                       one set with setSyncPolicy
+        @param: syncTargets - paths for the sync policy of this command
+        @param: silent - Whether or not to log the command and its output
+        @param: spill - bytes of output to keep in memory for this command,
+                        instead of the threshold set with setSpill
+
+        @returns: CommandResult.  Its stdout and stderr are SpooledOutput
+                  objects when spilling, to be closed when done with.
+        """
+        myshell = self._checkCommand(command, myshell)
+
+        callerEnv = env
+        if self.trace is not None:
+            replayed = self.trace.replay(command, env, cwd)
+            if replayed is not None:
+                if not silent:
+                    self._log(lp.DEBUG, "Replayed result for: %s", command)
+                return replayed
+
+        cacheKey = None
+        if (cache or ttl is not None) and self.cache is not None:
+            cacheKey = self.cache.key(command, env, cwd or os.getcwd())
+            cached = self.cache.get(cacheKey)
+            if cached is not None:
+                if not silent:
+                    self._log(lp.DEBUG, "Cached result for: %s", command)
+                return cached
+
+        if spill is None:
+            spill = self.spill
+        tempdir = None
+        if self.tempRoot is not None:
+            tempdir, env = makeTempEnviron(self.tempRoot, env,
+                                           self.tempXdgCache)
+        start = time.time()
+        try:
+            #####
+            # Own process group, so a timeout can stop all of it
+            proc = self._spawn(command, env, myshell, cwd, close_fds,
+                               newGroup=timeout is not None)
+            spawned = time.time()
+            stdout, stderr, timedOut = \
+                readPipes(proc, timeout,
+                          onTimeout=lambda proc: terminateGroup(proc, grace),
+                          spill=spill, spillDir=self.spillDir)
+            waited = time.time()
+        except Exception, err:
+            if self.metrics is not None:
+                self.metrics.record(command, time.time() - start, failed=True)
+            if not silent:
+                self._log(lp.WARNING, "command: %s", command)
+            self.logger.log(lp.WARNING, traceback.format_exc())
+            self.logger.log(lp.WARNING, str(err))
+            raise
+        finally:
+            if tempdir is not None:
+                shutil.rmtree(tempdir, ignore_errors=True)
+        self._sync(sync, syncTargets)
+        end = time.time()
+
+        result = CommandResult(command, stdout, stderr, proc.returncode,
+                               end - start, timedOut, usage=usageOf(proc))
+        if self.metrics is not None:
+            self.metrics.record(command, end - start, spawned - start,
+                                waited - spawned, end - waited,
+                                len(stdout) + len(stderr), not result.ok,
+                                result.usage)
+        if cacheKey is not None and result.ok and spill is None:
+            self.cache.put(cacheKey, result, ttl)
+        if self.trace is not None:
+            self.trace.record(command, callerEnv, cwd, result)
+
+        if timedOut:
+            self._log(lp.WARNING, "Timed out after %ss: %s", timeout, command)
+        #####
+        # Lines below could reveal a password if it is passed as an
+        # argument to the command.  Could reveal in whatever stream
+        # the logger is set to log (syslog, console, etc, etc.
+        if not silent:
+            self._log(lp.DEBUG, "Done with command: %s", command)
+            self._log(lp.DEBUG, "stdout: %s", stdout)
+            self._log(lp.DEBUG, "stderr: %s", stderr)
+        self._log(lp.DEBUG, "Command returned with error/returncode: %s",
+                  proc.returncode)
+        return result
+
+    ###########################################################################
+
+    def communicate(self, silent=True, sync=None, syncTargets=None,
+                    cache=False, ttl=None):
         """
         Use the subprocess module to execute a command, returning
         the output of the command
@@ -217,55 +884,60 @@ class RunWith(object):
                          standard logging practices.  Silent = True to
                          not print the command being run.  Silent = False
                          to print the command.
+        @param: sync - SyncPolicy to use for this command, instead of the
+                       one set with setSyncPolicy
+        @param: syncTargets - paths for the sync policy of this command
+        @param: cache - look the command up in, and keep its result in, the
+                        cache set with setCache.  Only for read only
+                        commands, and only successful results are kept.
+        @param: ttl - seconds to keep this result, implies cache=True
+
+        @note: Runs the command given to setCommand with run(), and keeps
+               the result on the RunWith for the getters.
 
         @author: Roy Nielsen
         """
-        self.stdout = ''
-        self.stderr = ''
-        self.retcode = 999
-        if self.command and isinstance(silent, bool):
-            try:
-                proc = Popen(self.command, stdout=PIPE, stderr=PIPE, shell=self.myshell, env=self.environ, close_fds=self.cfds)
-                self.stdout, self.stderr = proc.communicate()
-                self.retcode = proc.returncode
-                self.libc.sync()
-            except Exception, err:
-                if not silent:
-                    self.logger.log(lp.WARNING, "command: " + str(self.printcmd))
-                    self.logger.log(lp.DEBUG, "stdout: " + str(self.stdout))
-                    self.logger.log(lp.DEBUG, "stderr: " + str(self.stderr))
-                    self.logger.log(lp.DEBUG, "retcode: " + str(self.retcode))
-                self.logger.log(lp.WARNING, "stderr: " + str(self.stderr))
-                self.logger.log(lp.WARNING, traceback.format_exc())
-                self.logger.log(lp.WARNING, str(err))
-                raise err
-            else:
-                if not silent:
-                    self.logger.log(lp.DEBUG, "Done with: " + self.printcmd)
-                self.logger.log(lp.DEBUG, "Command returned with error/returncode: " + str(self.retcode))
-            finally:
-                #####
-                # Lines below could reveal a password if it is passed as an
-                # argument to the command.  Could reveal in whatever stream
-                # the logger is set to log (syslog, console, etc, etc.
-                if not silent:
-                    self.logger.log(lp.DEBUG, "Done with command: " + self.printcmd)
-                    self.logger.log(lp.DEBUG, "stdout: " + str(self.stdout))
-                    self.logger.log(lp.DEBUG, "stderr: " + str(self.stderr))
-                    self.logger.log(lp.DEBUG, "retcode: " + str(self.retcode))
-        else:
+        if not self.command or not isinstance(silent, bool):
             self.logger.log(lp.WARNING,
                             "Cannot run a command that way...")
+            self.command = None
             self.stdout = None
             self.stderr = None
             self.retcode = None
+            return self.stdout, self.stderr, self.retcode
 
-        self.command = None
+        self.stdout = ''
+        self.stderr = ''
+        self.retcode = 999
+        try:
+            result = self.run(self.command, self.environ, self.myshell,
+                              self.cfds, cache=cache, ttl=ttl, sync=sync,
+                              syncTargets=syncTargets, silent=silent)
+        finally:
+            self.command = None
+        self.stdout, self.stderr, self.retcode = self._legacyReturns(result)
+        self.usage = result.usage
         return self.stdout, self.stderr, self.retcode
 
     ###########################################################################
 
-    def wait(self, silent=True):
+    def _legacyReturns(self, result):
+        """
+        stdout, stderr and retcode of a run() result, with output that
+        spilled to a file read back into a string and the file removed, as
+        callers of communicate() and the getters expect.
+        """
+        returns = []
+        for output in [result.stdout, result.stderr]:
+            if isinstance(output, SpooledOutput):
+                with output:
+                    output = output.read()
+            returns.append(output)
+        return returns[0], returns[1], result.retcode
+
+    ###########################################################################
+
+    def wait(self, silent=True, sync=None, syncTargets=None):
         """
         Use subprocess to call a command and wait until it is finished before
         moving on...
@@ -275,12 +947,14 @@ class RunWith(object):
         self.stdout = ''
         self.stderr = ''
         if self.command:
+            start = self._startMetrics()
             try:
                 proc = Popen(self.command,
                              stdout=PIPE, stderr=PIPE,
                              shell=self.myshell,
                              env=self.environ,
                              close_fds=self.cfds)
+                spawned = time.time()
                 proc.wait()
                 for line in proc.stdout.readline():
                     if line:
@@ -293,24 +967,29 @@ class RunWith(object):
                     self.stderr = ""
                 proc.wait()
                 self.retcode = proc.returncode
-                self.libc.sync()
+                waited = time.time()
+                self.sync(sync, syncTargets)
+                self._recordMetrics(start, spawned, waited)
             except Exception, err:
+                self._recordMetrics(start, failed=True)
                 if not silent:
                     self.logger.log(lp.WARNING, "command: " + str(self.printcmd))
-                self.logger.log(lp.WARNING, "stderr: " + str(self.stderr))
+                self._log(lp.WARNING, "stderr: %s", self.stderr)
                 self.logger.log(lp.WARNING, traceback.format_exc())
                 self.logger.log(lp.WARNING, str(err))
                 raise err
             else:
                 if not silent:
-                    self.logger.log(lp.DEBUG, "Done with: " + self.printcmd)
-                self.logger.log(lp.DEBUG, "Command returned with error/returncode: " + str(self.retcode))
+                    self._log(lp.DEBUG, "Done with: %s", self.printcmd)
+                self._log(lp.DEBUG,
+                          "Command returned with error/returncode: %s",
+                          self.retcode)
             finally:
                 if not silent:
-                    self.logger.log(lp.DEBUG, "Done with command: " + self.printcmd)
-                    self.logger.log(lp.DEBUG, "stdout: " + str(self.stdout))
-                    self.logger.log(lp.DEBUG, "stderr: " + str(self.stderr))
-                    self.logger.log(lp.DEBUG, "retcode: " + str(self.retcode))
+                    self._log(lp.DEBUG, "Done with command: %s", self.printcmd)
+                    self._log(lp.DEBUG, "stdout: %s", self.stdout)
+                    self._log(lp.DEBUG, "stderr: %s", self.stderr)
+                    self._log(lp.DEBUG, "retcode: %s", self.retcode)
         else:
             self.logger.log(lp.WARNING,
                             "Cannot run a command that is empty...")
@@ -323,148 +1002,167 @@ class RunWith(object):
 
     ###########################################################################
 
-    def waitNpassThruStdout(self, chk_string=None, respawn=False, silent=True):
+    def stream(self, chk_string=None, silent=True, terminate=True,
+               chunkSize=65536, sync=None, syncTargets=None):
         """
-        Use the subprocess module to execute a command, returning
-        the output of the command
-
-        Author: Roy Nielsen
+        Run the command, yielding ("stdout", line) and ("stderr", line)
+        tuples as lines arrive on either pipe.  Both pipes are watched with
+        select and read in chunks, so a child writing a lot to stderr can't
+        stall on a full pipe, and output is never held in memory past the
+        line being yielded.
+
+        @param: chk_string - regular expression, or list of them.  Stop
+                             after yielding the first line that matches.
+        @param: silent - Whether or not to log each line
+        @param: terminate - terminate the child when stopping on chk_string,
+                            otherwise close its pipes and wait for it
+        @param: chunkSize - bytes to read from a pipe at a time
+        @param: sync - SyncPolicy to use for this command, instead of the
+                       one set with setSyncPolicy
+        @param: syncTargets - paths for the sync policy of this command
+
+        @note: Lines are yielded without their newline.  The return code is
+               available with getReturnCode() once the generator is done.
+               A child still running when the generator is closed early
+               is terminated.
         """
         self.stdout = ''
         self.stderr = ''
         self.retcode = 999
-        if self.command:
-            try:
-                proc = Popen(self.command, stdout=PIPE, stderr=PIPE,
-                             shell=self.myshell,
-                             env=self.environ,
-                             close_fds=self.cfds)
-                if proc:
-                    while True:
-                        #####
-                        # process stdout
-                        myout = proc.stdout.readline()
-                        if myout == '' and proc.poll() is not None:
-                            break
-                        tmpline = myout.strip()
-                        self.stdout += tmpline + "\n"
-
-                        if tmpline and not silent:
-                            self.logger.log(lp.DEBUG, str(tmpline))
-
-                        if isinstance(chk_string, str):
-                            if not chk_string:
-                                continue
-                            else:
-                                if re.search(chk_string, tmpline):
-                                    # proc.stdout.close()
-                                    # proc.stderr.close()
-                                    if respawn:
-                                        pass
-                                    else:
-                                        self.logger.log(lp.INFO,
-                                                        "chk_string found" +
-                                                        "... exiting process.")
-                                    break
-
-                        if isinstance(chk_string, list):
-                            if not chk_string:
-                                continue
-                            else:
-                                found = False
-                                for mystring in chk_string:
-                                    if chk_string(mystring, tmpline):
-                                        # proc.stdout.close()
-                                        # proc.stderr.close()
-                                        if respawn:
-                                            pass
-                                        else:
-                                            self.logger.log(lp.INFO,
-                                                            "chk_string " +
-                                                            "found... " +
-                                                            "exiting process.")
-                                            found = True
-                                            break
-                                if found:
-                                    break
-
-                    while True:
-                        myerr = proc.stderr.readline()
-                        if myerr == '' and proc.poll() is not None:
+        if not self.command:
+            self.logger.log(lp.WARNING,
+                            "Cannot run a command that is empty...")
+            self.stdout = None
+            self.stderr = None
+            self.retcode = None
+            return
+
+        if isinstance(chk_string, basestring):
+            chk_string = [chk_string]
+        patterns = [re.compile(pattern) for pattern in chk_string or []]
+
+        printcmd = self.printcmd
+        start = self._startMetrics()
+        try:
+            proc = Popen(self.command, stdout=PIPE, stderr=PIPE,
+                         shell=self.myshell, env=self.environ,
+                         close_fds=self.cfds)
+        except Exception:
+            self._recordMetrics(start, failed=True)
+            raise
+        spawned = time.time()
+        self.command = None
+        outputBytes = 0
+
+        names = {proc.stdout.fileno(): "stdout",
+                 proc.stderr.fileno(): "stderr"}
+        partial = dict([(fd, []) for fd in names])
+        streams = names.keys()
+        found = False
+        try:
+            while streams and not found:
+                try:
+                    ready, _, _ = select.select(streams, [], [])
+                except select.error, err:
+                    if err.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for fd in ready:
+                    data = os.read(fd, chunkSize)
+                    outputBytes += len(data)
+                    if not data:
+                        streams.remove(fd)
+                        if not partial[fd]:
+                            continue
+                        lines = ["".join(partial[fd])]
+                        partial[fd] = []
+                    else:
+                        lines = data.split("\n")
+                        if len(lines) == 1:
+                            partial[fd].append(data)
+                            continue
+                        lines[0] = "".join(partial[fd]) + lines[0]
+                        tail = lines.pop()
+                        partial[fd] = [tail] if tail else []
+                    for line in lines:
+                        if not silent and line.strip():
+                            self._log(lp.DEBUG, "%s", line)
+                        yield names[fd], line
+                        for pattern in patterns:
+                            if pattern.search(line):
+                                found = True
+                                break
+                        if found:
+                            self.logger.log(lp.INFO, "chk_string found" +
+                                            "... exiting process.")
                             break
-                        tmpline = myerr.strip()
-                        self.stderr += tmpline + "\n"
-
-                        if tmpline and not silent:
-                            self.logger.log(lp.DEBUG, str(tmpline))
-
-                        if isinstance(chk_string, str):
-                            if not chk_string:
-                                continue
-                            else:
-                                if re.search(chk_string, tmpline):
-                                    # proc.stdout.close()
-                                    # proc.stderr.close()
-                                    if respawn:
-                                        pass
-                                    else:
-                                        self.logger.log(lp.INFO,
-                                                        "chk_string found" +
-                                                        "... exiting process.")
-                                    break
-
-                        if isinstance(chk_string, list):
-                            if not chk_string:
-                                continue
-                            else:
-                                found = False
-                                for mystring in chk_string:
-                                    if chk_string(mystring, tmpline):
-                                        # proc.stdout.close()
-                                        # proc.stderr.close()
-                                        if respawn:
-                                            pass
-                                        else:
-                                            self.logger.log(lp.INFO,
-                                                            "chk_string " +
-                                                            "found... " +
-                                                            "exiting process.")
-                                            found = True
-                                            break
-                                if found:
-                                    break
+                    if found:
+                        break
+        finally:
+            if proc.poll() is None and (streams and not found or
+                                        found and terminate):
+                try:
+                    proc.terminate()
+                except OSError:
+                    pass
+            proc.stdout.close()
+            proc.stderr.close()
+            proc.wait()
+            self.retcode = proc.returncode
+            waited = time.time()
+            self.sync(sync, syncTargets)
+            self._recordMetrics(start, spawned, waited,
+                                outputBytes=outputBytes)
+            if not silent:
+                self._log(lp.DEBUG, "Done with command: %s", printcmd)
+            self._log(lp.DEBUG, "retcode: %s", self.retcode)
 
-                proc.wait()
-                # proc.stdout.close()
-                # proc.stderr.close()
-                self.retcode = proc.returncode
-                self.libc.sync()
+    ###########################################################################
 
-            except Exception, err:
-                if not silent:
-                    self.logger.log(lp.WARNING, "command: " + str(self.printcmd))
-                self.logger.log(lp.WARNING, "stderr: " + str(self.stderr))
-                self.logger.log(lp.WARNING, traceback.format_exc())
-                self.logger.log(lp.WARNING, str(err))
-                raise err
-            else:
-                if not silent:
-                    self.logger.log(lp.DEBUG, "Done with: " + self.printcmd)
-            finally:
-                self.retcode = proc.returncode
-                if not silent:
-                    self.logger.log(lp.DEBUG, "Done with command: " + self.printcmd)
-                self.logger.log(lp.DEBUG, "stdout: " + str(self.stdout))
-                self.logger.log(lp.DEBUG, "stderr: " + str(self.stderr))
-                self.logger.log(lp.DEBUG, "retcode: " + str(self.retcode))
-        else:
+    def waitNpassThruStdout(self, chk_string=None, respawn=False, silent=True,
+                            sync=None, syncTargets=None):
+        """
+        Use the subprocess module to execute a command, returning
+        the output of the command
+
+        @param: chk_string - regular expression, or list of them, to stop
+                             reading output at
+        @param: respawn - unused, kept for existing callers
+
+        @note: Built on stream(), so stdout and stderr are read together.
+               Use stream() directly to work through large output without
+               holding all of it.
+
+        Author: Roy Nielsen
+        """
+        if not self.command:
             self.logger.log(lp.WARNING,
                             "Cannot run a command that is empty...")
             self.stdout = None
             self.stderr = None
             self.retcode = None
+            return self.stdout, self.stderr, self.retcode
+
+        printcmd = self.printcmd
+        output = {"stdout": [], "stderr": []}
+        try:
+            for name, line in self.stream(chk_string, silent, terminate=False,
+                                          sync=sync, syncTargets=syncTargets):
+                output[name].append(line.strip() + "\n")
+        except Exception, err:
+            if not silent:
+                self.logger.log(lp.WARNING, "command: " + str(printcmd))
+            self._log(lp.WARNING, "stderr: %s", "".join(output["stderr"]))
+            self.logger.log(lp.WARNING, traceback.format_exc())
+            self.logger.log(lp.WARNING, str(err))
+            raise err
+        self.stdout = "".join(output["stdout"])
+        self.stderr = "".join(output["stderr"])
+        if not silent:
+            self._log(lp.DEBUG, "Done with: %s", printcmd)
+        self._log(lp.DEBUG, "stdout: %s", self.stdout)
+        self._log(lp.DEBUG, "stderr: %s", self.stderr)
 
-        self.command = None
         return self.stdout, self.stderr, self.retcode
 
     ###########################################################################
@@ -473,6 +1171,9 @@ class RunWith(object):
         """
         Support function for the "runWithTimeout" function below
 
+        @note: timeout() no longer uses this, it stops the command's whole
+               process group with terminateGroup.
+
         @author: Roy Nielsen
         """
         timeout["value"] = True
@@ -480,7 +1181,8 @@ class RunWith(object):
 
     ###########################################################################
 
-    def timeout(self, timout_sec, silent=True):
+    def timeout(self, timout_sec, silent=True, sync=None, syncTargets=None,
+                grace=2.0):
         """
         Run a command with a timeout - return:
         Returncode of the process
@@ -489,43 +1191,26 @@ class RunWith(object):
         timout - True if the command timed out
                  False if the command completed successfully
 
+        The command runs in its own process group.  When the timeout runs
+        out the whole group gets SIGTERM, then SIGKILL after grace seconds,
+        so nothing the command started outlives it or holds its output
+        open.  Output written before the timeout is kept.
+
         @author: Roy Nielsen
         """
+        timedOut = False
         if self.command:
             try:
-                proc = Popen(self.command,
-                             stdout=PIPE, stderr=PIPE, shell=self.myshell)
-
-                timeout = {"value": False}
-                timer = threading.Timer(timout_sec, self.killProc,
-                                        [proc, timeout])
-                timer.start()
-                self.stdout, self.stderr = proc.communicate()
-                timer.cancel()
-                self.retcode = proc.returncode
-            except Exception, err:
-                if not silent:
-                    self.logger.log(lp.WARNING, "command: " + str(self.printcmd))
-                self.logger.log(lp.WARNING, "stderr: " + str(self.stderr))
-                self.logger.log(lp.WARNING, traceback.format_exc())
-                self.logger.log(lp.WARNING, str(err))
-                raise err
-            else:
-                if not silent:
-                    self.logger.log(lp.DEBUG, "Done with: " + self.printcmd)
-                self.stdout = proc.stdout
-                self.stderr = proc.stderr
-                self.retcode = proc.returncode
-                self.libc.sync()
-                proc.stdout.close()
-                proc.stderr.close()
+                result = self.run(self.command, self.environ, self.myshell,
+                                  self.cfds, timeout=timout_sec, grace=grace,
+                                  sync=sync, syncTargets=syncTargets,
+                                  silent=silent)
             finally:
-                if not silent:
-                    self.logger.log(lp.DEBUG, "Done with command: " +
-                                    str(self.printcmd))
-                    self.logger.log(lp.DEBUG, "stdout: " + str(self.stdout))
-                    self.logger.log(lp.DEBUG, "stderr: " + str(self.stderr))
-                    self.logger.log(lp.DEBUG, "retcode: " + str(self.retcode))
+                self.command = None
+            self.stdout, self.stderr, self.retcode = \
+                self._legacyReturns(result)
+            self.usage = result.usage
+            timedOut = result.timedOut
         else:
             self.logger.log(lp.WARNING,
                             "Cannot run a command that is empty...")
@@ -534,11 +1219,12 @@ class RunWith(object):
             self.retcode = None
 
         self.command = None
-        return self.stdout, self.stderr, self.retcode, timeout["value"]
+        return self.stdout, self.stderr, self.retcode, timedOut
 
     ###########################################################################
 
-    def runAs(self, user="", password="", silent=True):
+    def runAs(self, user="", password="", silent=True, sync=None,
+              syncTargets=None):
         """
         Use pexpect to run "su" to run a command as another user...
 
@@ -575,84 +1261,48 @@ class RunWith(object):
                     self.logger.log(lp.DEBUG, "Trying to execute: \"" +
                                     " ".join(internal_command) + "\"")
 
-            (master, slave) = pty.openpty()
-
-            proc = Popen(internal_command,
-                         stdin=slave, stdout=slave, stderr=slave,
-                         close_fds=True)
-
-            prompt = os.read(master, 10)
-
-            if re.match("^Password:", str(prompt)):
-                os.write(master, password + "\n")
-                line = os.read(master, 512)
-                output = output + line
-                while True:
-                    #####
-                    # timeout of 0 means "poll"
-                    ready, _, _ = select.select([master], [], [], 0)
-                    if ready:
-                        line = os.read(master, 512)
-                        #####
-                        # Warning, uncomment at your own risk - several
-                        # programs print empty lines that will cause this to
-                        # break and the output will be all goofed up.
-                        # if not line :
-                        #    break
-                        # print output.rstrip()
-                        output = output + line
-                    elif proc.poll() is not None:
-                        break
-                os.close(master)
-                os.close(slave)
-                self.libc.sync()
-                proc.wait()
-                self.libc.sync()
-                self.stdout = proc.stdout
-                self.stderr = proc.stderr
-                self.retcode = proc.returncode
-            else:
-                output = prompt
-                while True:
-                    #####
-                    # timeout of 0 means "poll"
-                    ready, _, _ = select.select([master], [], [], 0)
-                    if ready:
-                        line = os.read(master, 512)
-                        #####
-                        # Warning, uncomment at your own risk - several
-                        # programs print empty lines that will cause this to
-                        # break and the output will be all goofed up.
-                        # if not line :
-                        #    break
-                        # print output.rstrip()
-                        output = output + line
-                    elif proc.poll() is not None:
-                        break
-                os.close(master)
-                os.close(slave)
-                proc.wait()
-                self.stdout = output
-                self.stderr = str(proc.stderr)
-                self.retcode = proc.returncode
+            start = self._startMetrics()
+            session = PtySession(internal_command, self.logger).spawn()
+            try:
+                #####
+                # su asks for the password before anything else, only its
+                # first output is taken for the prompt, so a line of the
+                # command's own output never gets the password.
+                if session.expectFirst(["Password:"], timeout=3) is not None:
+                    session.sendline(password)
+                output = session.readToEof()
+            finally:
+                self.retcode = session.close()
+                self.timings = session.timings
+            waited = time.time()
+            self.sync(sync, syncTargets)
+            self.stdout = output
+            self.stderr = ""
+            self._recordMetrics(start, start + session.timings[0][1], waited)
             output = output.strip()
             if not silent:
-                self.logger.log(lp.DEBUG, "retcode: " + str(self.stdout))
-                self.logger.log(lp.DEBUG, "retcode: " + str(self.stderr))
-                self.logger.log(lp.DEBUG, "retcode: " + str(self.retcode))
+                self._log(lp.DEBUG, "stdout: %s", self.stdout)
+                self._log(lp.DEBUG, "stderr: %s", self.stderr)
+                self._log(lp.DEBUG, "retcode: %s", self.retcode)
 
         self.command = None
         return self.stdout, self.stderr, self.retcode
 
     ###########################################################################
 
-    def liftDown(self, user="", target_dir="", silent=True):
+    def liftDown(self, user="", target_dir="", silent=True, sync=None,
+                 syncTargets=None, persistent=False):
         """
         Use the lift (elevator) to execute a command from privileged mode
         to a user's context with that user's uid.  Does not require a password.
 
         @param: user - name of user to run as
         @param: target_dir - directory to run the command from
+        @param: persistent - run the command through a long lived helper
+                             process for the user, started with su on first
+                             use, instead of su for every command.  The
+                             helper exits after coprocessIdle seconds idle,
+                             or with closeCoprocesses().
 
         @author: Roy Nielsen
         """
@@ -692,14 +1342,27 @@ class RunWith(object):
             elif isinstance(self.command, basestring):
                 internal_command.append(self.command)
 
-        self.setCommand(internal_command)
-        self.stdout, self.stderr, self.retcode = self.communicate()
+        if persistent:
+            if user not in self.coprocesses:
+                self.coprocesses[user] = Coprocess(user, self.logger,
+                                                   self.coprocessIdle)
+            cwd = None
+            if isinstance(target_dir, basestring) and target_dir:
+                cwd = os.getcwd()
+            start = self._startMetrics()
+            self.stdout, self.stderr, self.retcode = \
+                self.coprocesses[user].run(self.command, cwd)
+            waited = time.time()
+            self.sync(sync, syncTargets)
+            self._recordMetrics(start, waited=waited)
+        else:
+            self.setCommand(internal_command)
+            self.stdout, self.stderr, self.retcode = self.communicate(
+                sync=sync, syncTargets=syncTargets)
         if not silent:
-            for line in self.stdout.split('\n'):
-                self.logger.log(lp.DEBUG, "out: " + str(line))
-            for line in self.stderr.split('\n'):
-                self.logger.log(lp.DEBUG, "err: " + str(line))
-            self.logger.log(lp.DEBUG, "retcode: " + str(self.retcode))
+            self._log(lp.DEBUG, "out: %s", self.stdout)
+            self._log(lp.DEBUG, "err: %s", self.stderr)
+            self._log(lp.DEBUG, "retcode: %s", self.retcode)
 
         if target_dir:
             os.chdir(return_dir)
@@ -709,6 +1372,16 @@ class RunWith(object):
 
     ###########################################################################
 
+    def closeCoprocesses(self):
+        """
+        Stop the helper processes started by liftDown(persistent=True).
+        """
+        for coprocess in self.coprocesses.values():
+            coprocess.close()
+        self.coprocesses = {}
+
+    ###########################################################################
+
     def getecho (self, fileDescriptor):
         """This returns the terminal echo mode. This returns True if echo is
         on or False if echo is off. Child applications that are expecting you
@@ -737,22 +1410,17 @@ class RunWith(object):
         If timeout is None or negative, then this method to block forever until
         ECHO flag is False.
 
+        Wakes up on output from the terminal, or with a backoff, rather
+        than sleeping a tenth of a second between checks.
+
         Borrowed from pexpect - acceptable to license
         """
-        if timeout is not None and timeout > 0:
-            end_time = time.time() + timeout
-        while True:
-            if not self.getecho(fileDescriptor):
-                return True
-            if timeout < 0 and timeout is not None:
-                return False
-            if timeout is not None:
-                timeout = end_time - time.time()
-            time.sleep(0.1)
+        return waitForNoEcho(fileDescriptor, timeout, fileDescriptor)
 
     ###########################################################################
 
-    def runAsWithSudo(self, user="", password="", silent=True) :
+    def runAsWithSudo(self, user="", password="", silent=True, sync=None,
+                      syncTargets=None) :
         """
         Use pty method to run "su" to run a command as another user...
 
@@ -762,7 +1430,7 @@ class RunWith(object):
         """
         self.logger.log(lp.DEBUG, "Starting runAsWithSudo: ")
         self.logger.log(lp.DEBUG, "\tuser: \"" + str(user) + "\"")
-        self.logger.log(lp.DEBUG, "\tcmd : \"" + str(self.command) + "\"")
+        self._log(lp.DEBUG, "\tcmd : \"%s\"", self.command)
         if re.match("^\s+$", user) or re.match("^\s+$", password) or \
            not user or not password or \
            not self.command:
@@ -799,102 +1467,65 @@ class RunWith(object):
                                                 "'" +
                                                 str(self.command) + "'"))
 
+            start = self._startMetrics()
             try:
-                (master, slave) = pty.openpty()
+                session = PtySession(internal_command, self.logger).spawn()
             except Exception, err:
-                self.logger.log(lp.WARNING, "Error trying to open pty: " +
+                self._recordMetrics(start, failed=True)
+                self.logger.log(lp.WARNING,
+                                "Error opening process to pty: " +
                                 str(err))
                 self.logger.log(lp.WARNING, traceback.format_exc())
                 self.logger.log(lp.WARNING, str(err))
                 raise err
             else:
                 try:
-                    proc = Popen(internal_command,
-                                 stdin=slave, stdout=slave, stderr=slave,
-                                 close_fds=True)
-                except Exception, err:
-                    self.logger.log(lp.WARNING,
-                                    "Error opening process to pty: " +
-                                    str(err))
-                    self.logger.log(lp.WARNING, traceback.format_exc())
-                    self.logger.log(lp.WARNING, str(err))
-                    raise err
-                else:
-                    #####
-                    # Catch the su password prompt
-                    # prompt = os.read(master, 512)
-                    self.waitnoecho(master, 3)
-                    self.prompt = os.read(master, 512)
-
-                    #####
-                    # pass in the password
-                    os.write(master, password.strip() + "\n")
-
                     #####
-                    # catch the password
-                    self.prompt = os.read(master, 512)
+                    # Catch the su password prompt, and pass in the password
+                    session.waitnoecho(3)
+                    session.expect(["[Pp]assword.*:"], timeout=3)
+                    self.prompt = session.before
+                    session.sendline(password.strip())
 
                     #####
-                    # Wait for the next password prompt
-                    self.waitnoecho(master, 3)
-
-                    #####
-                    # catch the password prompt
-                    self.prompt = os.read(master, 512)
-
-                    #####
-                    # Enter the sudo password
-                    os.write(master, password + "\n")
-
-                    #####
-                    # Catch the password
-                    os.read(master, 512)
-
-                    # output = tmp + output
-                    while True:
-                        #####
-                        # timeout of 0 means "poll"
-                        ready, _, _ = select.select([master], [], [], 0)
-                        if ready:
-                            line = os.read(master, 512)
-                            #####
-                            # Warning, uncomment at your own risk - several
-                            # programs print empty lines that will cause this
-                            # to break and the output will be all goofed up.
-                            # if not line :
-                            #    break
-                            # print output.rstrip()
-                            output = output + line
-                        elif proc.poll() is not None:
-                            break
-                        # print output.strip()
-                    os.close(master)
-                    os.close(slave)
-                    self.libc.sync()
-                    proc.wait()
-                    self.libc.sync()
-                    self.stdout = proc.stdout
-                    self.stderr = proc.stderr
-                    self.retcode = proc.returncode
-                    # print output.strip()
+                    # Catch the sudo password prompt, and enter the password
+                    session.waitnoecho(3)
+                    session.expect(["[Pp]assword.*:"], timeout=3)
+                    self.prompt = session.before
+                    session.sendline(password)
+
+                    output = session.readToEof()
+                finally:
+                    self.retcode = session.close()
+                    self.timings = session.timings
+                waited = time.time()
+                self.sync(sync, syncTargets)
+                self.stdout = output
+                self.stderr = ""
+                self._recordMetrics(start, start + session.timings[0][1],
+                                    waited)
             if not silent:
-                self.logger.log(lp.DEBUG, "\n\nLeaving runAs with Sudo: \"" +
-                                str(self.stdout) + "\"\n\n")
+                self._log(lp.DEBUG, "\n\nLeaving runAs with Sudo: \"%s\"\n\n",
+                          self.stdout)
         self.command = None
         return self.stdout, self.stderr, self.retcode
 
     ###########################################################################
 
-    def runWithSudo(self, password="", silent=True) :
+    def runWithSudo(self, password="", silent=True, sync=None,
+                    syncTargets=None) :
         """
         Use pty method to run "sudo" to run a command with elevated privilege.
 
         Required parameters: user, password, command
 
+        @note: For more than a command or two, sudo_session.SudoSession
+               authenticates once instead of on every command.
+
         @author: Roy Nielsen
         """
         self.logger.log(lp.DEBUG, "Starting runWithSudo: ")
-        self.logger.log(lp.DEBUG, "\tcmd : " + str(self.command))
+        self._log(lp.DEBUG, "\tcmd : %s", self.command)
         if re.match("^\s+$", password) or \
            not password or \
            not self.command:
@@ -913,81 +1544,51 @@ class RunWith(object):
             elif isinstance(self.command, basestring):
                 cmd = cmd + [self.command]
 
+            start = self._startMetrics()
             try:
-                (master, slave) = pty.openpty()
+                session = PtySession(cmd, self.logger).spawn()
             except Exception, err:
-                self.logger.log(lp.WARNING, "Error trying to open pty: " +
+                self._recordMetrics(start, failed=True)
+                self.logger.log(lp.WARNING,
+                                "Error opening process to pty: " +
                                 str(err))
                 self.logger.log(lp.WARNING, traceback.format_exc())
                 self.logger.log(lp.WARNING, str(err))
                 raise err
             else:
                 try:
-                    proc = Popen(cmd, stdin=slave, stdout=slave, stderr=slave,
-                                 close_fds=True)
-                except Exception, err:
-                    self.logger.log(lp.WARNING,
-                                    "Error opening process to pty: " +
-                                    str(err))
-                    self.logger.log(lp.WARNING, traceback.format_exc())
-                    self.logger.log(lp.WARNING, str(err))
-                    raise err
-                else:
                     #####
-                    # Catch the sudo password prompt
-                    # prompt = os.read(master, 512)
-                    self.waitnoecho(master, 3)
-                    self.prompt = os.read(master, 512)
-
-                    #####
-                    # Enter the sudo password
-                    os.write(master, password + "\n")
-
-                    #####
-                    # Catch the password
-                    os.read(master, 512)
-
-                    # output = tmp + output
-                    while True:
-                        #####
-                        # timeout of 0 means "poll"
-                        ready, _, _ = select.select([master], [], [], 0)
-                        if ready:
-                            line = os.read(master, 512)
-                            #####
-                            # Warning, uncomment at your own risk - several
-                            # programs print empty lines that will cause this
-                            # to break and the output will be all goofed up.
-                            # if not line :
-                            #    break
-                            # print output.rstrip()
-                            output = output + line
-                        elif proc.poll() is not None:
-                            break
-                        # print output.strip()
-                    os.close(master)
-                    os.close(slave)
-                    self.libc.sync()
-                    proc.wait()
-                    self.libc.sync()
-                    self.stdout = output
-                    self.stderr = proc.stderr
-                    self.retcode = proc.returncode
-                    #print output.strip()
+                    # Catch the sudo password prompt, and enter the password
+                    session.waitnoecho(3)
+                    session.expect(["[Pp]assword.*:"], timeout=3)
+                    self.prompt = session.before
+                    session.sendline(password)
+
+                    output = session.readToEof()
+                finally:
+                    self.retcode = session.close()
+                    self.timings = session.timings
+                waited = time.time()
+                self.sync(sync, syncTargets)
+                self.stdout = output
+                self.stderr = ""
+                self._recordMetrics(start, start + session.timings[0][1],
+                                    waited)
             #output = output.strip()
             if not silent:
                 #####
                 # ONLY USE WHEN IN DEVELOPMENT AND DEBUGGING OR YOU MAY
                 # REVEAL MORE THAN YOU WANT TO IN THE LOGS!!!
-                self.logger.log(lp.DEBUG, "\n\nLeaving runAs with Sudo: \"" + \
-                                str(output) + "\"\n" + str(self.stdout) + "\n")
+                self._log(lp.DEBUG, "\n\nLeaving runAs with Sudo: \"%s\"\n",
+                          output)
             return output
 
 ##############################################################################
 
-class RunThread(threading.Thread):
+class RunThread(object):
     """
-    Use a thread & subprocess.Popen to run something
+    Run something in the background on the shared CommandPool, see
+    command_pool.sharedPool.
 
     To use - where command could be an array, or a string... :
 
@@ -996,9 +1597,14 @@ class RunThread(threading.Thread):
     run_thread.join()
     print run_thread.stdout
 
+    @note: Used to be a threading.Thread per command, start() now queues the
+           command on the pool's bounded set of workers.  A list runs
+           without the shell and a string with it, unless myshell says
+           otherwise.
+
     @author: Roy Nielsen
     """
-    def __init__(self, command, logger, myshell=False):
+    def __init__(self, command, logger, myshell=None, priority=0):
         """
         Initialization method
         """
@@ -1007,14 +1613,8 @@ class RunThread(threading.Thread):
         self.retout = None
         self.reterr = None
         self.shell = myshell
-        threading.Thread.__init__(self)
-
-        if isinstance(self.command, types.ListType):
-            self.shell = True
-            self.printcmd = " ".join(self.command)
-        if isinstance(self.command, types.StringTypes):
-            self.shell = False
-            self.printcmd = self.command
+        self.priority = priority
+        self.future = None
 
         if isinstance(logger, CyLogger):
             self.logger = logger
@@ -1026,33 +1626,57 @@ class RunThread(threading.Thread):
 
     ##########################################################################
 
+    def start(self):
+        """
+        Queue the command on the shared pool.
+        """
+        #####
+        # command_pool imports this module
+        from . command_pool import sharedPool
+        self.future = sharedPool(self.logger).run(self.command,
+                                                  self.priority,
+                                                  myshell=self.shell)
+
+    ##########################################################################
+
     def run(self):
+        """
+        Run the command in this thread.
+        """
         if self.command:
             try:
-                p = Popen(self.command, stdout=PIPE,
-                                        stderr=PIPE,
-                                        shell=self.shell)
-                self.retout, self.reterr = p.communicate()
-                self.logger.log(lp.WARNING, "Finished \"run\" of: " +
-                                str(self.command))
+                result = RunWith(self.logger).run(self.command,
+                                                  myshell=self.shell)
             except Exception, err:
                 self.logger.log(lp.WARNING, "Exception trying to open: " +
                                 str(self.command))
                 self.logger.log(lp.WARNING, traceback.format_exc())
                 self.logger.log(lp.WARNING, str(err))
                 raise err
-            else:
-                try:
-                    self.retout, self.reterr = p.communicate()
-                except Exception, err:
-                    self.logger.log(lp.WARNING, "Exception trying to open: " +
-                                    str(self.printcmd))
-                    self.logger.log(lp.WARNING, "Associated exception: " +
-                                    str(err))
-                    raise err
-                else:
-                    self.logger.log(lp.WARNING, "Finished \"run\" of: " +
-                                    str(self.printcmd))
+            self.retout, self.reterr = result.stdout, result.stderr
+            self.logger.log(lp.WARNING, "Finished \"run\" of: " +
+                            str(self.command))
+
+    ##########################################################################
+
+    def join(self, timeout=None):
+        """
+        Wait for the command started with start() to finish.
+        """
+        if self.future is None:
+            return
+        result = self.future.result(timeout)
+        self.retout, self.reterr = result.stdout, result.stderr
+        self.logger.log(lp.WARNING, "Finished \"run\" of: " +
+                        str(self.command))
+
+    ##########################################################################
+
+    def isAlive(self):
+        """
+        @returns: True if the command is queued or running
+        """
+        return self.future is not None and not self.future.done()
 
     ##########################################################################
 
@@ -1078,10 +1702,13 @@ class RunThread(threading.Thread):
 
 ##############################################################################
 
-def runMyThreadCommand(cmd, logger, myshell=False):
+def runMyThreadCommand(cmd, logger, myshell=None, wait=True, priority=0):
     """
     Use the RunThread class to get the stdout and stderr of a command
 
+    @param: wait - False to return the CommandFuture of the command's
+                   CommandResult right away, instead of waiting for it
+
     @author: Roy Nielsen
     """
     retval = None
@@ -1089,12 +1716,11 @@ def runMyThreadCommand(cmd, logger, myshell=False):
     if not isinstance(logger, CyLogger):
         raise NotACyLoggerError("Passed in value for logger is "
                                 "invalid, try again.")
-    print str(cmd)
-    print str(logger)
     if cmd and logger:
-        run_thread = RunThread(cmd, logger, myshell)
+        run_thread = RunThread(cmd, logger, myshell, priority)
         run_thread.start()
-        # run_thread.run()
+        if not wait:
+            return run_thread.future
         run_thread.join()
         retval = run_thread.getStdout()
         reterr = run_thread.getStderr()
@@ -1102,4 +1728,3 @@ def runMyThreadCommand(cmd, logger, myshell=False):
         logger.log(lp.INFO, "Invalid parameters, please report this as a bug.")
 
     return retval, reterr
-
@@ -0,0 +1,145 @@
+"""
+Command output that moves to a file once it gets large.
+
+RunWith normally keeps all of a command's stdout and stderr in memory, and
+logging it copies it again.  Commands like system_profiler or a verbose
+build can write hundreds of megabytes.  A SpooledOutput keeps output in
+memory up to a threshold, then moves it to a temporary file, ideally in a
+directory on a ramdisk, so peak memory stays bounded however much the
+command writes.  It reads back whole, by line, or as an mmap, and str()
+gives only a preview, so logging it stays cheap.
+"""
+from __future__ import absolute_import
+import mmap
+import tempfile
+
+
+class SpooledOutput(object):
+    """
+    Output of one stream of a command, in memory until it passes a threshold
+    and in a temporary file after.  The file is removed when closed.
+
+    @method write(self, data)
+    @method read(self)
+    @method mmap(self)
+    @method preview(self, limit=None)
+    @method close(self)
+    """
+    def __init__(self, threshold=1048576, directory=None, previewSize=1024):
+        """
+        @param: threshold - bytes kept in memory before moving to a file,
+                            0 to write to a file from the start
+        @param: directory - where to put the file, for instance a ramdisk
+                            mount point.  The system temp dir if None.
+        @param: previewSize - bytes of output str() shows
+        """
+        self.threshold = max(0, int(threshold))
+        self.directory = directory
+        self.previewSize = previewSize
+        #####
+        # Moved to a file here rather than by SpooledTemporaryFile, which
+        # never does it for a max_size of 0 on python 2.
+        self.file = tempfile.SpooledTemporaryFile(prefix="ramdisk-out-",
+                                                  dir=directory)
+        self.size = 0
+        self.head = ""
+        self.spilled = False
+        if not self.threshold:
+            self._rollover()
+
+    ###########################################################################
+
+    def write(self, data):
+        """
+        Add output to the end.
+        """
+        if len(self.head) < self.previewSize:
+            self.head += data[:self.previewSize - len(self.head)]
+        self.file.write(data)
+        self.size += len(data)
+        if self.size > self.threshold and not self.spilled:
+            self._rollover()
+
+    ###########################################################################
+
+    def _rollover(self):
+        """
+        Move the output to a file.
+        """
+        self.file.rollover()
+        self.spilled = True
+
+    ###########################################################################
+
+    def read(self):
+        """
+        @returns: all of the output, as one string.  Reads the whole file
+                  into memory, see mmap() or iterating for large output.
+        """
+        self.file.seek(0)
+        return self.file.read()
+
+    ###########################################################################
+
+    def __iter__(self):
+        """
+        Iterate over the lines of the output, without reading all of it.
+        """
+        self.file.seek(0)
+        for line in self.file:
+            yield line
+
+    ###########################################################################
+
+    def mmap(self):
+        """
+        Map the output into memory read only, moving it to a file first if
+        it is still in memory.
+
+        @returns: mmap object, or "" if there is no output, which can't be
+                  mapped.
+        """
+        if not self.size:
+            return ""
+        self._rollover()
+        self.file.flush()
+        return mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    ###########################################################################
+
+    def preview(self, limit=None):
+        """
+        @returns: the start of the output, at most limit bytes, the
+                  previewSize if None, marked if there is more.
+        """
+        if limit is None or limit > self.previewSize:
+            limit = self.previewSize
+        if self.size <= limit:
+            return self.head[:limit]
+        return self.head[:limit] + "... (" + str(self.size) + " bytes)"
+
+    ###########################################################################
+
+    def close(self):
+        """
+        Throw the output away, removing the file if there is one.
+        """
+        self.file.close()
+
+    ###########################################################################
+
+    def __len__(self):
+        return self.size
+
+    def __str__(self):
+        return self.preview()
+
+    def __repr__(self):
+        return "SpooledOutput(size=%d, spilled=%s)" % (self.size,
+                                                       self.spilled)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,255 @@
+"""
+Authenticate to sudo once, then run many commands with it.
+
+RunWith.runWithSudo and runAsWithSudo hold a password dialogue on a pty
+for every command.  A SudoSession gives sudo the password once, with
+"sudo -S -v", and then runs each command with "sudo -n", which uses sudo's
+cached credentials and never prompts.  A background thread runs
+"sudo -n -v" to keep the credentials from timing out while the session is
+open.
+
+Where the sudoers policy doesn't cache credentials, timestamp_timeout=0
+for instance, "sudo -n" can't work, and each command gets the password on
+its stdin with "sudo -S" instead.  Either way nothing needs a pty.
+
+sudo can keep the cached credentials per terminal, so every sudo the
+session runs stays in this process' session, with its controlling
+terminal, in a process group of its own so a timeout can stop it.
+Whether the credentials are still cached is told from the exit status of
+"sudo -n -v", run in the C locale, never from sudo's messages.
+
+The password is kept in memory for as long as the session is open, to
+authenticate again if the cached credentials are lost.
+"""
+from __future__ import absolute_import
+import os
+import time
+import threading
+import traceback
+from subprocess import Popen, PIPE
+
+from . loggers import CyLogger
+from . loggers import LogPriority as lp
+from . libHelperExceptions import NotACyLoggerError
+from . run_commands import CommandResult, readPipes, terminateGroup, preview
+from . resource_usage import usageOf
+
+
+class SudoSessionError(Exception):
+    """
+    Custom Exception
+    """
+    def __init__(self, *args, **kwargs):
+        Exception.__init__(self, *args, **kwargs)
+
+
+class SudoSession(object):
+    """
+    Run commands with sudo, authenticating once.
+
+    with SudoSession(logger) as sudo:
+        sudo.authenticate(password)
+        result = sudo.run(["/bin/ls", "/var/root"])
+
+    @method authenticate(self, password)
+    @method run(self, command, user=None, timeout=None, silent=True)
+    @method close(self, invalidate=True)
+    """
+    def __init__(self, logger, sudo="/usr/bin/sudo", refresh=60):
+        """
+        @param: logger - CyLogger
+        @param: sudo - path to sudo
+        @param: refresh - seconds between refreshes of the cached
+                          credentials, None for no refresh thread
+        """
+        if isinstance(logger, CyLogger):
+            self.logger = logger
+        else:
+            raise NotACyLoggerError("Passed in value for logger" +
+                                    " is invalid, try again.")
+        self.sudo = sudo
+        self.refresh = refresh
+        self.password = None
+        self.cached = False
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    ###########################################################################
+
+    def _sudo(self, command, timeout=None, password=False, env=None):
+        """
+        Run command, a sudo command line.  Every sudo the session runs goes
+        through here, so they all share the same session and terminal.
+
+        @param: password - True for a sudo -S command line, to give it the
+                           password on its stdin
+        @param: env - environment, this process' if None
+
+        @returns: CommandResult
+        """
+        start = time.time()
+        #####
+        # setpgrp rather than setsid, a new session would leave the
+        # terminal sudo keeps the credentials for
+        proc = Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE, env=env,
+                     preexec_fn=os.setpgrp)
+        try:
+            if password:
+                proc.stdin.write(self.password + "\n")
+        except IOError:
+            #####
+            # sudo exited without reading it
+            pass
+        proc.stdin.close()
+        stdout, stderr, timedOut = readPipes(proc, timeout,
+                                             onTimeout=terminateGroup)
+        return CommandResult(command, stdout, stderr, proc.returncode,
+                             time.time() - start, timedOut,
+                             usage=usageOf(proc))
+
+    ###########################################################################
+
+    def _isCached(self):
+        """
+        @returns: True if sudo has cached credentials, from the exit status
+                  of sudo -n -v
+        """
+        env = dict(os.environ)
+        env["LC_ALL"] = "C"
+        return self._sudo([self.sudo, "-n", "-v"], 30, env=env).ok
+
+    ###########################################################################
+
+    def _validate(self):
+        """
+        Authenticate with the password kept, and find out if sudo caches
+        the credentials.
+
+        @returns: True if the password was accepted
+        """
+        result = self._sudo([self.sudo, "-S", "-p", "", "-v"], 30,
+                            password=True)
+        if not result.ok:
+            self.logger.log(lp.WARNING, "sudo did not accept the password")
+            return False
+        self.cached = self._isCached()
+        if not self.cached:
+            self.logger.log(lp.INFO, "sudo does not cache credentials, " +
+                            "passing the password to each command")
+        return True
+
+    ###########################################################################
+
+    def authenticate(self, password):
+        """
+        Give sudo the password, and start refreshing its cached
+        credentials.
+
+        @returns: True if the password was accepted
+        """
+        if not password or not password.strip():
+            raise SudoSessionError("Cannot authenticate without a password")
+        with self.lock:
+            self.password = password
+            if not self._validate():
+                self.password = None
+                return False
+        if self.cached and self.refresh and self.thread is None:
+            self.stopEvent.clear()
+            self.thread = threading.Thread(target=self._refresh)
+            self.thread.daemon = True
+            self.thread.start()
+        return True
+
+    ###########################################################################
+
+    def _refresh(self):
+        """
+        Keep sudo's cached credentials from timing out.
+        """
+        while not self.stopEvent.wait(self.refresh):
+            try:
+                if not self._isCached():
+                    with self.lock:
+                        self._validate()
+            except Exception:
+                self.logger.log(lp.WARNING, traceback.format_exc())
+
+    ###########################################################################
+
+    def run(self, command, user=None, timeout=None, silent=True):
+        """
+        Run a command with sudo, without a prompt.
+
+        @param: command - argv list, or a string for the shell
+        @param: user - user to run as, root if None
+        @param: timeout - seconds before the command is stopped
+        @param: silent - False to log the command and its result
+
+        @returns: CommandResult
+        """
+        if self.password is None:
+            raise SudoSessionError("Not authenticated, see authenticate()")
+        if isinstance(command, basestring):
+            command = ["/bin/sh", "-c", command]
+        options = []
+        if user:
+            options = ["-u", str(user).strip()]
+
+        if self.cached:
+            result = self._sudo([self.sudo, "-n"] + options + ["--"] +
+                                command, timeout)
+            #####
+            # sudo exits 1 when it can't run the command, if it still has
+            # the credentials that came from the command itself
+            if result.ok or result.retcode != 1 or self._isCached():
+                return self._logged(result, silent)
+            #####
+            # The credentials were lost, to sudo -k or a timeout the
+            # refresh missed, authenticate again and retry once
+            self.logger.log(lp.INFO, "sudo credentials expired, " +
+                            "authenticating again")
+            with self.lock:
+                if not self._validate():
+                    return self._logged(result, silent)
+            if self.cached:
+                return self._logged(self._sudo([self.sudo, "-n"] + options +
+                                               ["--"] + command, timeout),
+                                    silent)
+        return self._logged(self._sudo([self.sudo, "-S", "-p", ""] + options +
+                                       ["--"] + command, timeout,
+                                       password=True), silent)
+
+    def _logged(self, result, silent):
+        if not silent:
+            self.logger.log(lp.DEBUG, "sudo command: " +
+                            preview(result.command))
+            self.logger.log(lp.DEBUG, "stdout: " + preview(result.stdout))
+            self.logger.log(lp.DEBUG, "stderr: " + preview(result.stderr))
+            self.logger.log(lp.DEBUG, "retcode: " + str(result.retcode))
+        return result
+
+    ###########################################################################
+
+    def close(self, invalidate=True):
+        """
+        Stop refreshing, forget the password, and with invalidate, have
+        sudo forget the cached credentials too.
+        """
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if invalidate and self.password is not None:
+            self._sudo([self.sudo, "-k"], 30)
+        self.password = None
+        self.cached = False
+
+    ###########################################################################
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -8,9 +8,11 @@ import os
 import re
 import pwd
 import sys
+import errno
+import threading
 import traceback
 from tempfile import mkdtemp
-from time import time
+from time import time, sleep
 
 #--- non-native python libraries in this source tree
 from lib.run_commands import RunWith
@@ -21,6 +23,118 @@ from lib.libHelperExceptions import SystemToolNotAvailable, UserMustBeRootError
 
 ###############################################################################
 
+class LazyTeardown(object):
+    """
+    Background worker that removes mount point directories after a lazy
+    (MNT_DETACH) unmount, so callers don't wait on it.
+
+    One daemon thread drains the queue of scheduled directories and exits
+    when there is nothing left to do.  join() lets callers that must confirm
+    completion wait for the work scheduled so far.
+    """
+    def __init__(self, retries=20, delay=0.05):
+        """
+        @param: retries - times to retry a directory that is still busy
+        @param: delay - initial delay between retries, doubled on each retry
+        """
+        self.retries = retries
+        self.delay = delay
+        self.pending = []
+        self.done = {}
+        self.cond = threading.Condition()
+        self.thread = None
+
+    ###########################################################################
+
+    def schedule(self, directory, logger=None):
+        """
+        Queue a mount point directory for removal.
+        """
+        with self.cond:
+            self.pending.append((directory, logger))
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run,
+                                               name="LazyTeardown")
+                self.thread.daemon = True
+                self.thread.start()
+
+    ###########################################################################
+
+    def _run(self):
+        """
+        Drain the pending queue.
+        """
+        while True:
+            with self.cond:
+                if not self.pending:
+                    self.thread = None
+                    self.cond.notify_all()
+                    return
+                directory, logger = self.pending[0]
+            removed = self._remove(directory, logger)
+            with self.cond:
+                self.pending.pop(0)
+                self.done[directory] = removed
+                self.cond.notify_all()
+
+    ###########################################################################
+
+    def _remove(self, directory, logger):
+        """
+        Remove an empty, no longer mounted, directory.  A detached mount can
+        take a moment to go away, so busy directories are retried with a
+        backoff.  Directories that aren't empty are left alone.
+        """
+        delay = self.delay
+        for _ in range(self.retries):
+            try:
+                if os.path.ismount(directory):
+                    raise OSError(errno.EBUSY, "still mounted")
+                os.rmdir(directory)
+            except OSError, err:
+                if err.errno == errno.ENOENT:
+                    return True
+                if err.errno != errno.EBUSY:
+                    if logger:
+                        logger.log(lp.WARNING, "Not removing mount point " +
+                                   str(directory) + ": " + str(err))
+                    return False
+                sleep(delay)
+                delay = delay * 2
+            else:
+                if logger:
+                    logger.log(lp.DEBUG, "Removed mount point: " +
+                               str(directory))
+                return True
+        return False
+
+    ###########################################################################
+
+    def join(self, timeout=None):
+        """
+        Wait for scheduled removals to finish.
+
+        @returns: True if nothing is left pending, False on timeout
+        """
+        if timeout is not None:
+            end_time = time() + timeout
+        with self.cond:
+            while self.pending:
+                if timeout is None:
+                    self.cond.wait()
+                else:
+                    remaining = end_time - time()
+                    if remaining <= 0:
+                        return False
+                    self.cond.wait(remaining)
+        return True
+
+#####
+# Shared by every ramdisk in the process, one thread at most.
+TEARDOWN = LazyTeardown()
+
+###############################################################################
+
 class RamDisk(RamDiskTemplate):
     """
     http://www.cyberciti.biz/tips/what-is-devshm-and-its-practical-usage.html
@@ -316,26 +430,67 @@ class RamDisk(RamDiskTemplate):
 
     ###########################################################################
 
-    def unmount(self) :
+    def resize(self, size):
+        """
+        Grow or shrink a mounted tmpfs in place, keeping its contents.
+
+        @param: size - new size in 1Mb chunks
+
+        @note: Runs the remount with a RunWith of its own, the watchdog
+               calls this from its thread while self.runWith may be busy.
+
+        @author: Roy Nielsen
+        """
+        success = False
+        if not self.fstype == "tmpfs":
+            raise BadRamdiskArguments("Can only use 'resize' with " + \
+                                      "tmpfs...")
+        command = [self.mountPath, "-o", "remount,size=" + str(size) + "m",
+                   self.mntPoint]
+        retval, reterr, retcode = RunWith(self.logger).run(command).getReturns()
+        if not reterr:
+            self.diskSize = size
+            success = True
+        return success
+
+    ###########################################################################
+
+    def unmount(self, lazy=False) :
         """
         Unmount the disk
 
+        @param: lazy - detach the filesystem right away (umount -l, or
+                       MNT_DETACH) even if files on it are still open, and
+                       remove the mount point directory in the background.
+                       Use waitForTeardown to confirm the removal.
+
         @author: Roy Nielsen
         """
         success = False
 
-        command = [self.umountPath, self.mntPoint]
+        self.stopWatchdog()
+        #####
+        # Mapped arena regions would keep the filesystem busy
+        if self.arena is not None:
+            self.arena.close()
+
+        if lazy:
+            command = [self.umountPath, "-l", self.mntPoint]
+        else:
+            command = [self.umountPath, self.mntPoint]
         self.runWith.setCommand(command)
         self.runWith.communicate()
         retval, reterr, retcode = self.runWith.getNlogReturns()
         if not reterr:
             success = True
+            if lazy:
+                TEARDOWN.schedule(self.mntPoint, self.logger)
 
         return success
 
     ###########################################################################
 
-    def umount(self):
+    def umount(self, lazy=False):
         """
         Unmount the disk
 
@@ -343,12 +498,12 @@ class RamDisk(RamDiskTemplate):
         """
         success = False
 
-        success = self.unmount()
+        success = self.unmount(lazy)
         return success
 
     ###########################################################################
 
-    def detach(self) :
+    def detach(self, lazy=False) :
         """
         Unmount the disk
 
@@ -356,12 +511,22 @@ class RamDisk(RamDiskTemplate):
         """
         success = False
 
-        success = self.umount()
+        success = self.umount(lazy)
 
         return success
 
     ###########################################################################
 
+    def waitForTeardown(self, timeout=None):
+        """
+        Wait for the background cleanup scheduled by a lazy unmount.
+
+        @returns: True if the cleanup finished, False on timeout
+        """
+        return waitForTeardown(timeout)
+
+    ###########################################################################
+
     def __isMemoryAvailable(self):
         """
         Check to make sure there is plenty of memory of the size passed in
@@ -389,21 +554,24 @@ class RamDisk(RamDiskTemplate):
 
 ###############################################################################
 
-def detach(mnt_point="", logger=False):
+def detach(mnt_point="", logger=False, lazy=False):
     """
     Mirror for the unmount function...
 
     @author: Roy Nielsen
     """
-    success = umount(mnt_point, logger)
+    success = umount(mnt_point, logger, lazy)
     return success
 
 ###############################################################################
 
-def umount(mnt_point="", logger=False):
+def umount(mnt_point="", logger=False, lazy=False):
     """
     Unmount the ramdisk
 
+    @param: lazy - detach right away even if the filesystem is busy, and
+                   remove the mount point directory in the background.
+
     @author: Roy Nielsen
     """
     success = False
@@ -427,19 +595,34 @@ def umount(mnt_point="", logger=False):
         #####
         # Run the umount command...
         runWith = RunWith(logger)
-        command = [umountPath, mnt_point]
+        if lazy:
+            command = [umountPath, "-l", mnt_point]
+        else:
+            command = [umountPath, mnt_point]
         runWith.setCommand(command)
         runWith.communicate()
         retval, reterr, retcode = runWith.getNlogReturns()
         if not reterr:
             success = True
+            if lazy:
+                TEARDOWN.schedule(mnt_point, logger)
 
     return success
 
-def unmount(mnt_point="", logger=False):
+def unmount(mnt_point="", logger=False, lazy=False):
     '''
     mirror functioin for umount
     '''
     success = False
-    success = umount(mnt_point, logger)
+    success = umount(mnt_point, logger, lazy)
     return success
+
+###############################################################################
+
+def waitForTeardown(timeout=None):
+    """
+    Wait for mount point removals scheduled by lazy unmounts.
+
+    @returns: True if they all finished, False on timeout
+    """
+    return TEARDOWN.join(timeout)
@@ -27,8 +27,9 @@ Maybe function, method  or other module
 #--- Native python libraries
 import os
 import re
+import time
 import shutil
-from subprocess import Popen, PIPE
+from uuid import uuid4
 
 #--- non-native python libraries in this source tree
 from commonRamdiskTemplate import RamDiskTemplate
@@ -40,6 +41,193 @@ from lib.libHelperExceptions import NotValidForThisOS
 
 ###############################################################################
 
+class RunWithExecutor(object):
+    """
+    Default executor for ramdisk commands, runs them with RunWith.
+
+    An executor only needs a run(cmd) method returning a
+    (stdout, stderr, returncode) tuple, so a stand-in that records calls,
+    or replays canned output, can be passed to the RamDisk or
+    MacRamdiskPlan instead.
+    """
+    def __init__(self, logger, runWith=None):
+        """
+        Initialization method
+        """
+        if runWith is None:
+            runWith = RunWith(logger)
+        self.runWith = runWith
+
+    def run(self, cmd):
+        """
+        Run a command, returning stdout, stderr and the return code.
+        """
+        self.runWith.setCommand(cmd)
+        self.runWith.communicate()
+        return self.runWith.getNlogReturns()
+
+###############################################################################
+
+class MacRamdiskPlan(object):
+    """
+    Declarative plan of the commands that create a Mac ramdisk.
+
+    The plan is a list of (name, command builder, output handler) steps,
+    run in order against an executor, with the time of each step recorded
+    in self.timings.  The steps are:
+
+    memory - top -l 1, check there is enough unused physical memory
+    attach - hdiutil attach -nomount ram://<blocks>, the device
+    format - newfs_hfs on the whole device.  newfs_hfs doesn't journal
+             unless asked to, so there is no separate disableJournal step,
+             and nothing gets auto-mounted, so there is no unmount step.
+    mount  - diskutil mount -mountPoint <mountpoint> <device>
+
+    Without a custom mount point, format and mount are merged into a single
+    "diskutil erasevolume HFS+", which formats without a journal and mounts
+    on /Volumes/<volume name>.
+
+    @param: size - size of the ramdisk in 1Mb chunks
+    @param: mountpoint - where to mount the ramdisk, empty for the default
+                         /Volumes location
+    @param: executor - object with a run(cmd) method, see RunWithExecutor
+    """
+    def __init__(self, size, mountpoint, logger, executor=None,
+                 hdiutil="/usr/bin/hdiutil", diskutil="/usr/sbin/diskutil",
+                 newfs="/sbin/newfs_hfs", top="/usr/bin/top",
+                 volumeName=None):
+        """
+        Initialization method
+        """
+        self.logger = logger
+        if executor is None:
+            executor = RunWithExecutor(logger)
+        self.executor = executor
+        self.hdiutil = hdiutil
+        self.diskutil = diskutil
+        self.newfs = newfs
+        self.top = top
+
+        self.sizeMb = int(size)
+        #####
+        # hdiutil wants the size in 512 byte blocks
+        self.blocks = str(self.sizeMb * 1024 * 1024 / 512)
+        self.mntPoint = mountpoint
+        if volumeName:
+            self.volumeName = volumeName
+        else:
+            self.volumeName = "ramdisk-" + uuid4().hex[:8]
+        self.device = ""
+        self.free = 0
+        self.timings = []
+
+    ###########################################################################
+
+    def steps(self):
+        """
+        The steps of this plan, as (name, command builder, output handler)
+        tuples.  Builders are called right before their step runs, so they
+        can use what earlier steps found.
+        """
+        steps = [("memory", lambda: [self.top, "-l", "1"],
+                  self._memoryAvailable),
+                 ("attach", lambda: [self.hdiutil, "attach", "-nomount",
+                                     "ram://" + self.blocks],
+                  self._attached)]
+        if self.mntPoint:
+            steps.append(("format", lambda: [self.newfs, "-v",
+                                             self.volumeName, self.device],
+                          self._noError))
+            steps.append(("mount", lambda: [self.diskutil, "mount",
+                                            "-mountPoint", self.mntPoint,
+                                            self.device],
+                          self._noError))
+        else:
+            steps.append(("format", lambda: [self.diskutil, "erasevolume",
+                                             "HFS+", self.volumeName,
+                                             self.device],
+                          self._erased))
+        return steps
+
+    ###########################################################################
+
+    def run(self):
+        """
+        Run the steps in order, stopping at the first one that fails.
+
+        @returns: True if every step succeeded
+        """
+        self.timings = []
+        for name, builder, handler in self.steps():
+            cmd = builder()
+            start = time.time()
+            retval, reterr, retcode = self.executor.run(cmd)
+            self.timings.append((name, time.time() - start))
+            if not handler(retval, reterr, retcode):
+                self.logger.log(lp.WARNING, "Ramdisk step '" + name +
+                                "' failed: " + str(reterr).strip())
+                return False
+            self.logger.log(lp.DEBUG, "Ramdisk step '" + name + "' done")
+        return True
+
+    ###########################################################################
+
+    def _noError(self, retval, reterr, retcode):
+        """
+        Generic handler, the step worked if nothing came out on stderr.
+        """
+        return not reterr
+
+    ###########################################################################
+
+    def _memoryAvailable(self, retval, reterr, retcode):
+        """
+        Find the unused physical memory in the output of "top -l 1", ie:
+
+        PhysMem: 15G used (2370M wired), 420M unused.
+        """
+        self.free = 0
+        for line in str(retval).split("\n"):
+            match = re.search(r"(\d+)([KMG])\s+(unused|free)", line)
+            if match:
+                number = int(match.group(1))
+                magnitude = match.group(2)
+                if magnitude == "G":
+                    self.free = number * 1024
+                elif magnitude == "M":
+                    self.free = number
+                else:
+                    self.free = number / 1024
+                break
+        self.logger.log(lp.DEBUG, "free: " + str(self.free))
+        self.logger.log(lp.DEBUG, "Size requested: " + str(self.sizeMb))
+        return self.free > self.sizeMb
+
+    ###########################################################################
+
+    def _attached(self, retval, reterr, retcode):
+        """
+        Keep the /dev/disk<#> device hdiutil attached the ramdisk to.
+        """
+        if reterr or not str(retval).strip():
+            return False
+        self.device = str(retval).split()[0].strip()
+        self.logger.log(lp.DEBUG, "Device: \"" + str(self.device) + "\"")
+        return True
+
+    ###########################################################################
+
+    def _erased(self, retval, reterr, retcode):
+        """
+        erasevolume mounts the new volume under /Volumes.
+        """
+        if reterr:
+            return False
+        self.mntPoint = os.path.join("/Volumes", self.volumeName)
+        return True
+
+###############################################################################
+
 class RamDisk(RamDiskTemplate) :
     """
     Class to manage a ramdisk
@@ -51,12 +239,13 @@ class RamDisk(RamDiskTemplate) :
     @param: size - size of the ramdisk to create - must have a value on the Mac
                    or the creation will fail.
     @param: mountpoint - where to mount the disk, if left empty, will mount
-                         on locaiton created by tempfile.mkdtemp.
+                         on /Volumes/<volume name>.
     @param: message_level - level at which to log.
+    @param: executor - runs the commands, see RunWithExecutor
 
     @author: Roy Nielsen
     """
-    def __init__(self, size=0, mountpoint="", logger=False) :
+    def __init__(self, size=0, mountpoint="", logger=False, executor=None) :
         """
         Constructor
         """
@@ -72,6 +261,9 @@ class RamDisk(RamDiskTemplate) :
         #####
         # Initialize the RunWith helper for executing shelled out commands.
         self.runWith = RunWith(self.logger)
+        if executor is None:
+            executor = RunWithExecutor(self.logger, self.runWith)
+        self.executor = executor
 
         #####
         # Calculating the size of ramdisk in 1Mb chunks
@@ -85,10 +277,8 @@ class RamDisk(RamDiskTemplate) :
         self.myRamdiskDev = ""
 
         #####
-        # should take the form of /dev/disk2s1, where disk 2 is the assigned
-        # disk and s1 is the slice, or partition number.  While just /dev/disk2
-        # is good for some things, others will need the full path to the
-        # device, such as formatting the disk.
+        # The device to format and mount.  The ramdisk is formatted without
+        # a partition map, so this is the same as myRamdiskDev.
         self.devPartition = ""
 
         #####
@@ -96,100 +286,47 @@ class RamDisk(RamDiskTemplate) :
         # but not mounted.
         self.mounted = False
 
+        self.plan = None
+        self.volumeName = "ramdisk"
+
         success = False
 
+        if mountpoint:
+            self.logger.log(lp.INFO, "\n\n\n\tMOUNTPOINT: " + str(mountpoint) + "\n\n\n")
+        elif self.mntPoint:
+            #####
+            # Without a custom mountpoint the volume is mounted where
+            # erasevolume puts it, drop the directory the template made.
+            try:
+                os.rmdir(self.mntPoint)
+            except OSError:
+                pass
+            self.mntPoint = ""
+
         #####
         # Passed in disk size must have a non-default value
-        if not self.diskSize == 0 :
-            success  = True
-        #####
-        # Checking to see if memory is availalbe...
-        if not self.__isMemoryAvailable() :
-            self.logger.log(lp.DEBUG, "Physical memory not available to create ramdisk.")
-            success = False
+        if int(size) > 0:
+            self.plan = MacRamdiskPlan(size, self.mntPoint, self.logger,
+                                       self.executor, hdiutil=self.hdiutil,
+                                       diskutil=self.diskutil)
+            self.volumeName = self.plan.volumeName
+            success = self.plan.run()
+            self.free = self.plan.free
+            self.myRamdiskDev = self.plan.device
+            self.devPartition = self.plan.device
+            self.mntPoint = self.plan.mntPoint
+            self.mounted = success
+            self.logger.log(lp.DEBUG, "Step timings: " +
+                            str(self.plan.timings))
         else:
-            success = True
-
-        if success :
-
-            #####
-            # If a mountpoint is passed in, use that, otherwise, set up for a
-            # random mountpoint.
-            if mountpoint:
-                self.logger.log(lp.INFO, "\n\n\n\tMOUNTPOINT: " + str(mountpoint) + "\n\n\n")
-                self.mntPoint = mountpoint
-                #####
-                # eventually have checking to make sure that directory
-                # doesn't already exist, and have data in it.
-            else :
-                #####
-                # If a mountpoint is not passed in, create a randomized
-                # mount point.
-                self.logger.log(lp.DEBUG, "Attempting to acquire a radomized mount " + \
-                           "point. . .")
-                if not self.getRandomizedMountpoint() :
-                    success = False
-
-            #####
-            # The Mac has a more complicated method of managing ramdisks...
-            if success:
-                #####
-                # Attempt to create the ramdisk
-                if not self.__create():
-                    success = False
-                    self.logger.log(lp.WARNING, "Create appears to have failed..")
-                else:
-                    #####
-                    # Ramdisk created, try mounting it.
-                    if not self.__mount():
-                        success = False
-                        self.logger.log(lp.WARNING, "Mount appears to have failed..")
-                    else:
-                        #####
-                        # Filessystem journal will only slow the ramdisk down...
-                        # No need to keep it as when the journal is unmounted
-                        # all memory is de-allocated making it impossible to do
-                        # forensics on the volume.
-                        if not self.__remove_journal():
-                            success = False
-                            self.logger.log(lp.WARNING, "Remove journal " + \
-                                            "appears to have failed..")
+            self.logger.log(lp.WARNING, "Cannot create a ramdisk of size: " +
+                            str(size))
 
         self.success = success
         if success:
             self.logger.log(lp.INFO, "Mount point: " + str(self.mntPoint))
             self.logger.log(lp.INFO, "Device: " + str(self.myRamdiskDev))
         self.logger.log(lp.INFO, "Success: " + str(self.success))
-            
-
-    ###########################################################################
-
-    def __create(self) :
-        """
-        Create a ramdisk device
-
-        @author: Roy Nielsen
-        """
-        retval = None
-        reterr = None
-        success = False
-        #####
-        # Create the ramdisk and attach it to a device.
-        cmd = [self.hdiutil, "attach", "-nomount", "ram://" + self.diskSize]
-        self.runWith.setCommand(cmd)
-        self.runWith.communicate()
-        retval, reterr, retcode = self.runWith.getNlogReturns()
-
-        if reterr:
-            success = False
-            raise Exception("Error trying to create ramdisk(" + \
-                            str(reterr).strip() + ")")
-        else:
-            self.myRamdiskDev = retval.strip()
-            self.logger.log(lp.DEBUG, "Device: \"" + str(self.myRamdiskDev) + "\"")
-            success = True
-        self.logger.log(lp.DEBUG, "Success: " + str(success) + " in __create")
-        return success
 
     ###########################################################################
 
@@ -231,86 +368,6 @@ class RamDisk(RamDiskTemplate) :
 
     ###########################################################################
 
-    def __mount(self) :
-        """
-        Mount the disk - for the Mac, just run self.__attach
-
-        @author: Roy Nielsen
-        """
-        success = False
-        success = self.__attach()
-        if success:
-            self.mounted = True
-        return success
-
-    ###########################################################################
-
-    def __attach(self):
-        """
-        Attach the device so it can be formatted
-
-        @author: Roy Nielsen
-        """
-        success = False
-        #####
-        # Attempt to partition the disk.
-        if self.__partition():
-            success = True
-            #####
-            # eraseVolume format name device
-            if self.mntPoint:
-                #####
-                # "Mac" unmount (not eject)
-                cmd = [self.diskutil, "unmount", self.myRamdiskDev + "s1"]
-                self.runWith.setCommand(cmd)
-                self.runWith.communicate()
-                retval, reterr, retcode = self.runWith.getNlogReturns()
-
-                if not reterr:
-                    success = True
-
-                if success:
-                    #####
-                    # remount to self.mntPoint
-                    cmd = [self.diskutil, "mount", "-mountPoint",
-                           self.mntPoint, self.devPartition]
-                    self.runWith.setCommand(cmd)
-                    self.runWith.communicate()
-                    retval, reterr, retcode = self.runWith.getNlogReturns()
-
-                    if not reterr:
-                        success = True
-            self.runWith.getNlogReturns()
-            self.getData()
-            self.logger.log(lp.DEBUG, "Success: " + str(success) + " in __mount")
-        return success
-
-    ###########################################################################
-
-    def __remove_journal(self) :
-        """
-        Having a journal in ramdisk makes very little sense.  Remove the journal
-        after creating the ramdisk device
-
-        cmd = ["/usr/sbin/diskutil", "disableJournal", "force", myRamdiskDev]
-
-        using "force" doesn't work on a mounted filesystem, without it, the
-        command will work on a mounted file system
-
-        @author: Roy Nielsen
-        """
-        success = False
-        cmd = [self.diskutil, "disableJournal", self.myRamdiskDev + "s1"]
-        self.runWith.setCommand(cmd)
-        self.runWith.communicate()
-        retval, reterr, retcode = self.runWith.getNlogReturns()
-        if not reterr:
-            success = True
-        self.logger.log(lp.DEBUG, "Success: " + str(success) + " in __remove_journal")
-        return success
-
-    ###########################################################################
-
     def unionOver(self, target="", fstype="hfs", nosuid=None, noowners=True,
                         noatime=None, nobrowse=None):
         """
@@ -381,9 +438,7 @@ class RamDisk(RamDiskTemplate) :
 
             #####
             # Run the command
-            self.runWith.setCommand(cmd)
-            self.runWith.communicate()
-            retval, reterr, retcode = self.runWith.getNlogReturns()
+            retval, reterr, retcode = self.executor.run(cmd)
             if not reterr:
                 success = True
 
@@ -427,9 +482,7 @@ class RamDisk(RamDiskTemplate) :
         """
         success = False
         cmd = [self.diskutil, "unmount", self.devPartition]
-        self.runWith.setCommand(cmd)
-        self.runWith.communicate()
-        retval, reterr, retcode = self.runWith.getNlogReturns()
+        retval, reterr, retcode = self.executor.run(cmd)
         if not reterr:
             success = True
         return success
@@ -445,9 +498,7 @@ class RamDisk(RamDiskTemplate) :
         """
         success = False
         cmd = [self.diskutil, "mount", "-mountPoint", self.mntPoint, self.devPartition]
-        self.runWith.setCommand(cmd)
-        self.runWith.communicate()
-        retval, reterr, retcode = self.runWith.getNlogReturns()
+        retval, reterr, retcode = self.executor.run(cmd)
         if not reterr:
             success = True
         return success
@@ -465,13 +516,15 @@ class RamDisk(RamDiskTemplate) :
         @author: Roy Nielsen
         """
         success = False
+        self.stopWatchdog()
+        #####
+        # Mapped arena regions would keep the volume busy
+        if self.arena is not None:
+            self.arena.close()
         cmd = [self.hdiutil, "detach", self.myRamdiskDev]
-        self.runWith.setCommand(cmd)
-        self.runWith.communicate()
-        retval, reterr, retcode = self.runWith.getNlogReturns()
+        retval, reterr, retcode = self.executor.run(cmd)
         if not reterr:
             success = True
-        self.runWith.getNlogReturns()
 
         return success
 
@@ -489,11 +542,9 @@ class RamDisk(RamDiskTemplate) :
         # Cannot format the drive unless only the device is accessible.
         success = self._unmount()
         #####
-        # Format the disk (partition)
-        cmd = ["/sbin/newfs_hfs", "-v", "ramdisk", self.devPartition]
-        self.runWith.setCommand(cmd)
-        self.runWith.communicate()
-        retval, reterr, retcode = self.runWith.getNlogReturns()
+        # Format the disk
+        cmd = ["/sbin/newfs_hfs", "-v", self.volumeName, self.devPartition]
+        retval, reterr, retcode = self.executor.run(cmd)
         if not reterr:
             success = True
         #####
@@ -503,118 +554,6 @@ class RamDisk(RamDiskTemplate) :
 
     ###########################################################################
 
-    def __partition(self) :
-        """
-        Partition the ramdisk (mac specific)
-
-        @author: Roy Nielsen
-        """
-        success=False
-        size = str(int(self.diskSize)/(2*1024))
-        cmd = [self.diskutil, "partitionDisk", self.myRamdiskDev, str(1),
-               "MBR", "HFS+", "ramdisk", str(size) + "M"]
-        self.runWith.setCommand(cmd)
-        self.runWith.communicate()
-        retval, reterr, retcode = self.runWith.getNlogReturns()
-        if not reterr:
-            success = True
-        if success:
-            #####
-            # Need to get the partition device out of the output to assign to
-            # self.devPartition
-            for line in retval.split("\n"):
-                if re.match("^Initialized (\S+)\s+", line):
-                    linematch = re.match("Initialized\s+(\S+)", line)
-                    rdevPartition = linematch.group(1)
-                    self.devPartition = re.sub("rdisk", "disk", rdevPartition)
-                    break
-
-        self.runWith.getNlogReturns()
-
-        return success
-
-    ###########################################################################
-
-    def __isMemoryAvailable(self) :
-        """
-        Check to make sure there is plenty of memory of the size passed in
-        before creating the ramdisk
-
-        Best method to do this on the Mac is to get the output of "top -l 1"
-        and re.search("unused\.$", line)
-
-        @author: Roy Nielsen
-        """
-        #mem_free = psutil.phymem_usage()[2]
-
-        #print "Memory free = " + str(mem_free)
-        success = False
-        found = False
-        almost_size = 0
-        size = 0
-        self.free = 0
-        line = ""
-        freeMagnitude = None
-
-        #####
-        # Set up and run the command
-        cmd = ["/usr/bin/top", "-l", "1"]
-
-        proc = Popen(cmd, stdout=PIPE, stderr=PIPE)
-
-        while True:
-            line = proc.stdout.readline().strip()
-            #####
-            # Split on spaces
-            line = line.split()
-            #####
-            # Get the last item in the list
-            found = line[-1]
-            almost_size = line[:-1]
-            size = almost_size[-1]
-
-            found = found.strip()
-            #almost_size = almost_size.strip()
-            size = size.strip()
-
-            self.logger.log(lp.INFO, "size: " + str(size))
-            self.logger.log(lp.INFO, "found: " + str(found))
-
-            if re.search("unused", found) or re.search("free", found):
-                #####
-                # Found the data we wanted, stop the search.
-                break
-        proc.kill()
-
-        #####
-        # Find the numerical value and magnitute of the ramdisk
-        if size:
-            sizeCompile = re.compile("(\d+)(\w+)")
-
-            split_size = sizeCompile.search(size)
-            freeNumber = split_size.group(1)
-            freeMagnitude = split_size.group(2)
-
-            if re.match("^\d+$", freeNumber.strip()):
-                if re.match("^\w$", freeMagnitude.strip()):
-                    if freeMagnitude:
-                        #####
-                        # Calculate the size of the free memory in Megabytes
-                        if re.search("G", freeMagnitude.strip()):
-                            self.free = 1024 * int(freeNumber)
-                            self.free = str(self.free)
-                        elif re.search("M", freeMagnitude.strip()):
-                            self.free = freeNumber
-        self.logger.log(lp.DEBUG, "free: " + str(self.free))
-        self.logger.log(lp.DEBUG, "Size requested: " + str(self.diskSize))
-        if int(self.free) > int(self.diskSize)/(2*1024):
-            success = True
-        print str(self.free)
-        print str(success)
-        return success
-
-    ###########################################################################
-
     def getDevice(self):
         """
         Getter for the device name the ramdisk is using
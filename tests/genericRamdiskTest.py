@@ -227,7 +227,13 @@ class GenericRamdiskTest(unittest.TestCase, GenericTestUtilities):
         """
         self.tearDownInstanceSpecifics()
         try:
-            umount(self.mount)
+            if sys.platform.startswith("linux"):
+                #####
+                # Detach lazily so stray open handles don't stall shutdown,
+                # the mount point is cleaned up in the background.
+                umount(self.mount, self.logger, lazy=True)
+            else:
+                umount(self.mount, self.logger)
             self.logger.log(lp.INFO, r"Successfully detached disk: " + \
                        str(self.my_ramdisk.mntPoint).strip())
         except Exception:
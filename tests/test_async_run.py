@@ -0,0 +1,132 @@
+#!/usr/bin/python -u
+"""
+Test of running many commands at once from one reactor thread.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import sys
+import time
+import unittest
+import threading
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib import async_run
+from lib.async_run import AsyncRunWith, AsyncRunError
+
+
+class test_async_run(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def setUp(self):
+        """
+        """
+        self.arw = AsyncRunWith(self.logger)
+
+    def tearDown(self):
+        """
+        """
+        self.arw.close()
+
+    def test_manyInFlight(self):
+        """
+        """
+        threads = threading.active_count()
+        start = time.time()
+        futures = [self.arw.run(["/bin/sh", "-c",
+                                 "sleep 0.5; echo %d; exit %d" % (i, i % 2)])
+                   for i in range(200)]
+        self.assertTrue(self.arw.inFlight() > 0)
+        #####
+        # Just the one reactor thread, however many commands
+        self.assertEquals(threading.active_count(), threads + 1)
+        results = self.arw.gather(futures, timeout=30)
+        self.assertTrue(time.time() - start < 20)
+        for i, result in enumerate(results):
+            self.assertEquals(result.getReturns(), (str(i) + "\n", "", i % 2))
+        self.assertEquals(self.arw.inFlight(), 0)
+
+        future = self.arw.run(["/nonexistent/command"])
+        self.assertTrue(isinstance(future.exception(), OSError))
+        self.assertRaises(OSError, future.result)
+
+    def test_timeoutAndStream(self):
+        """
+        """
+        slow = self.arw.run(["/bin/sh", "-c",
+                             "sleep 30 & echo started; sleep 30"],
+                            timeout=0.3)
+        self.assertRaises(AsyncRunError, slow.result, 0)
+        lines = []
+        done = []
+        streamed = self.arw.stream(["/bin/sh", "-c",
+                                    "echo one; echo two >&2; printf three"],
+                                   lambda name, line: lines.append((name,
+                                                                    line)))
+        streamed.addDoneCallback(done.append)
+        self.assertEquals(streamed.result(10).getReturns(), ("", "", 0))
+        self.assertEquals(sorted(lines), [("stderr", "two"),
+                                          ("stdout", "one"),
+                                          ("stdout", "three")])
+        self.assertEquals(done, [streamed])
+
+        result = slow.result(10)
+        self.assertTrue(result.timedOut)
+        self.assertEquals(result.stdout, "started\n")
+
+    def test_oneBadJob(self):
+        """
+        """
+        usageOf = async_run.usageOf
+
+        def oddUsage(proc):
+            if getattr(proc, "oddChild", False):
+                raise ValueError("odd child")
+            return usageOf(proc)
+
+        def marked(future, bad):
+            with self.arw.lock:
+                for job in list(self.arw.incoming) + list(self.arw.jobs):
+                    if job.future is future:
+                        job.proc.oddChild = bad
+            return future
+
+        async_run.usageOf = oddUsage
+        try:
+            bad = marked(self.arw.run(["/bin/sh", "-c", "sleep 0.3"]), True)
+            good = marked(self.arw.run(["/bin/sh", "-c",
+                                        "sleep 0.3; echo ok"]), False)
+            self.assertTrue(isinstance(bad.exception(10), ValueError))
+            self.assertEquals(good.result(10).getReturns(), ("ok\n", "", 0))
+            #####
+            # The reactor outlives the odd child and keeps taking commands
+            later = self.arw.run(["/bin/echo", "later"])
+            self.assertEquals(later.result(10).stdout, "later\n")
+            self.assertEquals(self.arw.inFlight(), 0)
+        finally:
+            async_run.usageOf = usageOf
+
+    def test_runPty(self):
+        """
+        """
+        future = self.arw.runPty(["/bin/sh", "-c",
+                                  "printf 'Password: '; read pw; " +
+                                  "echo got $pw"],
+                                 [("[Pp]assword.*:", "secret")], timeout=10)
+        result = future.result(15)
+        self.assertFalse(result.timedOut)
+        self.assertEquals(result.retcode, 0)
+        self.assertTrue("got secret" in result.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
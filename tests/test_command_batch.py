@@ -0,0 +1,108 @@
+#!/usr/bin/python -u
+"""
+Test of running a batch of commands in parallel.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import time
+import shutil
+import unittest
+import tempfile
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.command_batch import CommandBatch
+
+
+class test_command_batch(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def test_resultsInOrder(self):
+        """
+        """
+        commands = [["/bin/echo", str(i)] for i in range(20)]
+        results = CommandBatch(self.logger, workers=4).run(commands)
+        self.assertEquals([result.stdout.strip() for result in results],
+                          [str(i) for i in range(20)])
+        self.assertTrue(all([result.ok for result in results]))
+        self.assertRaises(AttributeError, setattr, results[0], "retcode", 1)
+
+    def test_fanOutTakesSlowestCommand(self):
+        """
+        """
+        commands = [["/bin/sleep", "0.5"]] * 6
+        start = time.time()
+        results = CommandBatch(self.logger, workers=6).run(commands)
+        self.assertTrue(time.time() - start < 2.0)
+        self.assertEquals([result.retcode for result in results], [0] * 6)
+
+    def test_timeoutsAndErrors(self):
+        """
+        """
+        commands = [(["/bin/sleep", "10"], 0.2),
+                    ["/nonexistent/command"],
+                    ["/bin/sh", "-c", "echo out; echo err >&2; exit 3"]]
+        start = time.time()
+        results = CommandBatch(self.logger).run(commands)
+        self.assertTrue(time.time() - start < 5.0)
+        self.assertTrue(results[0].timedOut)
+        self.assertFalse(results[0].ok)
+        self.assertTrue(results[1].error is not None)
+        self.assertEquals(results[1].retcode, None)
+        self.assertEquals(results[2].getReturns(), ("out\n", "err\n", 3))
+
+        #####
+        # A child holding the pipes open is stopped with the command
+        tmpdir = tempfile.mkdtemp()
+        try:
+            pidfile = os.path.join(tmpdir, "child")
+            command = ["/bin/sh", "-c", "sleep 30 & echo $! > " + pidfile +
+                       "; echo started; wait"]
+            start = time.time()
+            result = CommandBatch(self.logger).run([(command, 0.3)])[0]
+            self.assertTrue(time.time() - start < 5.0)
+            self.assertTrue(result.timedOut)
+            self.assertEquals(result.stdout, "started\n")
+            with open(pidfile) as pid:
+                child = int(pid.read())
+            time.sleep(0.1)
+            self.assertFalse(self.isRunning(child))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def isRunning(self, pid):
+        """
+        True if pid is a live process, not a zombie waiting to be reaped.
+        """
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        try:
+            with open("/proc/" + str(pid) + "/stat") as stat:
+                return stat.read().rsplit(")", 1)[1].split()[0] != "Z"
+        except IOError:
+            return True
+
+    def test_iterateAsCompleted(self):
+        """
+        """
+        commands = [["/bin/sleep", "0.6"], ["/bin/echo", "fast"]]
+        order = [result.index for result in
+                 CommandBatch(self.logger).iterate(commands)]
+        self.assertEquals(order, [1, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/python -u
+"""
+Test of the command result cache, on its own and through RunWith.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import shutil
+import unittest
+import tempfile
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.command_cache import CommandCache
+from lib.run_commands import RunWith
+
+
+class FakeClock(object):
+    """
+    Clock the test moves by hand.
+    """
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class test_command_cache(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def setUp(self):
+        """
+        """
+        self.clock = FakeClock()
+        self.cache = CommandCache(maxEntries=3, ttl=10, clock=self.clock)
+
+    def test_ttlAndLru(self):
+        """
+        """
+        keys = [self.cache.key(["/bin/echo", str(i)]) for i in range(4)]
+        self.cache.put(keys[0], "zero")
+        self.cache.put(keys[1], "one", ttl=1)
+        self.cache.put(keys[2], "two", ttl=-1)
+        self.assertEquals(self.cache.get(keys[0]), "zero")
+
+        #####
+        # keys[0] was just used, so keys[1] is the one evicted
+        self.cache.put(keys[3], "three")
+        self.assertEquals(self.cache.get(keys[1]), None)
+        self.assertEquals(self.cache.getStats()["evictions"], 1)
+
+        self.clock.now += 20
+        self.assertEquals(self.cache.get(keys[0]), None)
+        self.assertEquals(self.cache.get(keys[2]), "two")
+        stats = self.cache.getStats()
+        self.assertEquals((stats["hits"], stats["misses"],
+                           stats["expirations"]), (2, 2, 1))
+
+    def test_keyAndInvalidate(self):
+        """
+        """
+        self.assertNotEquals(self.cache.key(["/usr/bin/groups"], {"A": "1"}),
+                             self.cache.key(["/usr/bin/groups"], {"A": "2"}))
+        self.assertNotEquals(self.cache.key(["/usr/bin/groups"], cwd="/"),
+                             self.cache.key(["/usr/bin/groups"], cwd="/tmp"))
+        self.cache.put(self.cache.key(["/usr/bin/groups", "a"]), "a")
+        self.cache.put(self.cache.key("/usr/bin/groups b"), "b")
+        self.cache.put(self.cache.key(["/bin/hostname"]), "host")
+        self.assertEquals(self.cache.invalidate("groups"), 2)
+        self.assertEquals(self.cache.invalidate(lambda key: True), 1)
+        self.assertEquals(self.cache.getStats()["entries"], 0)
+
+    def test_runWithCache(self):
+        """
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            counter = os.path.join(tmpdir, "runs")
+            rw = RunWith(self.logger, cache=self.cache)
+            command = ["/bin/sh", "-c", "echo x >> " + counter + "; echo hi"]
+            for _ in range(5):
+                rw.setCommand(command)
+                self.assertEquals(rw.communicate(cache=True),
+                                  ("hi\n", "", 0))
+            with open(counter) as runs:
+                self.assertEquals(len(runs.readlines()), 1)
+
+            #####
+            # Not asked for, not cached.  Failures are never cached.
+            rw.setCommand(command)
+            rw.communicate()
+            for _ in range(2):
+                rw.setCommand(["/bin/sh", "-c", "echo y >> " + counter +
+                               "; exit 1"])
+                rw.communicate(cache=True)
+            with open(counter) as runs:
+                self.assertEquals(len(runs.readlines()), 4)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
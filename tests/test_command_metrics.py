@@ -0,0 +1,98 @@
+#!/usr/bin/python -u
+"""
+Test of the command metrics collector, on its own and through RunWith.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import json
+import time
+import shutil
+import unittest
+import tempfile
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.command_metrics import CommandMetrics
+from lib.run_commands import RunWith, SyncPolicy
+
+
+class test_command_metrics(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def test_collector(self):
+        """
+        """
+        metrics = CommandMetrics(maxSamples=100)
+        for i in range(200):
+            metrics.record(["/bin/ls", "-l"], total=i / 1000.0, wait=0.001,
+                           outputBytes=10, failed=(i % 50 == 0))
+        metrics.record("/bin/date +%s", total=0.5)
+        stats = metrics.getStats("/bin/ls")
+        self.assertEquals(stats["calls"], 200)
+        self.assertEquals(stats["failures"], 4)
+        self.assertEquals(stats["outputBytes"], 2000)
+        #####
+        # Percentiles cover the latest 100 calls, 0.100s to 0.199s
+        self.assertEquals(stats["p50"], 0.15)
+        self.assertEquals(stats["p99"], 0.199)
+        self.assertEquals(sorted(metrics.getStats()),
+                          ["/bin/date", "/bin/ls"])
+        self.assertEquals(metrics.getStats("/bin/nope"), None)
+
+    def test_runWithRecords(self):
+        """
+        """
+        metrics = CommandMetrics()
+        rw = RunWith(self.logger, metrics=metrics,
+                     syncPolicy=SyncPolicy.GLOBAL)
+        for _ in range(3):
+            rw.setCommand(["/bin/echo", "hello"])
+            rw.communicate()
+        rw.setCommand(["/bin/sh", "-c", "echo out; echo err >&2; exit 2"])
+        list(rw.stream())
+        rw.setCommand(["/bin/sh", "-c", "exit 1"])
+        rw.wait()
+
+        echo = metrics.getStats("/bin/echo")
+        self.assertEquals((echo["calls"], echo["failures"],
+                           echo["outputBytes"]), (3, 0, 18))
+        self.assertTrue(echo["total"] >= echo["wait"] + echo["spawn"])
+        self.assertTrue(echo["sync"] > 0)
+        shell = metrics.getStats("/bin/sh")
+        self.assertEquals((shell["calls"], shell["failures"],
+                           shell["outputBytes"]), (2, 2, 8))
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "metrics.json")
+            metrics.dumpJson(path)
+            with open(path) as dump:
+                self.assertEquals(json.load(dump)["/bin/echo"]["calls"], 3)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_disabledOverhead(self):
+        """
+        """
+        rw = RunWith(self.logger)
+        count = 100000
+        start = time.time()
+        for _ in xrange(count):
+            rw._recordMetrics(rw._startMetrics())
+        perCall = (time.time() - start) / count
+        self.assertTrue(perCall < 1e-6, "%.3fus per call" % (perCall * 1e6))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/python -u
+"""
+Test of the bounded pool of workers running commands in the background.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import sys
+import time
+import unittest
+import threading
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.command_pool import CommandPool
+from lib.async_run import CommandCancelledError
+
+
+class test_command_pool(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def test_boundedAndConcurrent(self):
+        """
+        """
+        threads = threading.active_count()
+        pool = CommandPool(self.logger, workers=4, maxProcesses=2)
+        try:
+            start = time.time()
+            futures = [pool.run(["/bin/sh", "-c", "sleep 0.3; echo %d" % i])
+                       for i in range(6)]
+            self.assertTrue(threading.active_count() <= threads + 4)
+            for i, future in enumerate(futures):
+                self.assertEquals(future.result(10).stdout, str(i) + "\n")
+            #####
+            # Two at a time, three rounds of 0.3s
+            elapsed = time.time() - start
+            self.assertTrue(0.85 < elapsed < 5, elapsed)
+
+            failed = pool.submit(int, ("not a number",))
+            self.assertTrue(isinstance(failed.exception(10), ValueError))
+        finally:
+            pool.shutdown()
+
+    def test_priorityAndCancel(self):
+        """
+        """
+        pool = CommandPool(self.logger, workers=1)
+        order = []
+        gate = threading.Event()
+        started = threading.Event()
+        try:
+            blocker = pool.submit(lambda: started.set() or gate.wait(10))
+            started.wait(10)
+            low = pool.submit(order.append, ("low",), priority=5)
+            high = pool.submit(order.append, ("high",), priority=-5)
+            cancelled = pool.submit(order.append, ("cancelled",))
+            self.assertEquals(pool.pending(), 3)
+            self.assertTrue(cancelled.cancel())
+            self.assertTrue(cancelled.cancelled())
+            self.assertRaises(CommandCancelledError, cancelled.result)
+            self.assertEquals(pool.pending(), 2)
+            gate.set()
+            blocker.result(10)
+            low.result(10)
+            high.result(10)
+            self.assertEquals(order, ["high", "low"])
+            self.assertFalse(low.cancel())
+        finally:
+            pool.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
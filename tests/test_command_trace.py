@@ -0,0 +1,117 @@
+#!/usr/bin/python -u
+"""
+Test of recording RunWith's commands to a trace, and replaying them.  The
+Mac ramdisk plan is recorded against stand-in tools, then replayed with the
+tools gone.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import shutil
+import unittest
+import tempfile
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.run_commands import RunWith
+from lib.command_trace import TraceRecorder, TraceReplayer
+from lib.command_trace import CommandNotInTraceError
+from macRamdisk import MacRamdiskPlan, RunWithExecutor
+
+STANDINS = {"hdiutil": 'echo "/dev/disk9          "',
+            "diskutil": 'echo "Finished"',
+            "newfs_hfs": 'echo "Initialized /dev/rdisk9"',
+            "top": 'echo "PhysMem: 15G used (2370M wired), 4096M unused."'}
+
+
+class test_command_trace(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def setUp(self):
+        """
+        """
+        self.tmpdir = tempfile.mkdtemp()
+        self.tools = os.path.join(self.tmpdir, "tools")
+        os.mkdir(self.tools)
+        for name, body in STANDINS.items():
+            path = os.path.join(self.tools, name)
+            with open(path, "w") as script:
+                script.write("#!/bin/sh\n" + body + "\n")
+            os.chmod(path, 0o755)
+
+    def tearDown(self):
+        """
+        """
+        shutil.rmtree(self.tmpdir)
+
+    def runPlan(self, trace):
+        """
+        """
+        rw = RunWith(self.logger)
+        rw.setTrace(trace)
+        tool = lambda name: os.path.join(self.tools, name)
+        plan = MacRamdiskPlan(64, "/tmp/ramdisk_mnt", self.logger,
+                              RunWithExecutor(self.logger, rw),
+                              hdiutil=tool("hdiutil"),
+                              diskutil=tool("diskutil"),
+                              newfs=tool("newfs_hfs"), top=tool("top"),
+                              volumeName="ramdisk")
+        return plan.run(), plan
+
+    def test_recordAndReplay(self):
+        """
+        """
+        path = os.path.join(self.tmpdir, "plan.trace.gz")
+        with TraceRecorder(path) as recorder:
+            success, plan = self.runPlan(recorder)
+        self.assertTrue(success)
+        self.assertEquals(recorder.count, 4)
+
+        shutil.rmtree(self.tools)
+        replayer = TraceReplayer(path)
+        success, replayed = self.runPlan(replayer)
+        self.assertTrue(success)
+        self.assertEquals((replayed.device, replayed.free),
+                          (plan.device, plan.free))
+        self.assertEquals(replayer.unused(), [])
+
+    def test_lookups(self):
+        """
+        """
+        path = os.path.join(self.tmpdir, "calls.trace")
+        rw = RunWith(self.logger)
+        with TraceRecorder(path) as recorder:
+            rw.setTrace(recorder)
+            for i in range(2):
+                rw.run("echo %d >> count; cat count; printf '\\377'" % i,
+                       cwd=self.tmpdir)
+            rw.run(["/bin/sh", "-c", "echo $X; exit 2"], env={"X": "y"})
+
+        rw.setTrace(TraceReplayer(path))
+        command = "echo 0 >> count; cat count; printf '\\377'"
+        self.assertEquals(rw.run(command, cwd=self.tmpdir).stdout,
+                          "0\n\xff")
+        self.assertEquals(rw.run(["/bin/sh", "-c", "echo $X; exit 2"],
+                                 env={"X": "y"}).getReturns(),
+                          ("y\n", "", 2))
+        #####
+        # Different environment, directory or command, not in the trace
+        self.assertRaises(CommandNotInTraceError, rw.run,
+                          ["/bin/sh", "-c", "echo $X; exit 2"], env={"X": "z"})
+        self.assertRaises(CommandNotInTraceError, rw.run, command)
+        rw.setTrace(TraceReplayer(path, strict=False))
+        self.assertEquals(rw.run(["/bin/echo", "live"]).stdout, "live\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/python -u
+"""
+Test of menu actions running their commands without blocking the menu.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import imp
+import sys
+import time
+import unittest
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+
+#####
+# composite_menu imports its siblings as ..lib, so load it from inside
+# the source tree's package, whatever the checkout is called
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+imp.load_module("ramdisk_tree", None, _root, ("", "", imp.PKG_DIRECTORY))
+from ramdisk_tree.lib.composite_menu import MenuItem
+
+
+class test_composite_menu(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def test_actionRunsInBackground(self):
+        """
+        """
+        futures = []
+
+        def slow():
+            futures.append(item.run(["/bin/sh", "-c", "sleep 1; echo done"]))
+            return True
+
+        item = MenuItem("Slow choice", slow)
+        start = time.time()
+        item.menuAction()
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEquals(len(futures), 1)
+        self.assertFalse(futures[0].done())
+        self.assertEquals(futures[0].result(10).getReturns(),
+                          ("done\n", "", 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python -u
+"""
+Test of the long lived command helper.  The helper is started with a plain
+shell instead of su, so the test runs as any user.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import time
+import shutil
+import unittest
+import tempfile
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.coprocess import Coprocess, CoprocessError
+
+
+class test_coprocess(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def setUp(self):
+        """
+        """
+        self.tmpdir = tempfile.mkdtemp()
+        #####
+        # Login scripts that print something must not confuse the startup
+        launcher = ["/bin/sh", "-c", 'echo noisy profile; exec "$0" "$@"',
+                    "/bin/sh", "-c"]
+        self.coprocess = Coprocess("nobody", self.logger, idleTimeout=0.5,
+                                   launcher=launcher)
+
+    def tearDown(self):
+        """
+        """
+        self.coprocess.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_manyCommandsOneHelper(self):
+        """
+        """
+        for i in range(20):
+            stdout, stderr, retcode = self.coprocess.run(["/bin/echo", str(i)])
+            self.assertEquals((stdout, stderr, retcode), (str(i) + "\n", "", 0))
+        self.assertEquals(self.coprocess.starts, 1)
+
+        stdout, stderr, retcode = self.coprocess.run(
+            "printf '\\000\\377'; echo oops >&2; exit 3", cwd=self.tmpdir)
+        self.assertEquals((stdout, stderr, retcode), ("\x00\xff", "oops\n", 3))
+        stdout, _, _ = self.coprocess.run(["/bin/pwd"], cwd=self.tmpdir)
+        self.assertEquals(os.path.realpath(stdout.strip()),
+                          os.path.realpath(self.tmpdir))
+
+        _, stderr, retcode = self.coprocess.run(["/nonexistent/command"])
+        self.assertEquals(retcode, 127)
+        self.assertTrue(stderr)
+
+    def test_idleTimeout(self):
+        """
+        """
+        self.coprocess.run(["/bin/true"])
+        self.assertTrue(self.coprocess.isRunning())
+        pid = self.coprocess.proc.pid
+        time.sleep(1.5)
+        self.assertFalse(self.coprocess.isRunning())
+        #####
+        # Reaped when it went idle, not left a zombie until the next run
+        self.assertEquals(self.coprocess.proc, None)
+        self.assertRaises(OSError, os.waitpid, pid, os.WNOHANG)
+
+        stdout, _, _ = self.coprocess.run(["/bin/echo", "again"])
+        self.assertEquals(stdout, "again\n")
+        self.assertEquals(self.coprocess.starts, 2)
+
+    def test_noRerunAfterSend(self):
+        """
+        """
+        #####
+        # The command runs, then takes its helper down before the reply
+        marker = os.path.join(self.tmpdir, "marker")
+        self.assertRaises(CoprocessError, self.coprocess.run,
+                          "echo ran >> " + marker + "; kill -9 $PPID")
+        with open(marker) as ran:
+            self.assertEquals(ran.read(), "ran\n")
+        self.assertEquals(self.coprocess.starts, 1)
+
+        stdout, _, _ = self.coprocess.run(["/bin/echo", "again"])
+        self.assertEquals(stdout, "again\n")
+        self.assertEquals(self.coprocess.starts, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
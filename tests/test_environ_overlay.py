@@ -0,0 +1,83 @@
+#!/usr/bin/python -u
+"""
+Test of sending commands' temporary files to a directory, like a ramdisk.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import shutil
+import unittest
+import tempfile
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.environ_overlay import EnvironOverlay, tempEnviron
+from lib.run_commands import RunWith
+
+
+class test_environ_overlay(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def setUp(self):
+        """
+        """
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        """
+        shutil.rmtree(self.root)
+
+    def test_overlay(self):
+        """
+        """
+        base = {"HOME": "/home/me", "TMPDIR": "/tmp", "SECRET": "x"}
+        overlay = EnvironOverlay({"TMPDIR": "/mnt/ram"}, base,
+                                 remove=["SECRET"])
+        self.assertEquals(dict(overlay), {"HOME": "/home/me",
+                                          "TMPDIR": "/mnt/ram"})
+        self.assertEquals(len(overlay), 2)
+        self.assertEquals(overlay.get("SECRET"), None)
+        #####
+        # Reads through, changes to the base show up
+        base["LANG"] = "C"
+        self.assertEquals(overlay["LANG"], "C")
+
+    def test_runWithTempDir(self):
+        """
+        """
+        script = "echo $TMPDIR $TMP $TEMP $XDG_CACHE_HOME $KEPT; " + \
+                 "touch $TMPDIR/scratch"
+        for spawn in [False, True]:
+            rw = RunWith(self.logger)
+            rw.setSpawn(spawn)
+            rw.setTempDir(self.root, xdgCache=True)
+            result = rw.run(script, env={"KEPT": "kept"})
+            words = result.stdout.split()
+            self.assertEquals(len(set(words[:4])), 1)
+            self.assertEquals(os.path.dirname(words[0]), self.root)
+            self.assertEquals(words[4], "kept")
+            self.assertEquals(os.listdir(self.root), [])
+
+        with tempEnviron(self.root) as env:
+            rw = RunWith(self.logger)
+            rw.setCommand("echo $TMPDIR; echo $PATH", env=env)
+            stdout, _, _ = rw.communicate()
+            tmpdir, path = stdout.split()
+            self.assertTrue(os.path.isdir(tmpdir))
+            self.assertEquals(path, os.environ["PATH"])
+        self.assertFalse(os.path.exists(tmpdir))
+
+
+if __name__ == "__main__":
+    unittest.main()
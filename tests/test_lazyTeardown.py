@@ -0,0 +1,73 @@
+#!/usr/bin/python -u
+"""
+Test of the background mount point cleanup used by lazy unmounts.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import shutil
+import unittest
+import tempfile
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+
+if sys.platform.startswith("linux"):
+    from linuxTmpfsRamdisk import LazyTeardown
+
+
+class test_lazyTeardown(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        if not sys.platform.startswith("linux"):
+            raise unittest.SkipTest("This is not valid on this OS")
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def setUp(self):
+        """
+        """
+        self.tmpdir = tempfile.mkdtemp()
+        self.teardown = LazyTeardown()
+
+    def tearDown(self):
+        """
+        """
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_removesEmptyMountPoint(self):
+        """
+        """
+        mntpnt = os.path.join(self.tmpdir, "mnt")
+        os.mkdir(mntpnt)
+        self.teardown.schedule(mntpnt, self.logger)
+        self.assertTrue(self.teardown.join(5))
+        self.assertFalse(os.path.exists(mntpnt))
+        self.assertTrue(self.teardown.done[mntpnt])
+
+    def test_leavesNonEmptyDirectory(self):
+        """
+        """
+        mntpnt = os.path.join(self.tmpdir, "full")
+        os.mkdir(mntpnt)
+        open(os.path.join(mntpnt, "data"), "w").close()
+        self.teardown.schedule(mntpnt, self.logger)
+        self.assertTrue(self.teardown.join(5))
+        self.assertTrue(os.path.isdir(mntpnt))
+        self.assertFalse(self.teardown.done[mntpnt])
+
+    def test_joinWithNothingPending(self):
+        """
+        """
+        self.assertTrue(self.teardown.join(0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/python -u
+"""
+Test of writing log records from a background thread.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import sys
+import time
+import logging
+import unittest
+import threading
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.loggers import LogPriority as lp
+from lib import log_queue
+from lib.log_queue import QueueHandler, QueueListener, OverflowPolicy
+from lib.log_queue import InvalidOverflowPolicyError
+
+
+class SlowHandler(logging.Handler):
+    """
+    Handler taking delay seconds to write each record.
+    """
+    def __init__(self, delay):
+        logging.Handler.__init__(self)
+        self.delay = delay
+        self.messages = []
+
+    def emit(self, record):
+        time.sleep(self.delay)
+        self.messages.append(record.getMessage())
+
+
+def record(message):
+    return logging.makeLogRecord({"levelno": logging.INFO,
+                                  "levelname": "INFO", "msg": message})
+
+
+class test_log_queue(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def test_overflow(self):
+        """
+        """
+        self.assertRaises(InvalidOverflowPolicyError, QueueHandler, 10,
+                          "newest")
+
+        queue = QueueHandler(3, OverflowPolicy.DROP_OLDEST)
+        for i in range(10):
+            queue.emit(record("message %d" % i))
+        self.assertEquals([item.msg for item in queue.records],
+                          ["message 7", "message 8", "message 9"])
+        self.assertEquals(queue.dropped, 7)
+
+        queue = QueueHandler(3, OverflowPolicy.SAMPLE, sampleRate=4)
+        for i in range(11):
+            queue.emit(record("message %d" % i))
+        #####
+        # 8 overflowed, the 4th and 8th of them got in
+        self.assertEquals([item.msg for item in queue.records],
+                          ["message 2", "message 6", "message 10"])
+        self.assertEquals(queue.dropped, 8)
+
+        #####
+        # The message is put together when it is logged
+        args = ["before"]
+        item = logging.makeLogRecord({"msg": "%s", "args": (args,)})
+        queue = QueueHandler(3)
+        queue.emit(item)
+        args[0] = "after"
+        self.assertEquals(queue.get().getMessage(), "['before']")
+
+    def test_listener(self):
+        """
+        """
+        slow = SlowHandler(0.01)
+        queue = QueueHandler(100)
+        listener = QueueListener(queue, [slow])
+        listener.start()
+        try:
+            start = time.time()
+            for i in range(20):
+                queue.handle(record("message %d" % i))
+            #####
+            # The caller doesn't wait on the 0.2s of writing
+            self.assertTrue(time.time() - start < 0.1)
+            self.assertTrue(queue.join(5))
+            self.assertEquals(slow.messages,
+                              ["message %d" % i for i in range(20)])
+
+            #####
+            # Overflow gets reported once the queue drains
+            queue.overflow = OverflowPolicy.DROP_OLDEST
+            queue.size = 2
+            for i in range(10):
+                queue.handle(record("burst %d" % i))
+            self.assertTrue(queue.join(5))
+            self.assertTrue(slow.messages[-1].endswith(
+                "log records dropped, the log queue was full"))
+        finally:
+            listener.stop()
+        self.assertEquals(listener.thread, None)
+        #####
+        # Written right away once the listener is gone
+        queue.handle(record("late"))
+        self.assertEquals(slow.messages[-1], "late")
+        self.assertFalse(listener in log_queue._listeners)
+
+        #####
+        # Records logged while stop() waits for the queue to drain are
+        # written right away, not left in a queue nobody reads
+        slow = SlowHandler(0.01)
+        queue = QueueHandler(100)
+        listener = QueueListener(queue, [slow])
+        listener.start()
+        self.assertTrue(listener in log_queue._listeners)
+        for i in range(20):
+            queue.handle(record("message %d" % i))
+        stopping = threading.Thread(target=listener.stop)
+        stopping.start()
+        time.sleep(0.05)
+        queue.handle(record("during stop"))
+        self.assertTrue("during stop" in slow.messages)
+        stopping.join()
+        self.assertEquals(len(slow.messages), 21)
+
+        try:
+            self.logger.initializeLogs(asynchronous=True, myconsole=False,
+                                       syslog=False)
+            self.assertTrue(self.logger.queueHandler in
+                            self.logger.logr.handlers)
+            self.logger.log(lp.WARNING, "Written in the background")
+            self.assertTrue(self.logger.flush(5))
+        finally:
+            self.logger.initializeLogs()
+        self.assertEquals(self.logger.listener, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
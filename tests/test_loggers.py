@@ -6,6 +6,7 @@ Testing logging functionality via CyLogger
 """
 # --- Native python libraries
 import sys
+import logging
 import unittest
 
 from datetime import datetime
@@ -15,6 +16,7 @@ sys.path.append("..")
 # --- Non-native python libraries in this source tree
 from lib.loggers import CyLogger
 from lib.loggers import LogPriority
+from lib.loggers import IllegalLoggingLevelError
 
 class test_CyLogger(unittest.TestCase):
     """
@@ -71,6 +73,47 @@ class test_CyLogger(unittest.TestCase):
         except:
             self.fail("Failed to write DEBUG to log file")
 
+    def testLogDropped(self):
+        """
+        A message below the level is dropped before its prefix is made
+        """
+        level = self.logger.logr.level
+        prefix = self.logger._prefix
+        self.logger.logr.setLevel(self.priority.INFO)
+        try:
+            self.logger._prefix = None
+            self.logger.log(self.priority.DEBUG, "Dropped message")
+            self.assertFalse(self.logger.isEnabledFor(self.priority.DEBUG))
+            self.assertRaises(IllegalLoggingLevelError, self.logger.log,
+                              5, "Not a priority")
+            self.assertRaises(IllegalLoggingLevelError, self.logger.log,
+                              [], "Not a priority")
+        finally:
+            self.logger._prefix = prefix
+            self.logger.logr.setLevel(level)
+
+    def testLogCaller(self):
+        """
+        The prefix names the caller, or its caller with stacklevel=2
+        """
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        self.logger.logr.addHandler(handler)
+
+        def helper(message):
+            self.logger.log(self.priority.WARNING, message, stacklevel=2)
+
+        try:
+            self.logger.log(self.priority.WARNING, "From the test")
+            helper("From the helper")
+        finally:
+            self.logger.logr.removeHandler(handler)
+        self.assertEquals(len(records), 2)
+        for record in records:
+            self.assertTrue("test_loggers.py, testLogCaller (" in
+                            record.getMessage(), record.getMessage())
+
 
 if __name__ == "__main__":
     unittest.main()
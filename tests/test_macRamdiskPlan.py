@@ -0,0 +1,127 @@
+#!/usr/bin/python -u
+"""
+Test of the Mac ramdisk creation plan, against stand-in hdiutil, diskutil,
+newfs_hfs and top scripts so it can run on any platform.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import shutil
+import unittest
+import tempfile
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from macRamdisk import MacRamdiskPlan
+
+#####
+# Each stand-in records how it was called, then prints what the real tool
+# would have.
+STANDINS = {"hdiutil": 'echo "/dev/disk9          "',
+            "diskutil": 'echo "Finished"',
+            "newfs_hfs": 'echo "Initialized /dev/rdisk9 as a 64 MB HFS Plus volume"',
+            "top": 'echo "PhysMem: 15G used (2370M wired), 4096M unused."'}
+
+
+class RecordingExecutor(object):
+    """
+    Stand-in executor, records commands and answers with canned output.
+    """
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+
+    def run(self, cmd):
+        self.calls.append(cmd)
+        return self.answers.get(os.path.basename(cmd[0]), ("", "", 0))
+
+
+class test_macRamdiskPlan(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def setUp(self):
+        """
+        """
+        self.tmpdir = tempfile.mkdtemp()
+        self.calllog = os.path.join(self.tmpdir, "calls")
+        self.tools = {}
+        for name, body in STANDINS.items():
+            path = os.path.join(self.tmpdir, name)
+            with open(path, "w") as script:
+                script.write("#!/bin/sh\n" +
+                             'echo "' + name + ' $@" >> ' + self.calllog +
+                             "\n" + body + "\n")
+            os.chmod(path, 0o755)
+            self.tools[name] = path
+
+    def tearDown(self):
+        """
+        """
+        shutil.rmtree(self.tmpdir)
+
+    def makePlan(self, mountpoint, executor=None):
+        """
+        """
+        return MacRamdiskPlan(64, mountpoint, self.logger, executor,
+                              hdiutil=self.tools["hdiutil"],
+                              diskutil=self.tools["diskutil"],
+                              newfs=self.tools["newfs_hfs"],
+                              top=self.tools["top"],
+                              volumeName="ramdisk")
+
+    def recordedCalls(self):
+        """
+        """
+        with open(self.calllog) as calls:
+            return [line.strip() for line in calls.readlines()]
+
+    def test_customMountpointPlan(self):
+        """
+        attach, format and mount, no unmount/remount or disableJournal.
+        """
+        plan = self.makePlan("/tmp/ramdisk_mnt")
+        self.assertTrue(plan.run())
+        self.assertEquals(self.recordedCalls(),
+                          ["top -l 1",
+                           "hdiutil attach -nomount ram://131072",
+                           "newfs_hfs -v ramdisk /dev/disk9",
+                           "diskutil mount -mountPoint /tmp/ramdisk_mnt " +
+                           "/dev/disk9"])
+        self.assertEquals(plan.device, "/dev/disk9")
+        self.assertEquals(plan.free, 4096)
+        self.assertEquals([name for name, _ in plan.timings],
+                          ["memory", "attach", "format", "mount"])
+
+    def test_defaultMountpointPlan(self):
+        """
+        Without a mount point, format and mount are one erasevolume.
+        """
+        plan = self.makePlan("")
+        self.assertTrue(plan.run())
+        self.assertEquals(self.recordedCalls()[2:],
+                          ["diskutil erasevolume HFS+ ramdisk /dev/disk9"])
+        self.assertEquals(plan.mntPoint, "/Volumes/ramdisk")
+
+    def test_notEnoughMemoryStops(self):
+        """
+        """
+        executor = RecordingExecutor(
+            {"top": ("PhysMem: 15G used (2370M wired), 10M unused.", "", 0)})
+        plan = self.makePlan("/tmp/ramdisk_mnt", executor)
+        self.assertFalse(plan.run())
+        self.assertEquals(len(executor.calls), 1)
+        self.assertEquals(plan.free, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/python -u
+"""
+Test of starting commands with posix_spawn, on its own and through RunWith.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import time
+import errno
+import unittest
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.getLibc import getLibc
+from lib.posix_spawn import Spawner
+from lib.run_commands import RunWith, readPipes
+
+
+class test_posix_spawn(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+        self.spawner = Spawner(getLibc())
+
+    def test_spawn(self):
+        """
+        """
+        self.assertTrue(self.spawner.available())
+        proc = self.spawner.spawn(["/bin/sh", "-c",
+                                   "echo $SPAWNED; echo err >&2; exit 4"],
+                                  env={"SPAWNED": "yes"})
+        self.assertEquals(readPipes(proc), ("yes\n", "err\n", False))
+        self.assertEquals(proc.returncode, 4)
+
+        proc = self.spawner.spawn("kill -9 $$", shell=True)
+        readPipes(proc)
+        self.assertEquals(proc.returncode, -9)
+
+        try:
+            self.spawner.spawn(["/nonexistent/command"])
+        except OSError, err:
+            self.assertEquals(err.errno, errno.ENOENT)
+        else:
+            self.fail("Missing command did not raise OSError")
+
+    def test_runWithSpawn(self):
+        """
+        """
+        rw = RunWith(self.logger)
+        self.assertTrue(rw.setSpawn())
+        result = rw.run(["/bin/echo", "spawned"])
+        self.assertEquals(result.getReturns(), ("spawned\n", "", 0))
+
+        start = time.time()
+        result = rw.run(["/bin/sh", "-c", "sleep 30 & echo x; sleep 30"],
+                        timeout=0.3)
+        self.assertTrue(result.timedOut)
+        self.assertTrue(time.time() - start < 10)
+
+        #####
+        # A cwd goes through Popen
+        result = rw.run(["/bin/pwd"], cwd="/")
+        self.assertEquals(result.stdout, "/\n")
+        self.assertFalse(rw.setSpawn(False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python -u
+"""
+Test of the pty session engine, against a stand-in password prompting
+script.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import time
+import shutil
+import resource
+import unittest
+import tempfile
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.pty_session import PtySession
+
+#####
+# Asks for a password with echo off, like su, then answers and exits.
+PROMPTER = """#!/bin/sh
+stty -echo
+printf "Password:"
+read secret
+stty echo
+echo
+echo "got $secret"
+i=0
+while [ $i -lt 2000 ]; do echo "line $i"; i=$((i+1)); done
+exit 4
+"""
+
+
+class test_pty_session(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def setUp(self):
+        """
+        """
+        self.tmpdir = tempfile.mkdtemp()
+        self.prompter = os.path.join(self.tmpdir, "prompter")
+        with open(self.prompter, "w") as script:
+            script.write(PROMPTER)
+        os.chmod(self.prompter, 0o755)
+
+    def tearDown(self):
+        """
+        """
+        shutil.rmtree(self.tmpdir)
+
+    def test_passwordDialog(self):
+        """
+        """
+        session = PtySession([self.prompter], self.logger).spawn()
+        self.assertTrue(session.waitnoecho(5))
+        self.assertEquals(session.expect(["nomatch", "Password:"], 5), 1)
+        session.sendline("sekrit")
+        output = session.readToEof(10)
+        self.assertEquals(session.close(), 4)
+        self.assertTrue("got sekrit" in output)
+        self.assertTrue("line 1999" in output)
+        self.assertFalse("Password:" in output)
+        self.assertTrue(session.getOutput().startswith("Password:"))
+        self.assertEquals([phase for phase, _ in session.timings],
+                          ["spawn", "waitnoecho", "expect", "read", "close"])
+
+    def test_expectTimeoutAndEof(self):
+        """
+        """
+        session = PtySession(["/bin/sh", "-c", "echo hello; sleep 0.3"],
+                             self.logger).spawn()
+        start = time.time()
+        self.assertEquals(session.expect("never", timeout=0.1), None)
+        self.assertTrue(time.time() - start < 0.3)
+        self.assertEquals(session.expect("never"), None)
+        self.assertTrue(session.eof)
+        self.assertTrue("hello" in session.before)
+        self.assertEquals(session.close(), 0)
+
+    def test_expectFirst(self):
+        """
+        """
+        session = PtySession([self.prompter], self.logger).spawn()
+        self.assertEquals(session.expectFirst(["nomatch", "Password:"], 5), 1)
+        session.sendline("sekrit")
+        self.assertEquals(session.expect("line 1", 5), 0)
+        self.assertTrue("got sekrit" in session.before)
+        self.assertEquals(session.expect("line 2", 5), 0)
+        self.assertEquals(session.before.strip(), "")
+        session.readToEof(10)
+        self.assertEquals(session.close(), 4)
+
+        #####
+        # A prompt in the command's own output isn't the first output
+        session = PtySession(["/bin/sh", "-c", "echo hello; echo Password:"],
+                             self.logger).spawn()
+        start = time.time()
+        self.assertEquals(session.expectFirst("Password:", 5), None)
+        self.assertTrue(time.time() - start < 1)
+        self.assertTrue("hello" in session.readToEof(10))
+        self.assertEquals(session.close(), 0)
+
+    def test_waitingUsesNoCpu(self):
+        """
+        """
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        session = PtySession(["/bin/sleep", "1"], self.logger).spawn()
+        session.readToEof()
+        session.close()
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        cpu = (after.ru_utime - before.ru_utime) + \
+              (after.ru_stime - before.ru_stime)
+        self.assertTrue(cpu < 0.2, "Used " + str(cpu) + "s of CPU")
+
+
+if __name__ == "__main__":
+    unittest.main()
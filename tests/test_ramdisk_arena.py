@@ -0,0 +1,108 @@
+#!/usr/bin/python -u
+"""
+Test of the ramdisk backed shared memory arena.
+
+Runs against a temporary directory, the arena itself doesn't care if the
+directory is on a ramdisk or not.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import shutil
+import unittest
+import tempfile
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.loggers import LogPriority as lp
+from lib.ramdisk_arena import RamdiskArena, ArenaError
+
+
+class test_ramdisk_arena(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def setUp(self):
+        """
+        """
+        self.tmpdir = tempfile.mkdtemp()
+        self.arena = RamdiskArena(os.path.join(self.tmpdir, "arena"),
+                                  self.logger)
+
+    def tearDown(self):
+        """
+        """
+        self.arena.destroy()
+        shutil.rmtree(self.tmpdir)
+
+    def test_allocRoundsToSizeClass(self):
+        """
+        """
+        region = self.arena.alloc("one", 5000)
+        self.assertEquals(region.size, 5000)
+        self.assertTrue(region.capacity >= 5000)
+        self.assertEquals(region.capacity & (region.capacity - 1), 0,
+                          "Capacity is not a power of two...")
+        self.assertEquals(os.stat(region.path).st_size, region.capacity)
+
+    def test_badNamesAndDuplicates(self):
+        """
+        """
+        self.assertRaises(ArenaError, self.arena.alloc, "../escape", 10)
+        self.assertRaises(ArenaError, self.arena.alloc, ".free", 10)
+        self.arena.alloc("dup", 10)
+        self.assertRaises(ArenaError, self.arena.alloc, "dup", 10)
+        self.assertRaises(ArenaError, self.arena.attach, "missing")
+
+    def test_releaseReusesFreeList(self):
+        """
+        """
+        region = self.arena.alloc("first", 100)
+        region.map[0:6] = "secret"
+        self.arena.release("first")
+        self.assertFalse(os.path.exists(os.path.join(self.arena.path,
+                                                     "first")))
+        self.assertEquals(self.arena.getStats()["free"], 1)
+        region = self.arena.alloc("second", 200)
+        self.assertEquals(region.map[0:6], "\0" * 6)
+        stats = self.arena.getStats()
+        self.assertEquals(stats["free"], 0)
+        self.assertEquals(stats["reuses"], 1)
+        self.assertRaises(ArenaError, self.arena.release, "first")
+
+    def test_sharedBetweenProcesses(self):
+        """
+        A forked child attaching by name sees the parent's data, and the
+        parent sees what the child writes.
+        """
+        region = self.arena.alloc("shared", 4000)
+        region.map[0:5] = "hello"
+
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                child = RamdiskArena(self.arena.path, self.logger)
+                attached = child.attach("shared")
+                if attached.map[0:5] == "hello" and attached.size == 4000:
+                    attached.map[5:11] = " world"
+                    status = 0
+                attached.close()
+            finally:
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        self.assertEquals(os.WEXITSTATUS(status), 0)
+        self.assertEquals(region.map[0:11], "hello world")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/python -u
+"""
+Test of the ramdisk health watchdog, against stand-in /proc files.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import time
+import shutil
+import unittest
+import tempfile
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.ramdisk_watchdog import RamdiskWatchdog
+from lib.ramdisk_arena import RamdiskArena, ArenaError
+
+PRESSURE = "some avg10=%s avg60=0.00 avg300=0.00 total=0\n" + \
+           "full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n"
+VMSTAT = "nr_free_pages 1000\npswpin %d\npswpout %d\n"
+
+
+class test_ramdisk_watchdog(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def setUp(self):
+        """
+        """
+        self.tmpdir = tempfile.mkdtemp()
+        self.pressure = os.path.join(self.tmpdir, "pressure")
+        self.vmstat = os.path.join(self.tmpdir, "vmstat")
+        self.writeProc("0.00", 0, 0)
+        self.resized = []
+        self.events = []
+        self.watchdog = RamdiskWatchdog(self.tmpdir, self.logger,
+                                        interval=0.01, shrink=True,
+                                        shrinkMargin=1,
+                                        resize=self.resized.append,
+                                        pressurePath=self.pressure,
+                                        vmstatPath=self.vmstat)
+        self.watchdog.addCallback(
+            lambda dog, sample: self.events.append(dog.underPressure))
+
+    def tearDown(self):
+        """
+        """
+        self.watchdog.stop(5)
+        shutil.rmtree(self.tmpdir)
+
+    def writeProc(self, psi, swapin, swapout):
+        """
+        Overwrite the stand-in /proc files in place, like the kernel does.
+        """
+        for path, data in [(self.pressure, PRESSURE % psi),
+                           (self.vmstat, VMSTAT % (swapin, swapout))]:
+            with open(path, "r+" if os.path.exists(path) else "w") as proc:
+                proc.write(data)
+
+    def test_psiPressureRefusesAllocations(self):
+        """
+        """
+        sample = self.watchdog.sample()
+        self.assertEquals(sample["psi"], 0.0)
+        self.assertTrue(self.watchdog.allocationsAllowed)
+
+        self.writeProc("55.00", 0, 0)
+        sample = self.watchdog.sample()
+        self.assertEquals(sample["psi"], 55.0)
+        self.assertFalse(self.watchdog.allocationsAllowed)
+        self.assertEquals(self.events, [True])
+
+        arena = RamdiskArena(os.path.join(self.tmpdir, "arena"), self.logger,
+                             gate=lambda: self.watchdog.allocationsAllowed)
+        self.assertRaises(ArenaError, arena.alloc, "refused", 10)
+
+        self.writeProc("00.00", 0, 0)
+        self.watchdog.sample()
+        self.assertTrue(self.watchdog.allocationsAllowed)
+        self.assertEquals(self.events, [True, False])
+        arena.alloc("allowed", 10)
+        arena.destroy()
+
+    def test_swapRateAndShrink(self):
+        """
+        """
+        self.watchdog.sample()
+        time.sleep(0.05)
+        self.writeProc("0.00", 500000, 500000)
+        sample = self.watchdog.sample()
+        self.assertTrue(sample["swap"] > self.watchdog.swapThreshold)
+        self.assertTrue(self.watchdog.underPressure)
+        self.assertEquals(len(self.resized), 1)
+
+    def test_fullWarnedOnce(self):
+        """
+        """
+        warnings = []
+        self.logger.log = lambda priority, msg, **kwargs: \
+            warnings.append(msg) if "% full" in msg else None
+        try:
+            self.watchdog.usageThreshold = 0.0
+            for _ in range(3):
+                self.watchdog.sample()
+            self.watchdog.usageThreshold = 2.0
+            self.watchdog.sample()
+            self.watchdog.usageThreshold = 0.0
+            self.watchdog.sample()
+        finally:
+            del self.logger.log
+        self.assertEquals(len(warnings), 2)
+
+    def test_threadSamples(self):
+        """
+        """
+        self.watchdog.start()
+        time.sleep(0.1)
+        self.watchdog.stop(5)
+        self.assertFalse(self.watchdog.is_alive())
+        self.assertTrue(self.watchdog.lastSample is not None)
+
+
+if __name__ == "__main__":
+    unittest.main()
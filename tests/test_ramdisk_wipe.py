@@ -0,0 +1,96 @@
+#!/usr/bin/python -u
+"""
+Test of the ramdisk content wipe engine, run against a temporary directory.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import shutil
+import unittest
+import tempfile
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.ramdisk_wipe import WipeEngine, WipeError
+
+
+class test_ramdisk_wipe(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def setUp(self):
+        """
+        """
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, "mnt")
+        self.outside = os.path.join(self.tmpdir, "outside")
+        os.mkdir(self.root)
+        os.mkdir(self.outside)
+        open(os.path.join(self.outside, "keep"), "w").close()
+
+    def tearDown(self):
+        """
+        """
+        shutil.rmtree(self.tmpdir)
+
+    def test_wipesFilesAndDirectories(self):
+        """
+        """
+        for subdir in ["one", "two/three", "two/four"]:
+            os.makedirs(os.path.join(self.root, subdir))
+            for i in range(300):
+                open(os.path.join(self.root, subdir, "f" + str(i)), "w").close()
+        for i in range(1000):
+            open(os.path.join(self.root, "testfile" + str(i)), "w").close()
+
+        stats = WipeEngine(self.root, self.logger, workers=4).wipe()
+        self.assertEquals(os.listdir(self.root), [])
+        self.assertEquals(stats["files"], 1900)
+        self.assertEquals(stats["dirs"], 4)
+        self.assertEquals(stats["errors"], 0)
+        self.assertTrue(stats["filesPerSecond"] > 0)
+
+    def test_deepTreeIsNotRecursive(self):
+        """
+        Deeper than the python recursion limit.
+        """
+        depth = sys.getrecursionlimit() + 100
+        path = self.root
+        for _ in range(depth):
+            path = os.path.join(path, "d")
+            os.mkdir(path)
+        open(os.path.join(path, "bottom"), "w").close()
+
+        stats = WipeEngine(self.root, self.logger).wipe()
+        self.assertEquals(os.listdir(self.root), [])
+        self.assertEquals(stats["dirs"], depth)
+
+    def test_symlinksDoNotEscape(self):
+        """
+        """
+        os.symlink(self.outside, os.path.join(self.root, "dirlink"))
+        os.symlink(os.path.join(self.outside, "keep"),
+                   os.path.join(self.root, "filelink"))
+
+        WipeEngine(self.root, self.logger).wipe()
+        self.assertEquals(os.listdir(self.root), [])
+        self.assertTrue(os.path.exists(os.path.join(self.outside, "keep")))
+
+    def test_missingRoot(self):
+        """
+        """
+        engine = WipeEngine(os.path.join(self.tmpdir, "nope"), self.logger)
+        self.assertRaises(WipeError, engine.wipe)
+
+
+if __name__ == "__main__":
+    unittest.main()
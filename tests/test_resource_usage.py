@@ -0,0 +1,106 @@
+#!/usr/bin/python -u
+"""
+Test of resource usage accounting for the commands RunWith runs.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import json
+import shutil
+import unittest
+import tempfile
+from subprocess import Popen, PIPE
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.command_metrics import CommandMetrics
+from lib.run_commands import RunWith
+from lib.resource_usage import ResourceUsage, reap, usageOf
+
+BUSY = "i=0; while [ $i -lt 100000 ]; do i=$((i+1)); done"
+
+
+class test_resource_usage(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def test_reap(self):
+        """
+        """
+        proc = Popen(["/bin/sh", "-c", BUSY + "; exit 3"], stdout=PIPE)
+        self.assertEquals(reap(proc), 3)
+        self.assertEquals(proc.poll(), 3)
+        usage = usageOf(proc)
+        self.assertTrue(usage.cpuTime > 0)
+        self.assertTrue(usage.maxRss > 0)
+        self.assertTrue(usage.minorFaults > 0)
+        self.assertRaises(AttributeError, setattr, usage, "maxRss", 0)
+        proc.stdout.close()
+
+        #####
+        # Reaped elsewhere, the usage and the exit code are lost, Popen
+        # reports 0 for a child that is already gone
+        proc = Popen(["/bin/sh", "-c", "exit 2"])
+        os.waitpid(proc.pid, 0)
+        proc.returncode = None
+        self.assertEquals(reap(proc), 0)
+        self.assertEquals(usageOf(proc), None)
+
+        rw = RunWith(self.logger)
+        result = rw.run(["/bin/sh", "-c", BUSY])
+        self.assertTrue(result.usage.cpuTime > 0)
+        self.assertEquals(result.retcode, 0)
+        result = rw.run(["/bin/sleep", "30"], timeout=0.2)
+        self.assertTrue(result.timedOut)
+        self.assertEquals(result.retcode, -15)
+        self.assertNotEquals(result.usage, None)
+        rw.setCommand(["/bin/echo", "hi"])
+        rw.communicate()
+        self.assertTrue(isinstance(rw.getUsage(), ResourceUsage))
+
+    def test_metricsUsage(self):
+        """
+        """
+        metrics = CommandMetrics()
+        metrics.record(["/bin/ls"], 0.1,
+                       usage=ResourceUsage(0.5, 0.25, 2048, 10, 1, 3, 4))
+        metrics.record(["/bin/ls"], 0.1,
+                       usage=ResourceUsage(0.5, 0.25, 1024, 10, 1, 3, 4))
+        metrics.record(["/bin/ls"], 0.1)
+        metrics.record(["/bin/date"], 0.1,
+                       usage=ResourceUsage(0.1, 0.0, 4096))
+        stats = metrics.getStats("/bin/ls")
+        self.assertEquals((stats["calls"], stats["measured"]), (3, 2))
+        self.assertEquals((stats["cpu"], stats["maxRss"],
+                           stats["minorFaults"], stats["majorFaults"],
+                           stats["involuntarySwitches"]),
+                          (1.5, 2048, 20, 2, 8))
+        self.assertEquals(metrics.top(), [("/bin/ls", 1.5),
+                                          ("/bin/date", 0.1)])
+        self.assertEquals(metrics.top("maxRss", 1), [("/bin/date", 4096)])
+
+        rw = RunWith(self.logger, metrics=metrics)
+        rw.run(["/bin/sh", "-c", BUSY])
+        self.assertTrue(metrics.getStats("/bin/sh")["cpu"] > 0)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "metrics.json")
+            metrics.dumpJson(path)
+            with open(path) as dump:
+                self.assertEquals(json.load(dump)["/bin/ls"]["maxRss"], 2048)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
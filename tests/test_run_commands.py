@@ -3,6 +3,9 @@ import unittest
 import time
 import sys
 import os
+import shutil
+import tempfile
+from multiprocessing.pool import ThreadPool
 from datetime import datetime
 
 appendDir = "/".join(os.path.abspath(os.path.dirname(__file__)).split('/')[:-1])
@@ -11,6 +14,8 @@ sys.path.append(appendDir)
 from lib.loggers import CyLogger
 from lib.loggers import LogPriority as lp
 from lib.run_commands import RunWith, SetCommandTypeError
+from lib.run_commands import SyncPolicy, InvalidSyncPolicyError
+from lib.run_commands import RunThread, runMyThreadCommand
 
 
 class test_run_commands(unittest.TestCase):
@@ -69,6 +74,62 @@ class test_run_commands(unittest.TestCase):
 
         self.logger.log(lp.DEBUG, "=============== Ending test_communicate...")
 
+    def test_syncPolicy(self):
+        """
+        """
+        self.rw.__init__(self.logger)
+        self.assertEquals(self.rw.syncPolicy, SyncPolicy.NONE)
+        self.assertRaises(InvalidSyncPolicyError, self.rw.setSyncPolicy,
+                          "sometimes")
+
+        tmpfile = tempfile.NamedTemporaryFile()
+        tmpfile.write("dirty")
+        tmpfile.flush()
+        for policy, targets in [(SyncPolicy.NONE, None),
+                                (SyncPolicy.SYNCFS, tempfile.gettempdir()),
+                                (SyncPolicy.FDATASYNC, [tmpfile.name]),
+                                (SyncPolicy.GLOBAL, None)]:
+            self.rw.setSyncPolicy(policy, targets)
+            self.rw.setCommand(['/bin/echo', 'synced'])
+            stdout, _, retval = self.rw.communicate()
+            self.assertEquals(retval, 0)
+            self.assertEquals(stdout.strip(), "synced")
+
+        #####
+        # Per call override, missing targets are logged, not raised
+        self.rw.setSyncPolicy(SyncPolicy.NONE)
+        self.rw.setCommand(['/bin/echo', 'synced'])
+        self.rw.wait(sync=SyncPolicy.FDATASYNC,
+                     syncTargets="/nonexistent/file")
+        self.assertEquals(self.rw.getReturnCode(), 0)
+        tmpfile.close()
+
+        #####
+        # A target fdatasync refuses doesn't lose the command's result
+        result = self.rw.run(['/bin/echo', 'synced'],
+                             sync=SyncPolicy.FDATASYNC,
+                             syncTargets="/dev/null")
+        self.assertEquals(result.getReturns(), ("synced\n", "", 0))
+
+        #####
+        # syncfs without targets falls back to a global sync
+        class Libc(object):
+            synced = 0
+
+            def sync(self):
+                Libc.synced += 1
+
+            def syncfs(self, fd):
+                raise AssertionError("syncfs without a target")
+
+        libc = self.rw.libc
+        self.rw.libc = Libc()
+        try:
+            self.rw.sync(SyncPolicy.SYNCFS, [])
+        finally:
+            self.rw.libc = libc
+        self.assertEquals(Libc.synced, 1)
+
     def test_wait(self):
         """
         """
@@ -113,6 +174,51 @@ class test_run_commands(unittest.TestCase):
         else:
             self.assertEquals(retval, 2, "Returncode Test failed...")
 
+    def test_stream(self):
+        """
+        """
+        self.rw.__init__(self.logger)
+        #####
+        # A megabyte on stderr before anything on stdout would fill the
+        # stderr pipe if it weren't read alongside stdout
+        self.rw.setCommand(['/bin/sh', '-c',
+                            'i=0; while [ $i -lt 16384 ]; do ' +
+                            'echo 0123456789012345678901234567890123456789' +
+                            '01234567890123456789 >&2; i=$((i+1)); done; ' +
+                            'echo last; printf partial'])
+        counts = {"stdout": 0, "stderr": 0}
+        lines = []
+        for name, line in self.rw.stream():
+            counts[name] += 1
+            if name == "stdout":
+                lines.append(line)
+        self.assertEquals(counts["stderr"], 16384)
+        self.assertEquals(lines, ["last", "partial"])
+        self.assertEquals(self.rw.getReturnCode(), 0)
+
+        #####
+        # Stop on a match, without waiting for the child to finish
+        self.rw.setCommand(['/bin/sh', '-c',
+                            'echo starting; echo ready; sleep 30'])
+        start = time.time()
+        seen = [line for _, line in self.rw.stream(chk_string="^rea")]
+        self.assertEquals(seen, ["starting", "ready"])
+        self.assertTrue(time.time() - start < 10)
+        self.assertNotEquals(self.rw.getReturnCode(), 0)
+
+        #####
+        # Closing the generator early terminates the child
+        self.rw.setCommand(['/bin/sh', '-c', 'echo one; sleep 30'])
+        start = time.time()
+        lines = self.rw.stream()
+        self.assertEquals(lines.next(), ("stdout", "one"))
+        lines.close()
+        self.assertTrue(time.time() - start < 10)
+
+        self.rw.setCommand(['/bin/sh', '-c', 'echo out; echo err >&2'])
+        self.assertEquals(self.rw.waitNpassThruStdout(),
+                          ("out\n", "err\n", 0))
+
     def test_timeout(self):
         """
         """
@@ -131,6 +237,159 @@ class test_run_commands(unittest.TestCase):
         self.assertTrue(elapsed < 4,
                         "Elapsed time is greater than it should be...")
 
+    def isRunning(self, pid):
+        """
+        True if pid is a live process, not a zombie waiting to be reaped.
+        """
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        try:
+            with open("/proc/" + str(pid) + "/stat") as stat:
+                return stat.read().rsplit(")", 1)[1].split()[0] != "Z"
+        except IOError:
+            return True
+
+    def test_timeoutProcessGroup(self):
+        """
+        """
+        self.rw.__init__(self.logger)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            pidfile = os.path.join(tmpdir, "grandchild")
+            #####
+            # The backgrounded grandchild holds stdout open, killing only
+            # the shell would leave it running and the read blocked.
+            self.rw.setCommand(["/bin/sh", "-c",
+                                "sleep 30 & echo $! > " + pidfile +
+                                "; echo started; sleep 30"])
+            start = time.time()
+            stdout, _, retcode, timedOut = self.rw.timeout(0.5)
+            self.assertTrue(time.time() - start < 10)
+            self.assertTrue(timedOut)
+            self.assertEquals(stdout, "started\n")
+            with open(pidfile) as pid:
+                grandchild = int(pid.read())
+            time.sleep(0.1)
+            self.assertFalse(self.isRunning(grandchild))
+
+            #####
+            # Ignoring SIGTERM gets SIGKILL after the grace period
+            self.rw.setCommand(["/bin/sh", "-c",
+                                "trap '' TERM; echo stubborn; " +
+                                "while :; do sleep 1; done"])
+            stdout, _, retcode, timedOut = self.rw.timeout(0.3, grace=0.3)
+            self.assertTrue(timedOut)
+            self.assertEquals(stdout, "stubborn\n")
+            self.assertEquals(retcode, -9)
+
+            #####
+            # A child still cleaning up after the shell exits gets the
+            # grace period too
+            marker = os.path.join(tmpdir, "cleanedup")
+            self.rw.setCommand(["/bin/sh", "-c",
+                                "/bin/sh -c 'trap \"sleep 0.2; echo done > " +
+                                marker + "; exit\" TERM; " +
+                                "while :; do sleep 0.05; done' >/dev/null & " +
+                                "echo waiting; wait"])
+            stdout, _, retcode, timedOut = self.rw.timeout(0.3, grace=2)
+            self.assertTrue(timedOut)
+            self.assertTrue(os.path.exists(marker))
+
+            #####
+            # Output from a process that left the group stops being read
+            if os.path.exists("/usr/bin/setsid"):
+                self.rw.setCommand(["/bin/sh", "-c",
+                                    "/usr/bin/setsid /bin/sh -c 'echo $$ > " +
+                                    pidfile + "; while :; do echo x; " +
+                                    "sleep 0.01; done' & sleep 30"])
+                start = time.time()
+                _, _, _, timedOut = self.rw.timeout(0.3, grace=0.3)
+                self.assertTrue(timedOut)
+                self.assertTrue(time.time() - start < 5)
+                with open(pidfile) as pid:
+                    os.kill(int(pid.read()), 9)
+
+            self.rw.setCommand(["/bin/sh", "-c", "echo out; echo err >&2"])
+            self.assertEquals(self.rw.timeout(10),
+                              ("out\n", "err\n", 0, False))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_runShared(self):
+        """
+        """
+        self.rw.__init__(self.logger)
+        #####
+        # One RunWith, many threads, no locking
+        pool = ThreadPool(8)
+        try:
+            results = pool.map(lambda i: self.rw.run(["/bin/sh", "-c",
+                                                      "echo %d; exit %d" %
+                                                      (i, i % 3)]),
+                               range(40))
+        finally:
+            pool.close()
+            pool.join()
+        for i, result in enumerate(results):
+            self.assertEquals(result.getReturns(), (str(i) + "\n", "", i % 3))
+            self.assertEquals(result.ok, i % 3 == 0)
+        self.assertRaises(AttributeError, setattr, results[0], "retcode", 1)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            result = self.rw.run("pwd", cwd=tmpdir)
+            self.assertEquals(os.path.realpath(result.stdout.strip()),
+                              os.path.realpath(tmpdir))
+        finally:
+            shutil.rmtree(tmpdir)
+        result = self.rw.run(["/bin/sh", "-c", "echo slow; sleep 30"],
+                             timeout=0.3)
+        self.assertTrue(result.timedOut)
+        self.assertEquals(result.stdout, "slow\n")
+        self.assertRaises(SetCommandTypeError, self.rw.run, None)
+
+    def test_lazyLogging(self):
+        """
+        """
+        self.rw.__init__(self.logger)
+
+        class Output(object):
+            made = 0
+
+            def __str__(self):
+                Output.made += 1
+                return "output"
+
+        self.rw.setCommand(["/bin/echo", "lazy"])
+        self.assertEquals(self.rw._printcmd, None)
+        self.assertEquals(self.rw.printcmd, "/bin/echo lazy")
+
+        #####
+        # Nothing is built for messages the logger drops
+        level = self.logger.logr.level
+        self.logger.logr.setLevel(lp.CRITICAL)
+        try:
+            self.assertFalse(self.logger.isEnabledFor(lp.INFO))
+            self.rw.stdout = Output()
+            self.rw.getNlogReturns()
+            self.assertEquals(Output.made, 0)
+        finally:
+            self.logger.logr.setLevel(level)
+
+        #####
+        # and output is cut to the preview size for those it keeps
+        messages = []
+        self.logger.log = lambda priority, msg, **kwargs: messages.append(msg)
+        try:
+            self.rw.setLogPreview(10)
+            self.rw.stdout = "x" * 100
+            self.rw.getNlogReturns()
+        finally:
+            del self.logger.log
+        self.assertTrue("Output: " + "x" * 10 + "... (100 bytes)" in messages)
+
     def test_runAs(self):
         """
         """
@@ -164,12 +423,22 @@ class test_run_commands(unittest.TestCase):
     def test_RunThread(self):
         """
         """
-        pass
+        run_thread = RunThread(["/bin/echo", "threaded"], self.logger)
+        run_thread.start()
+        run_thread.join()
+        self.assertFalse(run_thread.isAlive())
+        self.assertEquals(run_thread.getStdout(), "threaded\n")
+        self.assertEquals(run_thread.getStderr(), "")
 
     def test_runMyThreadCommand(self):
         """
         """
-        pass
+        self.assertEquals(runMyThreadCommand("echo out; echo err >&2",
+                                             self.logger),
+                          ("out\n", "err\n"))
+        future = runMyThreadCommand(["/bin/echo", "later"], self.logger,
+                                    wait=False)
+        self.assertEquals(future.result(10).stdout, "later\n")
 
 
 if __name__ == "__main__":
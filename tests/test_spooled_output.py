@@ -0,0 +1,105 @@
+#!/usr/bin/python -u
+"""
+Test of command output that moves to a file past a threshold, on its own
+and through RunWith.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import shutil
+import unittest
+import tempfile
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.spooled_output import SpooledOutput
+from lib.run_commands import RunWith
+
+
+class test_spooled_output(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def setUp(self):
+        """
+        """
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        """
+        shutil.rmtree(self.tmpdir)
+
+    def test_spill(self):
+        """
+        """
+        with SpooledOutput(100, self.tmpdir, previewSize=10) as output:
+            output.write("line 1\n")
+            self.assertFalse(output.spilled)
+            self.assertEquals(output.mmap()[:], "line 1\n")
+            self.assertTrue(output.spilled)
+            self.assertEquals(str(output), "line 1\n")
+
+        with SpooledOutput(100, self.tmpdir, previewSize=10) as output:
+            for i in range(100):
+                output.write("line %d\n" % i)
+            self.assertTrue(output.spilled)
+            #####
+            # The file is unlinked as soon as it is made, find it by its fd
+            path = os.readlink("/proc/self/fd/%d" % output.file.fileno())
+            self.assertTrue(path.startswith(os.path.realpath(self.tmpdir)))
+            self.assertEquals(len(output), len(output.read()))
+            self.assertEquals(list(output)[42], "line 42\n")
+            self.assertEquals(str(output), "line 0\nlin... (" +
+                              str(len(output)) + " bytes)")
+        self.assertEquals(SpooledOutput(10).mmap(), "")
+
+        with SpooledOutput(0, self.tmpdir) as output:
+            self.assertTrue(output.spilled)
+            path = os.readlink("/proc/self/fd/%d" % output.file.fileno())
+            self.assertTrue(path.startswith(os.path.realpath(self.tmpdir)))
+            output.write("x")
+            self.assertEquals(output.read(), "x")
+
+    def test_runWithSpill(self):
+        """
+        """
+        rw = RunWith(self.logger)
+        rw.setSpill(4096, self.tmpdir)
+        result = rw.run(["/bin/sh", "-c",
+                         "seq 1 100000; echo small >&2; exit 3"],
+                        silent=False)
+        try:
+            self.assertEquals(result.retcode, 3)
+            self.assertTrue(result.stdout.spilled)
+            self.assertFalse(result.stderr.spilled)
+            self.assertEquals(result.stderr.read(), "small\n")
+            self.assertEquals(sum(1 for _ in result.stdout), 100000)
+            self.assertTrue(len(str(result.stdout)) < 2048)
+        finally:
+            result.stdout.close()
+            result.stderr.close()
+
+        #####
+        # The legacy API still gives the whole output
+        rw.setCommand(["/bin/sh", "-c", "seq 1 10000"])
+        stdout, _, _ = rw.communicate()
+        self.assertEquals(stdout, rw.getStdout())
+        self.assertEquals(len(stdout.splitlines()), 10000)
+
+        rw.setSpill(None)
+        rw.setCommand(["/bin/echo", "hi"])
+        self.assertEquals(rw.communicate(), ("hi\n", "", 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
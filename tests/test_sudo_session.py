@@ -0,0 +1,134 @@
+#!/usr/bin/python -u
+"""
+Test of running commands with sudo after authenticating once, against a
+stand-in sudo script, so it runs without root or a sudoers entry.
+"""
+from __future__ import absolute_import
+#--- Native python libraries
+import os
+import sys
+import time
+import shutil
+import unittest
+import tempfile
+
+sys.path.append("..")
+
+#--- non-native python libraries in this source tree
+from lib.loggers import CyLogger
+from lib.sudo_session import SudoSession
+
+#####
+# Acts like sudo: -S reads the password, "secret", from stdin, -n fails
+# unless a timestamp file is there, -v only validates and -k removes the
+# timestamp.  A "nocache" file stands in for a policy that never caches.
+# Messages are in English only in the C locale.
+FAKE_SUDO = r'''#!/bin/sh
+dir=$(dirname "$0")
+n=; S=; v=; k=
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -n) n=1 ;;
+        -S) S=1 ;;
+        -v) v=1 ;;
+        -k) k=1 ;;
+        -p|-u) shift ;;
+        --) shift; break ;;
+        -*) ;;
+        *) break ;;
+    esac
+    shift
+done
+echo "${n:+-n }${S:+-S }${v:+-v }${k:+-k }$*" >> "$dir/calls"
+if [ -n "$k" ]; then rm -f "$dir/stamp"; exit 0; fi
+if [ -e "$dir/stamp" ] && [ ! -e "$dir/nocache" ]; then
+    :
+elif [ -n "$S" ]; then
+    read pw
+    [ "$pw" = secret ] || { echo "Sorry, try again." >&2; exit 1; }
+    [ -e "$dir/nocache" ] || touch "$dir/stamp"
+elif [ "$LC_ALL" = C ]; then
+    echo "sudo: a password is required" >&2
+    exit 1
+else
+    echo "sudo: Ein Passwort ist notwendig" >&2
+    exit 1
+fi
+[ -n "$v" ] && exit 0
+exec "$@"
+'''
+
+
+class test_sudo_session(unittest.TestCase):
+    """
+    """
+    @classmethod
+    def setUpClass(self):
+        """
+        """
+        self.logger = CyLogger(debug_mode=True)
+        self.logger.initializeLogs()
+
+    def setUp(self):
+        """
+        """
+        self.tmpdir = tempfile.mkdtemp()
+        self.sudo = os.path.join(self.tmpdir, "sudo")
+        with open(self.sudo, "w") as script:
+            script.write(FAKE_SUDO)
+        os.chmod(self.sudo, 0755)
+
+    def tearDown(self):
+        """
+        """
+        shutil.rmtree(self.tmpdir)
+
+    def calls(self, prefix):
+        """
+        Number of stand-in sudo calls starting with prefix.
+        """
+        with open(os.path.join(self.tmpdir, "calls")) as calls:
+            return len([line for line in calls if line.startswith(prefix)])
+
+    def test_cached(self):
+        """
+        """
+        with SudoSession(self.logger, self.sudo, refresh=0.2) as sudo:
+            self.assertFalse(sudo.authenticate("wrong"))
+            self.assertTrue(sudo.authenticate("secret"))
+            self.assertTrue(sudo.cached)
+            for i in range(5):
+                result = sudo.run(["/bin/echo", str(i)])
+                self.assertEquals(result.getReturns(), (str(i) + "\n", "", 0))
+            self.assertEquals(sudo.run("exit 3").retcode, 3)
+            #####
+            # A command failing with sudo's message isn't lost credentials
+            result = sudo.run("echo 'a password is required' >&2; exit 1")
+            self.assertEquals(result.retcode, 1)
+            self.assertEquals(self.calls("-S"), 2)
+            time.sleep(0.7)
+            self.assertTrue(self.calls("-n -v") >= 3)
+
+            #####
+            # Lost credentials are got back with the kept password
+            os.remove(os.path.join(self.tmpdir, "stamp"))
+            self.assertEquals(sudo.run(["/bin/echo", "again"]).stdout,
+                              "again\n")
+        self.assertEquals(self.calls("-k"), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "stamp")))
+
+    def test_noCaching(self):
+        """
+        """
+        open(os.path.join(self.tmpdir, "nocache"), "w").close()
+        with SudoSession(self.logger, self.sudo) as sudo:
+            self.assertTrue(sudo.authenticate("secret"))
+            self.assertFalse(sudo.cached)
+            for i in range(3):
+                result = sudo.run(["/bin/echo", str(i)], user="nobody")
+                self.assertEquals(result.getReturns(), (str(i) + "\n", "", 0))
+            self.assertEquals(self.calls("-S"), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()